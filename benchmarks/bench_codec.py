@@ -0,0 +1,40 @@
+# 比较不同JSON编解码器解码transcript响应的速度。
+#
+# 用法: python -m benchmarks.bench_codec
+
+import timeit
+
+from benchmarks.fixtures import make_response, make_transcript
+from codypy.codec import CODECS
+from codypy.protocol import Transcript
+
+SIZES = (10_000, 100_000, 1_000_000, 5_000_000)
+
+
+def main() -> None:
+    """
+    对每种可用的编解码器和每种transcript大小，分别测量通用解码和类型化解码的速度。
+    """
+    codecs = []
+    for codec_class in CODECS.values():
+        try:
+            codecs.append(codec_class())
+        except ImportError as exc:
+            print(f"跳过 {codec_class.name}: {exc}")
+
+    for size in SIZES:
+        body = codecs[0].encode(make_response(make_transcript(size)))
+        print(f"transcript {len(body) / 1000:.0f} KB")
+        for codec in codecs:
+            for label, type_ in (("通用", None), ("类型化", Transcript)):
+
+                def decode():
+                    message = codec.decode_message(body)
+                    codec.decode_payload(message.result, type_)
+
+                number, total = timeit.Timer(decode).autorange()
+                print(f"  {codec.name:10s} {label:6s} {number / total:10.1f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
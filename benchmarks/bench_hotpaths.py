@@ -0,0 +1,217 @@
+# 传输层和transcript热点路径的微基准测试。
+#
+# 用法:
+#   python -m benchmarks.bench_hotpaths                  # 运行并与基准线比较
+#   python -m benchmarks.bench_hotpaths --save-baseline  # 运行并保存为新的基准线
+#   python -m benchmarks.bench_hotpaths -k transcript    # 只运行名称包含transcript的测试
+#
+# 存在退化时以退出码1结束，可以在发布前的检查中使用。
+# 基准线与机器相关，仓库中不提供：每台机器第一次使用前先运行--save-baseline，
+# 之后的运行才会与它比较并报告退化。
+
+import argparse
+import asyncio
+import os
+import sys
+from typing import Any, Callable, Dict
+
+import pydantic_core as pd
+
+from benchmarks.fixtures import (
+    make_agent_info,
+    make_frames,
+    make_response,
+    make_transcript,
+)
+from benchmarks.harness import compare, load_baseline, measure, run_sync, save_baseline
+from codypy.client_info import AgentSpecs, ClientCapabilities, ExtensionConfiguration
+from codypy.codec import CODECS, JsonCodec
+from codypy.messaging import (
+    FrameDecoder,
+    _receive_jsonrpc_messages,
+    _send_jsonrpc_request,
+    _show_last_message,
+)
+from codypy.protocol import Transcript
+from codypy.server_info import CodyAgentInfo
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+TRANSCRIPT_SIZES = (10_000, 100_000, 1_000_000, 5_000_000)
+FRAME_COUNT = 64  # 帧解码测试中每次操作解码的帧数
+
+
+class _NullWriter:
+    """
+    丢弃所有数据的写入端，只保留StreamWriter中被编码路径用到的方法。
+    """
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    async def drain(self) -> None:
+        return None
+
+
+def _size_label(size: int) -> str:
+    return f"{size // 1_000_000}MB" if size >= 1_000_000 else f"{size // 1000}KB"
+
+
+def _codecs() -> list[JsonCodec]:
+    """
+    创建所有可用的编解码器，跳过缺少依赖的。
+    """
+    codecs = []
+    for codec_class in CODECS.values():
+        try:
+            codecs.append(codec_class())
+        except ImportError:
+            pass
+    return codecs
+
+
+def build_benchmarks() -> Dict[str, Callable[[], Any]]:
+    """
+    构造所有基准测试，返回按名称索引的无参数函数。
+
+    所有数据在这里一次性生成，计时只包含被测操作本身。
+    """
+    benchmarks: Dict[str, Callable[[], Any]] = {}
+    codecs = _codecs()
+
+    # 帧编码: _send_jsonrpc_request
+    writer = _NullWriter()
+    specs = AgentSpecs(
+        workspaceRootUri="file:///workspace",
+        extensionConfiguration=ExtensionConfiguration(
+            accessToken="sgp_benchmark",
+            codebase="github.com/sourcegraph/cody",
+            customConfiguration={},
+        ),
+        capabilities=ClientCapabilities(chat="streaming"),
+    )
+    submit_params = {
+        "id": "chat-1",
+        "message": {
+            "command": "submit",
+            "text": "x" * 2000,
+            "submitType": "user",
+            "addEnhancedContext": True,
+            "contextFiles": [
+                {"type": "file", "uri": f"/workspace/{i}.py"} for i in range(10)
+            ],
+        },
+    }
+    for codec in codecs:
+        benchmarks[f"frame_encode/initialize/{codec.name}"] = (
+            lambda codec=codec: run_sync(
+                _send_jsonrpc_request(
+                    writer, "initialize", specs.model_dump(), 1, codec
+                )
+            )
+        )
+        benchmarks[f"frame_encode/submit/{codec.name}"] = lambda codec=codec: run_sync(
+            _send_jsonrpc_request(writer, "chat/submitMessage", submit_params, 1, codec)
+        )
+
+    # 帧解码: _receive_jsonrpc_messages逐条读取，以及连接读取循环使用的FrameDecoder
+    for result_bytes in (1_000, 100_000):
+        frames = make_frames(FRAME_COUNT, result_bytes)
+        label = f"{FRAME_COUNT}x{_size_label(result_bytes)}"
+
+        def receive(frames=frames) -> None:
+            reader = asyncio.StreamReader()
+            reader.feed_data(frames)
+            for _ in range(FRAME_COUNT):
+                run_sync(_receive_jsonrpc_messages(reader))
+
+        def decode(frames=frames) -> None:
+            FrameDecoder().feed(frames)
+
+        benchmarks[f"frame_decode/receive/{label}"] = receive
+        benchmarks[f"frame_decode/frame_decoder/{label}"] = decode
+
+    # transcript解析: 完整响应从JSON字节到Transcript
+    for size in TRANSCRIPT_SIZES:
+        body = pd.to_json(make_response(make_transcript(size)))
+        for codec in codecs:
+
+            def parse(codec=codec, body=body) -> Transcript:
+                message = codec.decode_message(body)
+                return codec.decode_payload(message.result, Transcript)
+
+            benchmarks[f"transcript_parse/{_size_label(size)}/{codec.name}"] = parse
+
+    # _show_last_message: 长对话，分别测试是否收集上下文文件
+    transcript = codecs[0].decode_payload(make_transcript(1_000_000), Transcript)
+    for show_context_files in (False, True):
+        benchmarks[f"show_last_message/1MB/context={show_context_files}"] = (
+            lambda show=show_context_files: run_sync(
+                _show_last_message(transcript, show)
+            )
+        )
+
+    # pydantic模型: 初始化请求的序列化和响应的校验
+    agent_info = make_agent_info()
+    benchmarks["models/AgentSpecs.model_dump"] = specs.model_dump
+    benchmarks["models/CodyAgentInfo.model_validate"] = (
+        lambda: CodyAgentInfo.model_validate(agent_info)
+    )
+    return benchmarks
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    运行基准测试，与基准线比较，并按需保存新的基准线。
+
+    返回:
+        int: 存在退化时为1，否则为0。
+    """
+    parser = argparse.ArgumentParser(description="codypy热点路径微基准测试")
+    parser.add_argument(
+        "-k", dest="pattern", default="", help="只运行名称包含该字符串的测试"
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基准线文件的路径")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="把本次结果保存为基准线"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.15, help="视为退化的相对变化"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="计时的重复次数")
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    if not baseline and not args.save_baseline:
+        print(
+            f"没有找到基准线 {args.baseline}，本次运行不会报告退化；"
+            "请先在这台机器上运行 --save-baseline",
+            file=sys.stderr,
+        )
+    results = []
+    regressions = 0
+    for name, func in build_benchmarks().items():
+        if args.pattern not in name:
+            continue
+        result = measure(name, func, repeat=args.repeat)
+        results.append(result)
+        note, regressed = compare(result, baseline.get(name), args.threshold)
+        regressions += regressed
+        print(
+            f"{name:50s} {result.ops_per_sec:12.1f} ops/s "
+            f"{result.peak_bytes / 1024:10.1f} KB峰值 {result.allocations:6d} 块  {note}",
+            flush=True,
+        )
+
+    if args.save_baseline:
+        # 只更新本次运行的测试，保留基准线中其他测试的结果
+        baseline.update({result.name: result for result in results})
+        save_baseline(args.baseline, list(baseline.values()))
+        print(f"基准线已保存到 {args.baseline}")
+    if regressions:
+        print(f"{regressions} 项退化（阈值 {args.threshold:.0%}）")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
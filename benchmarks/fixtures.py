@@ -0,0 +1,141 @@
+# 基准测试使用的可复现数据。
+# 所有数据都由固定的随机种子生成，不同机器、不同运行之间完全一致。
+
+import json
+import random
+import string
+from typing import Any, Dict
+
+SEED = 20240601
+
+
+def _text(rng: random.Random, size: int) -> str:
+    """
+    生成指定长度的伪随机文本，包含空格、换行和少量非ASCII字符，接近真实回答的形状。
+    """
+    alphabet = string.ascii_letters + string.digits + "     \n" + "代码上下文"
+    return "".join(rng.choices(alphabet, k=size))
+
+
+def make_transcript(target_bytes: int, in_progress: bool = False) -> Dict[str, Any]:
+    """
+    生成一个大约为target_bytes字节（JSON编码后）的transcript。
+
+    每轮对话包含一条带上下文文件的人类消息和一条助手回答，
+    轮数随目标大小增长，与长对话中transcript不断变大的情况一致。
+
+    参数:
+        target_bytes (int): 目标大小（字节）。
+        in_progress (bool): 最后一条助手消息是否仍在生成中。
+
+    返回:
+        Dict[str, Any]: transcript字典。
+    """
+    rng = random.Random(SEED + target_bytes)
+    messages = []
+    size = 0
+    turn = 0
+    while size < target_bytes:
+        context_files = [
+            {
+                "type": "file",
+                "uri": {
+                    "$mid": 1,
+                    "fsPath": f"/workspace/src/module_{turn}_{i}.py",
+                    "path": f"/workspace/src/module_{turn}_{i}.py",
+                    "scheme": "file",
+                },
+                "range": {
+                    "start": {"line": rng.randint(0, 200), "character": 0},
+                    "end": {"line": rng.randint(200, 400), "character": 0},
+                },
+                "source": "user",
+            }
+            for i in range(3)
+        ]
+        human = {
+            "speaker": "human",
+            "text": _text(rng, 200),
+            "contextFiles": context_files,
+        }
+        assistant = {
+            "speaker": "assistant",
+            "text": _text(rng, 1500),
+            "model": "anthropic",
+        }
+        messages += (human, assistant)
+        size += len(json.dumps([human, assistant], ensure_ascii=False).encode())
+        turn += 1
+    return {
+        "type": "transcript",
+        "messages": messages,
+        "isMessageInProgress": in_progress,
+        "chatID": "2024-06-01T00:00:00.000Z",
+        "chatTitle": "benchmark",
+    }
+
+
+def make_response(result: Any, message_id: int = 1) -> Dict[str, Any]:
+    """
+    将结果包装为JSON-RPC响应。
+    """
+    return {"jsonrpc": "2.0", "id": message_id, "result": result}
+
+
+def make_agent_info() -> Dict[str, Any]:
+    """
+    生成一个"initialize"结果，字段与真实代理返回的CodyAgentInfo一致。
+    """
+    return {
+        "name": "cody-agent",
+        "authenticated": True,
+        "codyEnabled": True,
+        "codyVersion": "5.5.14",
+        "authStatus": {
+            "endpoint": "https://sourcegraph.com",
+            "isDotCom": True,
+            "isLoggedIn": True,
+            "showInvalidAccessTokenError": False,
+            "authenticated": True,
+            "hasVerifiedEmail": True,
+            "requiresVerifiedEmail": False,
+            "siteHasCodyEnabled": True,
+            "siteVersion": "5.5.0",
+            "userCanUpgrade": False,
+            "username": "benchmark",
+            "primaryEmail": "benchmark@example.com",
+            "displayName": "Benchmark",
+            "avatarURL": "https://example.com/avatar.png",
+            "configOverwrites": {
+                "chatModel": "anthropic/claude-3-sonnet-20240229",
+                "chatModelMaxTokens": 7000,
+                "fastChatModel": "anthropic/claude-3-haiku-20240307",
+                "fastChatModelMaxTokens": 7000,
+                "completionModel": "fireworks/starcoder",
+                "completionModelMaxTokens": 9000,
+                "provider": "sourcegraph",
+            },
+        },
+    }
+
+
+def make_frames(count: int, result_bytes: int) -> bytes:
+    """
+    生成count个连续的Content-Length帧，每个帧是一个结果大约为result_bytes字节的响应。
+
+    参数:
+        count (int): 帧数。
+        result_bytes (int): 每个帧中结果的大致大小（字节）。
+
+    返回:
+        bytes: 拼接后的帧，可以直接送入StreamReader或FrameDecoder。
+    """
+    rng = random.Random(SEED + count + result_bytes)
+    frames = []
+    for message_id in range(1, count + 1):
+        body = json.dumps(
+            make_response({"text": _text(rng, result_bytes)}, message_id),
+            ensure_ascii=False,
+        ).encode()
+        frames.append(f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    return b"".join(frames)
@@ -0,0 +1,162 @@
+# 微基准测试的计时、内存分配统计和基准线比较。
+
+import json
+import os
+import timeit
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Coroutine, Dict
+
+# 内存峰值增长小于该值（字节）时不视为退化，避免很小的操作被tracemalloc的抖动误报
+MIN_MEMORY_REGRESSION = 1024
+
+
+@dataclass(slots=True)
+class BenchmarkResult:
+    """
+    一个基准测试的结果。
+
+    属性:
+        name (str): 基准测试名称
+        ops_per_sec (float): 每秒操作数，取多次重复中最快的一次
+        peak_bytes (int): 单次操作期间Python堆内存的峰值增量（字节）
+        allocations (int): 单次操作结束时仍未释放的内存块数
+    """
+
+    name: str
+    ops_per_sec: float
+    peak_bytes: int
+    allocations: int
+
+
+def run_sync(coroutine: Coroutine) -> Any:
+    """
+    在不经过事件循环的情况下执行一个不会挂起的协程，避免事件循环的调度开销混入计时。
+
+    参数:
+        coroutine (Coroutine): 要执行的协程。
+
+    返回:
+        Any: 协程的返回值。
+
+    异常:
+        RuntimeError: 如果协程挂起（例如在等待I/O）。
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("基准测试中的协程被挂起，无法同步执行")
+
+
+def measure(
+    name: str,
+    func: Callable[[], Any],
+    repeat: int = 5,
+    min_time: float = 0.2,
+) -> BenchmarkResult:
+    """
+    测量一个操作的吞吐量和内存分配。
+
+    计时使用timeit自动确定循环次数，重复repeat次取最快的一次；
+    内存分配在计时之外用tracemalloc单独测量一次，因此不会拖慢计时。
+
+    参数:
+        name (str): 基准测试名称。
+        func (Callable): 要测量的操作。
+        repeat (int): 计时的重复次数。
+        min_time (float): 每次重复至少持续的时间（秒）。
+
+    返回:
+        BenchmarkResult: 测量结果。
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    func()  # 预热，排除首次调用时的缓存和惰性初始化
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        del result
+    finally:
+        tracemalloc.stop()
+    allocations = sum(
+        stat.count_diff
+        for stat in after.compare_to(before, "filename")
+        if stat.count_diff > 0
+    )
+    return BenchmarkResult(name, 1 / best, peak - start, allocations)
+
+
+def load_baseline(path: str) -> Dict[str, BenchmarkResult]:
+    """
+    读取保存的基准线，文件不存在时返回空字典。
+
+    参数:
+        path (str): 基准线文件的路径。
+
+    返回:
+        Dict[str, BenchmarkResult]: 按名称索引的结果。
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    return {name: BenchmarkResult(name=name, **values) for name, values in data.items()}
+
+
+def save_baseline(path: str, results: list[BenchmarkResult]) -> None:
+    """
+    把结果保存为基准线。
+
+    参数:
+        path (str): 基准线文件的路径。
+        results (list[BenchmarkResult]): 要保存的结果。
+    """
+    data = {}
+    for result in results:
+        values = asdict(result)
+        del values["name"]
+        data[result.name] = values
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2, ensure_ascii=False)
+        file.write("\n")
+
+
+def compare(
+    result: BenchmarkResult,
+    baseline: BenchmarkResult | None,
+    threshold: float,
+) -> tuple[str, bool]:
+    """
+    把一个结果与基准线比较。
+
+    吞吐量下降或内存峰值增长超过threshold（相对比例）时视为退化，
+    内存峰值的增长还必须超过MIN_MEMORY_REGRESSION字节。
+
+    参数:
+        result (BenchmarkResult): 本次结果。
+        baseline (BenchmarkResult | None): 基准线中的结果，没有时不比较。
+        threshold (float): 允许的相对变化，例如0.1表示10%。
+
+    返回:
+        tuple[str, bool]: 用于显示的变化描述，以及是否退化。
+    """
+    if baseline is None:
+        return "（无基准线）", False
+    speed = result.ops_per_sec / baseline.ops_per_sec - 1
+    growth = result.peak_bytes - baseline.peak_bytes
+    memory = growth / max(baseline.peak_bytes, 1)
+    regressed = speed < -threshold or (
+        memory > threshold and growth > MIN_MEMORY_REGRESSION
+    )
+    note = f"速度 {speed:+.1%}  内存 {memory:+.1%}"
+    return (note + "  退化" if regressed else note), regressed
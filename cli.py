@@ -1,9 +1,11 @@
 import argparse
 import asyncio
 import os
+import sys
 
-from codypy import CodyServer, CodyAgent
-from codypy.client_info import AgentSpecs
+from codypy import CodyAgent, CodyServer
+from codypy.client_info import AgentSpecs, ClientCapabilities
+from codypy.daemon import DaemonClient, is_daemon_running, run_daemon
 
 
 async def async_main():
@@ -12,28 +14,29 @@ async def async_main():
     """
     # 创建命令行参数解析器
     parser = argparse.ArgumentParser(description="Cody Agent Python CLI")
-    parser.add_argument("chat", help="初始化聊天对话")
+    parser.add_argument(
+        "command",
+        choices=["chat", "daemon"],
+        help="chat: 发送一条聊天消息；daemon: 启动常驻的本地代理守护进程",
+    )
     parser.add_argument(
         "--binary_path",
         type=str,
-        required=True,
         default=os.getenv("BINARY_PATH"),
-        help="Cody CLI 二进制文件的路径。（必需）",
+        help="Cody CLI 二进制文件的路径。（使用守护进程时不需要）",
     )
 
     parser.add_argument(
         "--access_token",
         type=str,
-        required=True,
         default=os.getenv("SRC_ACCESS_TOKEN"),
-        help="Sourcegraph 访问令牌。（需要导出为 SRC_ACCESS_TOKEN 环境变量）（必需）",
+        help="Sourcegraph 访问令牌。（需要导出为 SRC_ACCESS_TOKEN 环境变量）（使用守护进程时不需要）",
     )
     parser.add_argument(
         "-m",
         "--message",
         type=str,
-        required=True,
-        help="要发送的聊天消息。（必需）",
+        help="要发送的聊天消息。（chat 必需）",
     )
     parser.add_argument(
         "--workspace_root_uri",
@@ -57,51 +60,140 @@ async def async_main():
         help="显示从消息中推断的上下文文件（如果有）。默认值=True",
     )
 
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help="守护进程的 Unix 套接字路径。默认值由 CODYPY_DAEMON_SOCKET 或运行时目录决定",
+    )
+    parser.add_argument(
+        "--agents",
+        type=int,
+        default=1,
+        help="守护进程启动的代理进程数。默认值=1",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="即使守护进程正在运行，也启动一个新的代理",
+    )
+
     # 解析命令行参数
     args = parser.parse_args()
+    if args.command == "chat" and not args.message:
+        parser.error("chat 需要 --message")
+
+    # 守护进程正在运行时直接交给它处理，不必启动和认证新的代理
+    if (
+        args.command == "chat"
+        and not args.no_daemon
+        and await is_daemon_running(args.socket)
+    ):
+        if await chat_via_daemon(args):
+            return
+
+    if not args.binary_path or not args.access_token:
+        parser.error(
+            "需要 --binary_path 和 --access_token（或 BINARY_PATH 和 SRC_ACCESS_TOKEN 环境变量）"
+        )
+    if args.command == "daemon":
+        await run_daemon(
+            _agent_specs(args),
+            args.binary_path,
+            agents=args.agents,
+            socket_path=args.socket,
+        )
+        return
     # 调用聊天函数
     await chat(args)
 
 
-async def chat(args):
+def _agent_specs(args) -> AgentSpecs:
     """
-    处理聊天逻辑的异步函数。
+    根据命令行参数创建代理规格。
 
     参数:
     args: 包含命令行参数的对象
     """
-    # 初始化 CodyServer
-    cody_server: CodyServer = await CodyServer.init(
-        cody_binary_file=args.binary_path,
-        version="5.5.14",
-    )
     # 创建 AgentSpecs 实例，指定工作空间根 URI 和扩展配置
-    agent_specs = AgentSpecs(
+    return AgentSpecs(
         workspaceRootUri=args.workspace_root_uri,
         extensionConfiguration={
             "accessToken": args.access_token,
             "codebase": "",  # 可以设置为特定的代码库，例如 "github.com/sourcegraph/cody"
             "customConfiguration": {},
         },
+        # 启用流式聊天，代理会在生成回答的过程中推送进行中的 transcript
+        capabilities=ClientCapabilities(chat="streaming"),
     )
-    # 初始化 CodyAgent
-    cody_agent: CodyAgent = await cody_server.initialize_agent(agent_specs=agent_specs)
 
-    # 创建新的聊天会话
-    await cody_agent.new_chat()
 
-    # 发送聊天消息并获取响应
-    response = await cody_agent.chat(
-        message=args.message,
-        enhanced_context=args.ec,
-        show_context_files=args.sc,
-    )
-    if response == "":
-        return
-    print("response="+response)
+async def chat_via_daemon(args) -> bool:
+    """
+    通过正在运行的守护进程发送聊天消息。
+
+    参数:
+    args: 包含命令行参数的对象
 
-    # 清理服务器资源
-    await cody_server.cleanup_server()
+    返回:
+    bool: 守护进程处理了这条消息时为 True；守护进程服务于其他工作目录或访问令牌时为 False
+    """
+    client = await DaemonClient.connect(args.socket)
+    try:
+        if not await client.serves(args.workspace_root_uri, args.access_token):
+            print(
+                "守护进程服务于其他工作目录或访问令牌，改为直接启动代理",
+                file=sys.stderr,
+            )
+            return False
+        print("response=", end="", flush=True)
+        async for delta in client.chat_stream(
+            message=args.message,
+            enhanced_context=args.enhanced_context,
+            show_context_files=args.show_context,
+            workspace_root_uri=args.workspace_root_uri,
+            access_token=args.access_token,
+        ):
+            print(delta, end="", flush=True)
+        print()
+        for context_file in client.last_context_files:
+            print(f"context={context_file}")
+    finally:
+        await client.close()
+    return True
+
+
+async def chat(args):
+    """
+    处理聊天逻辑的异步函数。
+
+    参数:
+    args: 包含命令行参数的对象
+    """
+    # 初始化 CodyServer，退出时在有限的时间内关闭代理
+    async with await CodyServer.init(
+        cody_binary_file=args.binary_path,
+        version="5.5.14",
+    ) as cody_server:
+        agent_specs = _agent_specs(args)
+        # 初始化 CodyAgent
+        cody_agent = CodyAgent(cody_server=cody_server, agent_specs=agent_specs)
+        await cody_agent.initialize_agent()
+
+        # 创建新的聊天会话
+        await cody_agent.new_chat()
+
+        # 发送聊天消息，并在回答生成时逐段打印
+        print("response=", end="", flush=True)
+        async for delta in cody_agent.chat_stream(
+            message=args.message,
+            enhanced_context=args.enhanced_context,
+            show_context_files=args.show_context,
+        ):
+            print(delta, end="", flush=True)
+        print()
+        for context_file in cody_agent.last_context_files:
+            print(f"context={context_file}")
     return None
 
 
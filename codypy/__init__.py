@@ -1,4 +1,7 @@
 from .agent import CodyAgent
+from .agent_log import AgentLog, AgentLogOptions
+from .batch import BatchResult, chat_many
+from .cache import ResponseCache
 from .client_info import (
     AgentSpecs,
     ClientCapabilities,
@@ -20,12 +23,50 @@ from .config import (
     get_configs,
 )
 from .context import append_paths
+from .model_catalog import ModelCatalog
+from .pool import CodyServerPool, LoadBalancing
+from .ratelimit import AdaptiveConcurrency, RateLimiter, RateLimits, TokenBucket
+from .repo_ids import RepoIdCache
+from .resources import ProcessSample, ResourceLimits, ResourceMonitor, sample_process
 from .server import CodyServer
 from .server_info import AuthStatus, CodyAgentInfo, CodyLLMSiteConfiguration
+from .session import ChatSession
+from .supervisor import AgentSupervisor, SupervisorState
+from .transcript_index import TranscriptIndex
+from .transport import AgentTransport, StdioTransport, TcpTransport, UnixSocketTransport
+from .warm import WarmAgent, WarmSpares, spawn_agent
 
 __all__ = [
     "CodyAgent",
+    "ChatSession",
+    "TranscriptIndex",
+    "AgentLog",
+    "AgentLogOptions",
+    "ResponseCache",
+    "BatchResult",
+    "chat_many",
+    "RepoIdCache",
+    "ModelCatalog",
+    "RateLimiter",
+    "RateLimits",
+    "TokenBucket",
+    "AdaptiveConcurrency",
     "CodyServer",
+    "CodyServerPool",
+    "LoadBalancing",
+    "ProcessSample",
+    "ResourceLimits",
+    "ResourceMonitor",
+    "sample_process",
+    "AgentSupervisor",
+    "SupervisorState",
+    "WarmAgent",
+    "WarmSpares",
+    "spawn_agent",
+    "AgentTransport",
+    "StdioTransport",
+    "TcpTransport",
+    "UnixSocketTransport",
     "Configs",
     "get_configs",
     "ClientCapabilities",
@@ -1,12 +1,22 @@
 import logging
-from typing import Any
+import weakref
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
 
+from codypy.batch import BatchResult, chat_many
+from codypy.cache import ResponseCache
 from codypy.client_info import AgentSpecs, Models
-from codypy.exceptions import AgentAuthenticationError
-from codypy.messaging import _show_last_message, request_response
+from codypy.exceptions import AgentAuthenticationError, CodyPyError
+from codypy.model_catalog import ModelCatalog
+from codypy.protocol import ModelList, RepoId
+from codypy.ratelimit import RateLimiter
+from codypy.repo_ids import RepoIdCache
 from codypy.server import CodyServer
 from codypy.server_info import CodyAgentInfo
 
+# EXIT_COMMANDS 定义在 session 模块中，保留从这里导入的方式
+from codypy.session import EXIT_COMMANDS, ChatSession  # noqa: F401
+from codypy.transcript_index import TranscriptIndex
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,14 +24,21 @@ class CodyAgent:
     """
     CodyAgent 类代表一个 Cody AI 代理。
     
-    这个类负责与 Cody 服务器进行交互，管理聊天会话，处理代码仓库上下文，
-    以及执行各种与 AI 代理相关的操作。
+    这个类负责与 Cody 服务器进行交互，初始化代理，并创建聊天会话（ChatSession）。
+    一个代理可以同时拥有多个聊天会话，它们共享同一个代理进程；仓库 ID 缓存默认在进程内所有代理之间共享。
+
+    为了兼容只使用一个会话的代码，new_chat 创建的会话同时成为代理的默认会话，
+    代理上的 chat、chat_stream、set_model 和 set_context_repo 作用于默认会话。
     """
 
     def __init__(
         self,
         cody_server: CodyServer,
         agent_specs: AgentSpecs,
+        response_cache: ResponseCache | None = None,
+        repo_id_cache: RepoIdCache | None = None,
+        model_catalog: ModelCatalog | None = None,
+        rate_limiter: RateLimiter | None = None,
     ) -> None:
         """
         初始化 CodyAgent 实例。
@@ -29,12 +46,22 @@ class CodyAgent:
         参数:
             cody_server (CodyServer): Cody 服务器实例。
             agent_specs (AgentSpecs): 代理规格，包含代理的配置信息。
+            response_cache (ResponseCache, optional): 回答缓存，为 None 时不缓存。多个代理可以共享同一个缓存。
+            repo_id_cache (RepoIdCache, optional): 仓库 ID 缓存，默认为进程内共享的 RepoIdCache.shared()。
+            model_catalog (ModelCatalog, optional): 模型列表缓存，默认为进程内共享的 ModelCatalog.shared()。
+            rate_limiter (RateLimiter, optional): 聊天请求的限速器，为 None 时不限速。同一账户的代理应共享同一个限速器。
         """
         self._cody_server = cody_server
-        self.chat_id: str | None = None  # 当前聊天会话的 ID
-        self.repos: dict = {}  # 缓存仓库信息的字典
-        self.current_repo_context: list[str] = []  # 当前使用的仓库上下文
+        self.repo_id_cache = repo_id_cache or RepoIdCache.shared()  # 仓库 ID 缓存
+        self.model_catalog = model_catalog or ModelCatalog.shared()  # 按账户缓存的模型
+        self.rate_limiter = rate_limiter  # 聊天请求的限速器
         self.agent_specs = agent_specs
+        self.response_cache = response_cache  # 这个代理所有会话使用的回答缓存
+        self._sessions: weakref.WeakSet = weakref.WeakSet()  # 这个代理创建的聊天会话
+        self._session: ChatSession | None = None  # new_chat 最近创建的默认会话
+        self._owns_server = False  # 是否由这个代理初始化了 Cody 服务器
+        # 会话发送请求之前等待的条件，例如监督器的 wait_ready，为 None 时不等待
+        self.ready_gate: Callable[[], Awaitable[None]] | None = None
 
     async def initialize_agent(self) -> None:
         """
@@ -62,137 +89,141 @@ class CodyAgent:
             if not cody_agent_info.authenticated:
                 await self._cody_server.cleanup_server()
                 raise AgentAuthenticationError("CodyAgent 未经认证")
+            self._owns_server = True
             logger.info("CodyAgent 初始化成功")
 
-        response = await request_response(
+        response = await self._cody_server.connection.request(
             "initialize",
             self.agent_specs.model_dump(),
-            self._cody_server._reader,
-            self._cody_server._writer,
         )
 
         await _handle_response(response)
 
-    async def new_chat(self):
+    async def wait_ready(self) -> None:
         """
-        创建一个新的聊天会话。
+        等待代理可以接受会话的请求。
 
-        这个方法向 Cody 代理服务器发送一个创建新聊天会话的请求，
-        并将返回的会话 ID 保存在实例变量中。
+        被 AgentSupervisor 监督时，代理重启、重新初始化和恢复会话期间会一直等待，
+        因此这期间发起的请求会发往恢复后的聊天，而不是已经失效的聊天 ID。
         """
+        if self.ready_gate is not None:
+            await self.ready_gate()
 
-        response = await request_response(
-            "chat/new",
-            None,
-            self._cody_server._reader,
-            self._cody_server._writer,
-        )
-
-        logger.info("新的聊天会话 %s 已创建", response)
-        self.chat_id = response
+    async def close(self) -> None:
+        """
+        关闭代理。
 
-    async def _lookup_repo_ids(self, repos: list[str]) -> list[dict]:
+        如果这个代理通过 initialize_agent 初始化了 Cody 服务器，会在有限的时间内优雅地关闭服务器；
+        绑定在共享服务器上、没有初始化它的代理只放弃自己的聊天会话，服务器继续为其他会话服务。
         """
-        查找仓库对象的 ID。
+        if self._owns_server:
+            await self._cody_server.cleanup_server()
+            self._owns_server = False
+        for session in list(self._sessions):
+            session.close()
 
-        这个方法通过仓库名称查找对应的仓库对象。结果会被缓存在 self.repos 字典中，
-        以避免在更改上下文时进行额外的查找。
+    async def __aenter__(self) -> "CodyAgent":
+        return self
 
-        参数:
-            repos (list[str]): 需要查找的仓库名称列表。
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
 
-        返回:
-            list[dict]: 包含仓库信息的字典列表。
+    async def new_chat(self, context_files: list | None = None) -> ChatSession:
         """
+        创建一个新的聊天会话，并把它作为代理的默认会话。
 
-        if repos_to_lookup := [x for x in repos if x not in self.repos]:
-            response = await request_response(
-                "graphql/getRepoIds",
-                {"names": repos_to_lookup, "first": len(repos_to_lookup)},
-                self._cody_server._reader,
-                self._cody_server._writer,
-            )
-
-            for repo in response["repos"]:
-                self.repos[repo["name"]] = repo
-            for repo in repos:
-                if repo not in self.repos:
-                    self.repos[repo] = None
-
-        return [self.repos[x] for x in repos if self.repos[x]]
+        参数:
+            context_files (list, optional): 这个会话每条消息都附带的上下文文件，例如 append_paths 的结果。
 
-    async def set_context_repo(self, repos: list[str]) -> None:
+        返回:
+            ChatSession: 新的聊天会话。
+        """
+        session = await ChatSession.create(self, context_files)
+        self._session = session
+        return session
+
+    @property
+    def sessions(self) -> list[ChatSession]:
+        """这个代理创建的、仍在使用的聊天会话。"""
+        return list(self._sessions)
+
+    @property
+    def chat_id(self) -> str | None:
+        """默认会话的 ID，还没有调用 new_chat 时为 None。"""
+        return self._session.chat_id if self._session is not None else None
+
+    @property
+    def current_repo_context(self) -> list[str]:
+        """默认会话当前使用的仓库上下文。"""
+        return self._session.current_repo_context if self._session is not None else []
+
+    @property
+    def current_model(self) -> Models | None:
+        """默认会话通过 set_model 设置的模型。"""
+        return self._session.current_model if self._session is not None else None
+
+    @property
+    def last_context_files(self) -> list[str]:
+        """默认会话最近一次回答推断出的上下文文件。"""
+        return self._session.last_context_files if self._session is not None else []
+
+    @property
+    def transcript_index(self) -> TranscriptIndex | None:
+        """默认会话的 transcript 索引，可以按轮次或对整个对话查询上下文文件。"""
+        return self._session.transcript_index if self._session is not None else None
+
+    def _default_session(self) -> ChatSession:
         """
-        设置用作上下文的仓库。
+        返回默认会话。
 
-        这个方法更新当前的仓库上下文，并将选定的仓库配置为聊天上下文。
+        异常:
+            CodyPyError: 如果还没有调用 new_chat。
+        """
+        if self._session is None:
+            raise CodyPyError("还没有聊天会话，请先调用 new_chat")
+        return self._session
 
-        参数:
-            repos (list[str]): 应该用作聊天上下文的仓库名称列表。
+    async def _lookup_repo_ids(self, repos: list[str]) -> list[RepoId]:
         """
+        查找仓库对象的 ID。
 
-        if self.current_repo_context == repos:
-            return
+        这个方法通过仓库名称查找对应的仓库对象。结果保存在 repo_id_cache 中，默认由进程内所有代理共享，
+        并发的相同查询只发送一次，同一时刻的多个查询合并为一个请求，见 RepoIdCache。
 
-        self.current_repo_context = repos
+        参数:
+            repos (list[str]): 需要查找的仓库名称列表。
 
-        repo_objects = await self._lookup_repo_ids(repos=repos)
+        返回:
+            list[RepoId]: 找到的仓库的名称和 ID。
+        """
+        return await self.repo_id_cache.lookup(self, repos)
 
-        command = {
-            "id": self.chat_id,
-            "message": {
-                "command": "context/choose-remote-search-repo",
-                "explicitRepos": repo_objects,
-            },
-        }
-        await request_response(
-            "webview/receiveMessage",
-            command,
-            self._cody_server._reader,
-            self._cody_server._writer,
-        )
+    async def set_context_repo(self, repos: list[str]) -> None:
+        """
+        设置默认会话用作上下文的仓库，见 ChatSession.set_context_repo。
+        """
+        await self._default_session().set_context_repo(repos)
 
-    async def get_models(self, model_type: str) -> Any:
+    async def get_models(self, model_type: str, refresh: bool = False) -> ModelList:
         """
         获取指定类型的可用模型。
 
+        结果按账户缓存在 model_catalog 中，有效期内不再发送 "chat/models" 请求，见 ModelCatalog。
+
         参数:
             model_type (str): 模型类型，可以是 "chat" 或 "edit"。
+            refresh (bool, optional): 是否忽略缓存重新获取。默认为 False。
 
         返回:
-            Any: "chat/models" 请求的结果。
+            ModelList: "chat/models" 请求的结果。
         """
-
-        model = {"modelUsage": f"{model_type}"}
-        return await request_response(
-            "chat/models",
-            model,
-            self._cody_server._reader,
-            self._cody_server._writer,
-        )
+        return await self.model_catalog.models(self, model_type, refresh)
 
     async def set_model(self, model: Models = Models.Claude3Sonnet) -> Any:
         """
-        设置聊天会话使用的模型。
-
-        参数:
-            model (Models): 要使用的模型。默认为 Models.Claude3Sonnet。
-
-        返回:
-            Any: "webview/receiveMessage" 请求的结果。
+        设置默认会话使用的模型，见 ChatSession.set_model。
         """
-
-        command = {
-            "id": f"{self.chat_id}",
-            "message": {"command": "chatModel", "model": f"{model.value.model_id}"},
-        }
-
-        return await request_response(
-            "webview/receiveMessage",
-            command,
-            self._cody_server._reader,
-            self._cody_server._writer,
-        )
+        return await self._default_session().set_model(model)
 
     async def chat(
         self,
@@ -202,50 +233,47 @@ class CodyAgent:
         context_files=None,
     ):
         """
-        向 Cody 服务器发送聊天消息并返回响应。
+        向默认会话发送聊天消息并返回响应，见 ChatSession.chat。
+        """
+        return await self._default_session().chat(
+            message, enhanced_context, show_context_files, context_files
+        )
+
+    async def chat_stream(
+        self,
+        message,
+        enhanced_context: bool = False,
+        show_context_files: bool = False,
+        context_files=None,
+    ) -> AsyncIterator[str]:
+        """
+        向默认会话发送聊天消息，并在回答生成过程中逐段产出新增的文本，见 ChatSession.chat_stream。
+        """
+        async for delta in self._default_session().chat_stream(
+            message, enhanced_context, show_context_files, context_files
+        ):
+            yield delta
+
+    def chat_many(
+        self,
+        prompts: Iterable[str] | AsyncIterable[str],
+        concurrency: int = 8,
+        **options: Any,
+    ) -> AsyncIterator[BatchResult]:
+        """
+        在这个代理上以有限的并发发送大量互相独立的提示，每个提示使用一个新的聊天会话，见 codypy.batch.chat_many。
 
         参数:
-            message (str): 要发送给 Cody 服务器的消息。
-            enhanced_context (bool, optional): 是否在聊天消息请求中包含增强上下文。默认为 False。
-            show_context_files (bool, optional): 是否显示上下文文件。默认为 False。
-            context_files (list, optional): 上下文文件列表。默认为 None。
+            prompts (Iterable[str] | AsyncIterable[str]): 提示。
+            concurrency (int, optional): 同时进行的提示数。默认为 8。
+            options: 传给 chat_many 的其他参数，例如 ordered、retries 和 results_file。
 
         返回:
-            tuple: 包含响应文本和上下文文件的元组。
-        """
-        if context_files is None:
-            context_files = []
-        if message in ["/quit", "/bye", "/exit"]:
-            logger.debug("用户输入了退出命令，返回空响应")
-            return "", []
-
-        chat_message_request = {
-            "id": f"{self.chat_id}",
-            "message": {
-                "command": "submit",
-                "text": message,
-                "submitType": "user",
-                "addEnhancedContext": enhanced_context,
-                "contextFiles": context_files,
-            },
-        }
-        logger.debug(f"准备发送聊天消息请求：{chat_message_request}")
-
-        result = await request_response(
-            "chat/submitMessage",
-            chat_message_request,
-            self._cody_server._reader,
-            self._cody_server._writer,
-        )
-        logger.debug(f"收到聊天消息响应：{result}")
-
-        (speaker, response, context_files_response) = await _show_last_message(
-            result,
-            show_context_files,
+            AsyncIterator[BatchResult]: 每个提示的结果。
+        """
+        return chat_many(
+            prompts,
+            lambda context_files: ChatSession.create(self, context_files),
+            concurrency=concurrency,
+            **options,
         )
-        logger.debug(f"解析响应结果：speaker={speaker}, response长度={len(response)}, context_files_response长度={len(context_files_response)}")
-        if speaker == "" or response == "":
-            logger.error("提交聊天消息失败: %s", result)
-            return None
-        logger.debug("成功获取聊天响应，准备返回结果")
-        return (response, context_files_response)
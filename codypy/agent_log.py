@@ -0,0 +1,369 @@
+import asyncio
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import time
+from asyncio.subprocess import Process
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Set
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 代理输出写入的日志记录器，调用方可以单独调整它的级别
+stderr_logger = logging.getLogger("codypy.agent.stderr")
+
+# 默认的共享日志文件
+DEFAULT_LOG_FILE = "log/cody_agent.log"
+
+# 每次从管道读取的字节数
+READ_CHUNK = 64 * 1024
+
+# 等待输出读取任务在进程退出后读完剩余输出的时间（秒）
+DRAIN_TIMEOUT = 1.0
+
+# 行首的日志级别标记，例如"ERROR ..."、"[warn] ..."或"debug: ..."
+_LEVEL_PATTERN = re.compile(
+    r"^\W{0,3}(TRACE|DEBUG|INFO|WARN|WARNING|ERROR|FATAL|CRITICAL)\b",
+    re.IGNORECASE,
+)
+_LEVELS = {
+    "TRACE": logging.DEBUG,
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARN": logging.WARNING,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "FATAL": logging.CRITICAL,
+    "CRITICAL": logging.CRITICAL,
+}
+
+
+@dataclass
+class AgentLogOptions:
+    """
+    代理进程输出（标准错误，以及网络传输下的标准输出）的处理方式。
+
+    属性:
+        log_file (str | None): 共享的日志文件，路径相同的所有代理进程写入同一组文件，为None时不写文件
+        max_bytes (int): 单个日志文件的大小上限（字节），超过后轮转
+        backup_count (int): 保留的轮转文件数
+        to_logging (bool): 是否把输出行发送到logging的"codypy.agent.stderr"记录器
+        default_level (int): 无法从行首识别级别时使用的日志级别
+        rate_limit (float): 每秒最多处理的警告以下级别的行数，超出的行只进入环形缓冲区，为0时不限
+        burst (int): 限流允许的突发行数
+        ring_buffer_bytes (int): 在内存中保留的最近输出的字节数，用于崩溃时转储，为0时不保留
+        max_line_bytes (int): 单行的长度上限（字节），超出部分被截断
+    """
+
+    log_file: str | None = DEFAULT_LOG_FILE
+    max_bytes: int = 10 * 1024 * 1024
+    backup_count: int = 3
+    to_logging: bool = True
+    default_level: int = logging.DEBUG
+    rate_limit: float = 200.0
+    burst: int = 1000
+    ring_buffer_bytes: int = 64 * 1024
+    max_line_bytes: int = 8 * 1024
+
+
+class SharedLogFile:
+    """
+    多个代理进程共享的轮转日志文件。
+
+    写入通过QueueHandler交给后台线程中的RotatingFileHandler，事件循环不会因为磁盘IO阻塞。
+    同一路径只会有一个实例，用shared_log_file获取。
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int) -> None:
+        """
+        参数:
+        path (str): 日志文件路径
+        max_bytes (int): 单个文件的大小上限（字节）
+        backup_count (int): 保留的轮转文件数
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        file_handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+        file_handler.setFormatter(
+            logging.Formatter("%(asctime)s [%(agent_pid)s] %(levelname)s %(message)s")
+        )
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._handler = logging.handlers.QueueHandler(self._queue)
+        self._listener = logging.handlers.QueueListener(self._queue, file_handler)
+        self._listener.start()
+        self._closed = False
+
+    def write(self, record: logging.LogRecord) -> None:
+        """
+        把一条记录交给后台线程写入文件。
+        """
+        if not self._closed:
+            self._handler.handle(record)
+
+    def close(self) -> None:
+        """
+        写完队列中的记录并关闭文件。
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+
+
+_shared_files: Dict[str, SharedLogFile] = {}
+
+
+def shared_log_file(path: str, max_bytes: int, backup_count: int) -> SharedLogFile:
+    """
+    获取路径对应的共享日志文件，第一次使用时创建。
+
+    轮转参数以第一次创建时为准。
+
+    参数:
+    path (str): 日志文件路径
+    max_bytes (int): 单个文件的大小上限（字节）
+    backup_count (int): 保留的轮转文件数
+
+    返回:
+    SharedLogFile: 共享的日志文件
+    """
+    key = os.path.abspath(path)
+    if (log_file := _shared_files.get(key)) is None:
+        log_file = _shared_files[key] = SharedLogFile(path, max_bytes, backup_count)
+    return log_file
+
+
+@atexit.register
+def close_log_files() -> None:
+    """
+    关闭所有共享日志文件，进程退出时自动调用。
+    """
+    for log_file in _shared_files.values():
+        log_file.close()
+    _shared_files.clear()
+
+
+def parse_level(line: str, default: int) -> int | None:
+    """
+    从行首识别日志级别。
+
+    参数:
+    line (str): 一行输出
+    default (int): 无法识别时使用的级别
+
+    返回:
+    int | None: 日志级别；以空白开头的续行（例如堆栈）返回None，表示沿用上一行的级别
+    """
+    if line[:1].isspace():
+        return None
+    if match := _LEVEL_PATTERN.match(line):
+        return _LEVELS[match.group(1).upper()]
+    return default
+
+
+class AgentLog:
+    """
+    异步读取代理进程的输出，并把每一行发送到共享日志文件和logging。
+
+    输出通过管道由后台任务读取，不再为每个进程打开一个日志文件。
+    每行的级别从行首识别，按令牌桶限流，被限流的行会被计数并在恢复时报告。
+    所有行（包括被限流的）都进入固定大小的环形缓冲区，代理崩溃时可以用tail()取得最后的输出。
+
+    一个CodyServer在多次重启之间使用同一个AgentLog，因此环形缓冲区跨越重启保留。
+    """
+
+    def __init__(self, options: AgentLogOptions | None = None) -> None:
+        """
+        初始化AgentLog实例。
+
+        参数:
+        options (AgentLogOptions | None): 输出的处理方式，默认为AgentLogOptions()
+        """
+        self.options = options or AgentLogOptions()
+        self._file: SharedLogFile | None = None
+        if self.options.log_file is not None:
+            self._file = shared_log_file(
+                self.options.log_file, self.options.max_bytes, self.options.backup_count
+            )
+        self._ring: Deque[str] = deque()
+        self._ring_bytes = 0
+        self._tokens = float(self.options.burst)
+        self._refilled_at = time.monotonic()
+        self._suppressed = 0
+        self._last_level = self.options.default_level
+        self._readers: Set[asyncio.Task] = set()
+        self.pid: int | None = None  # 当前代理进程的PID
+        self.lines: int = 0  # 读取的总行数
+        self.bytes: int = 0  # 读取的总字节数
+        self.dropped: int = 0  # 被限流丢弃的行数
+        self.levels: Counter = Counter()  # 按级别统计的行数
+
+    def attach(self, process: Process, read_stdout: bool = False) -> None:
+        """
+        开始读取一个代理进程的输出。
+
+        参数:
+        process (Process): 以管道方式创建标准错误的代理进程
+        read_stdout (bool): 是否同时读取标准输出。stdio传输下标准输出承载JSON-RPC消息，由连接读取
+        """
+        self.pid = process.pid
+        self._remember(f"--- 代理进程 {process.pid} 已启动 ---")
+        streams = [process.stderr, process.stdout if read_stdout else None]
+        for stream in streams:
+            if stream is None:
+                continue
+            task = asyncio.create_task(self._read(stream, process.pid))
+            self._readers.add(task)
+            task.add_done_callback(self._readers.discard)
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """
+        等待读取任务读完已退出进程的剩余输出，超时后取消它们。
+
+        参数:
+        timeout (float): 最长等待时间（秒）
+        """
+        readers = list(self._readers)
+        if not readers:
+            return
+        _, pending = await asyncio.wait(readers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _read(self, stream: asyncio.StreamReader, pid: int) -> None:
+        """
+        按块读取输出并按行处理，直到EOF。
+        """
+        pending = b""
+        limit = self.options.max_line_bytes
+        while chunk := await stream.read(READ_CHUNK):
+            self.bytes += len(chunk)
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            if len(pending) > limit:
+                # 没有换行的超长输出，截断后作为一行处理
+                lines.append(pending)
+                pending = b""
+            for line in lines:
+                self._handle(line[:limit], pid)
+        if pending:
+            self._handle(pending[:limit], pid)
+        self._report_suppressed(pid)
+
+    def _handle(self, raw: bytes, pid: int) -> None:
+        """
+        处理一行输出。
+        """
+        line = raw.decode("utf-8", errors="replace").rstrip("\r")
+        if not line:
+            return
+        self.lines += 1
+        self._remember(line)
+        level = parse_level(line, self.options.default_level)
+        if level is None:
+            level = self._last_level
+        self._last_level = level
+        self.levels[logging.getLevelName(level)] += 1
+        # 警告及以上的行不受限流影响
+        if level < logging.WARNING and not self._allow():
+            self.dropped += 1
+            self._suppressed += 1
+            return
+        self._report_suppressed(pid)
+        self._emit(level, line, pid)
+
+    def _report_suppressed(self, pid: int) -> None:
+        """
+        报告自上次报告以来被限流丢弃的行数。
+        """
+        if self._suppressed:
+            self._emit(logging.WARNING, f"输出过多，已丢弃{self._suppressed}行", pid)
+            self._suppressed = 0
+
+    def _allow(self) -> bool:
+        """
+        令牌桶限流：每行消耗一个令牌，令牌按rate_limit每秒补充，最多burst个。
+        """
+        if self.options.rate_limit <= 0:
+            return True
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.options.burst),
+            self._tokens + (now - self._refilled_at) * self.options.rate_limit,
+        )
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _emit(self, level: int, line: str, pid: int) -> None:
+        """
+        把一行发送到共享日志文件和logging。
+        """
+        if self._file is not None:
+            record = stderr_logger.makeRecord(
+                stderr_logger.name,
+                level,
+                __file__,
+                0,
+                line,
+                None,
+                None,
+                extra={"agent_pid": pid},
+            )
+            self._file.write(record)
+        if self.options.to_logging and stderr_logger.isEnabledFor(level):
+            stderr_logger.log(level, "[%d] %s", pid, line, extra={"agent_pid": pid})
+
+    def _remember(self, line: str) -> None:
+        """
+        把一行放入环形缓冲区，超出ring_buffer_bytes时丢弃最早的行。
+        """
+        capacity = self.options.ring_buffer_bytes
+        if capacity <= 0:
+            return
+        self._ring.append(line)
+        self._ring_bytes += len(line) + 1
+        while self._ring_bytes > capacity and len(self._ring) > 1:
+            self._ring_bytes -= len(self._ring.popleft()) + 1
+
+    def tail(self) -> str:
+        """
+        返回环形缓冲区中最近的输出，用于崩溃时转储。
+
+        返回:
+        str: 最近的输出，未启用环形缓冲区时为空字符串
+        """
+        return "\n".join(self._ring)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回输出处理的指标。
+        """
+        return {
+            "pid": self.pid,
+            "lines": self.lines,
+            "bytes": self.bytes,
+            "dropped": self.dropped,
+            "levels": dict(self.levels),
+            "ring_buffer_bytes": self._ring_bytes,
+            "log_file": self.options.log_file,
+        }
@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+)
+
+from codypy.client_info import Models
+from codypy.exceptions import CodyPyError
+from codypy.session import ChatSession
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认的并发数和每个提示的重试次数
+BATCH_CONCURRENCY = 8
+BATCH_RETRIES = 2
+
+# 重试前的等待时间（秒）：带随机抖动地翻倍，直到上限
+BATCH_BACKOFF_INITIAL = 0.5
+BATCH_BACKOFF_MAX = 10.0
+
+# 输出队列中表示所有提示都已处理的标记
+_DONE = object()
+
+
+@dataclass
+class BatchResult:
+    """
+    批量聊天中一个提示的结果。
+
+    属性:
+        index (int): 提示在输入中的序号，从0开始
+        prompt (str): 提示文本
+        response (str | None): 回答文本，失败时为None
+        context_files (list[str]): 回答推断出的上下文文件
+        error (str | None): 最后一次失败的原因，成功时为None
+        attempts (int): 尝试次数
+        seconds (float): 从第一次尝试到得到结果所用的时间（秒）
+    """
+
+    index: int
+    prompt: str
+    response: str | None = None
+    context_files: list[str] = field(default_factory=list)
+    error: str | None = None
+    attempts: int = 0
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """是否得到了回答。"""
+        return self.error is None
+
+
+def _prompt_digest(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def load_checkpoint(results_file: str) -> Dict[int, str]:
+    """
+    读取结果文件中已经成功的提示。
+
+    参数:
+    results_file (str): chat_many写入的JSON Lines结果文件
+
+    返回:
+    Dict[int, str]: 已经成功的提示的序号和提示文本的哈希；文件不存在时为空
+    """
+    completed: Dict[int, str] = {}
+    try:
+        with open(results_file, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 上次运行中断时可能留下写了一半的最后一行
+                    continue
+                if record.get("error") is None:
+                    completed[record["index"]] = _prompt_digest(record["prompt"])
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+async def _aiter_prompts(
+    prompts: Iterable[str] | AsyncIterable[str],
+) -> AsyncIterator[str]:
+    if isinstance(prompts, AsyncIterable):
+        async for prompt in prompts:
+            yield prompt
+    else:
+        for prompt in prompts:
+            yield prompt
+
+
+async def _aenumerate(iterator: AsyncIterator[str]) -> AsyncIterator[tuple[int, str]]:
+    index = 0
+    async for item in iterator:
+        yield index, item
+        index += 1
+
+
+async def chat_many(
+    prompts: Iterable[str] | AsyncIterable[str],
+    new_session: Callable[[list | None], Awaitable[ChatSession]],
+    release: Callable[[ChatSession], None] = ChatSession.close,
+    concurrency: int = BATCH_CONCURRENCY,
+    ordered: bool = False,
+    retries: int = BATCH_RETRIES,
+    results_file: str | None = None,
+    model: Models | None = None,
+    context_files: list | None = None,
+    enhanced_context: bool = False,
+    show_context_files: bool = False,
+    backoff_initial: float = BATCH_BACKOFF_INITIAL,
+    backoff_max: float = BATCH_BACKOFF_MAX,
+) -> AsyncIterator[BatchResult]:
+    """
+    以有限的并发发送大量互相独立的提示，并在得到结果时逐个产出。
+
+    通常通过CodyAgent.chat_many或CodyServerPool.chat_many调用。每个提示在一个新的聊天会话中发送，
+    提示之间不会共享对话历史；使用进程池时会话分布在所有进程上，吞吐量随进程数增长。
+    输入可以是普通的或异步的可迭代对象，只会按需读取，不会一次读入所有提示。
+
+    指定results_file时，每个提示的最终结果在产出时追加为JSON Lines中的一行。再次使用同一个文件运行时，
+    已经成功的提示（序号和文本都相同）会被跳过，不会再次产出；失败的提示会重新发送。
+    提前停止迭代时，已经完成但还没有产出的结果（按顺序产出时等待前面的提示）不会写入，下次运行会重新发送。
+
+    参数:
+    prompts (Iterable[str] | AsyncIterable[str]): 提示
+    new_session (Callable): 接受上下文文件、创建聊天会话的异步函数
+    release (Callable): 提示处理完后用来释放会话的函数
+    concurrency (int): 同时进行的提示数
+    ordered (bool): 是否按输入顺序产出结果，为False时按完成顺序
+    retries (int): 每个提示失败后的重试次数
+    results_file (str | None): 结果文件的路径，用于断点续跑
+    model (Models | None): 每个会话使用的模型，为None时使用代理的默认模型
+    context_files (list | None): 每个提示都附带的上下文文件
+    enhanced_context (bool): 是否包含增强上下文
+    show_context_files (bool): 是否收集回答推断出的上下文文件
+    backoff_initial (float): 第一次重试前的等待时间（秒）
+    backoff_max (float): 重试等待时间的上限（秒）
+
+    产生:
+    BatchResult: 每个提示的结果，重试次数用完后仍然失败的提示error不为None
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency必须大于0")
+    completed = load_checkpoint(results_file) if results_file is not None else {}
+    if completed:
+        logger.info("结果文件中已有%d个成功的提示，将被跳过", len(completed))
+    checkpoint = (
+        open(results_file, "a", encoding="utf-8") if results_file is not None else None
+    )
+
+    work: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    output: asyncio.Queue = asyncio.Queue()
+
+    async def _attempt(prompt: str) -> tuple[str, list[str]]:
+        session = await new_session(context_files)
+        try:
+            if model is not None:
+                await session.set_model(model)
+            result = await session.chat(
+                prompt,
+                enhanced_context=enhanced_context,
+                show_context_files=show_context_files,
+            )
+        finally:
+            release(session)
+        if result is None:
+            raise CodyPyError("代理没有返回回答")
+        return result
+
+    async def _run(index: int, prompt: str) -> BatchResult:
+        result = BatchResult(index, prompt)
+        started = time.monotonic()
+        backoff = backoff_initial
+        while True:
+            result.attempts += 1
+            try:
+                result.response, result.context_files = await _attempt(prompt)
+                result.error = None
+                break
+            except CodyPyError as exc:
+                result.error = repr(exc)
+                if result.attempts > retries:
+                    logger.warning(
+                        "提示 #%d 在%d次尝试后失败: %r", index, result.attempts, exc
+                    )
+                    break
+                await asyncio.sleep(random.uniform(backoff / 2, backoff))
+                backoff = min(backoff * 2, backoff_max)
+        result.seconds = time.monotonic() - started
+        return result
+
+    def _save(result: BatchResult) -> BatchResult:
+        # 在产出之前写入，调用方拿到的结果在下次运行时一定会被跳过
+        if checkpoint is not None:
+            checkpoint.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+            checkpoint.flush()
+        return result
+
+    async def _produce() -> None:
+        async for index, prompt in _aenumerate(_aiter_prompts(prompts)):
+            if completed.get(index) == _prompt_digest(prompt):
+                # 跳过的序号也要告知输出端，按顺序产出时才能越过它
+                output.put_nowait((index, None))
+                continue
+            await work.put((index, prompt))
+
+    async def _work() -> None:
+        while (item := await work.get()) is not None:
+            output.put_nowait((item[0], await _run(*item)))
+
+    async def _run_all() -> None:
+        workers = [asyncio.create_task(_work()) for _ in range(concurrency)]
+        try:
+            await _produce()
+            for _ in workers:
+                await work.put(None)
+            await asyncio.gather(*workers)
+            output.put_nowait(_DONE)
+        except BaseException as exc:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            output.put_nowait(exc)
+            raise
+
+    runner = asyncio.create_task(_run_all())
+    buffered: Dict[int, BatchResult | None] = {}
+    next_index = 0
+    try:
+        while (item := await output.get()) is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            index, result = item
+            if not ordered:
+                if result is not None:
+                    yield _save(result)
+                continue
+            buffered[index] = result
+            while next_index in buffered:
+                if (result := buffered.pop(next_index)) is not None:
+                    yield _save(result)
+                next_index += 1
+    finally:
+        if not runner.done():
+            runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def batch_metrics(results: Iterable[BatchResult]) -> Dict[str, Any]:
+    """
+    汇总一组结果的成功数、失败数、重试次数和延迟。
+
+    参数:
+    results (Iterable[BatchResult]): chat_many产出的结果
+
+    返回:
+    Dict[str, Any]: 汇总指标
+    """
+    results = list(results)
+    seconds = sorted(result.seconds for result in results)
+    return {
+        "count": len(results),
+        "ok": sum(result.ok for result in results),
+        "failed": sum(not result.ok for result in results),
+        "retries": sum(result.attempts - 1 for result in results),
+        "p50_seconds": seconds[len(seconds) // 2] if seconds else None,
+        "max_seconds": seconds[-1] if seconds else None,
+    }
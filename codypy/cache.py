@@ -0,0 +1,370 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认的内存条目数上限和有效期（秒）
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL = 24 * 60 * 60.0
+
+# 等待其他进程释放SQLite写锁的时间（秒）
+SQLITE_TIMEOUT = 5.0
+
+
+@dataclass(slots=True)
+class CachedResponse:
+    """
+    缓存的一次聊天回答。
+
+    属性:
+        response (str): 回答文本
+        context_files (list[str]): 回答推断出的上下文文件
+        expires_at (float): 过期时间（time.time()）
+    """
+
+    response: str
+    context_files: list[str]
+    expires_at: float
+
+
+def _context_file_path(context_file: Any) -> str | None:
+    """
+    取出上下文文件的本地路径。支持append_paths创建的Context对象和同样结构的字典。
+    """
+    uri = (
+        context_file.get("uri")
+        if isinstance(context_file, dict)
+        else getattr(context_file, "uri", None)
+    )
+    if uri is None:
+        return None
+    path = uri.get("fsPath") if isinstance(uri, dict) else getattr(uri, "fsPath", None)
+    return path or None
+
+
+class ResponseCache:
+    """
+    聊天回答的缓存。
+
+    缓存键由模型ID、消息文本、上下文文件内容的哈希和是否包含增强上下文组成，
+    因此上下文文件被修改后不会命中旧的回答。
+    条目先保存在内存中的LRU里，按TTL过期；指定path时同时写入SQLite数据库，多个进程可以共享。
+    数据库只在一个专用线程中访问，不会阻塞事件循环，内存命中时不做任何数据库操作。
+
+    命中的回答不会发送给代理，因此也不会出现在代理中该聊天的历史记录里；ChatSession只在会话还没有
+    对话历史时使用缓存。缓存适合批量任务中互相独立的提示，例如对未修改的文件重复提出同一个代码审查问题。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl: float = CACHE_TTL,
+        path: str | None = None,
+    ) -> None:
+        """
+        初始化ResponseCache实例。
+
+        参数:
+        max_entries (int): 内存中保留的条目数上限，超出时淘汰最久未使用的条目
+        ttl (float): 条目的有效期（秒）
+        path (str | None): SQLite数据库文件的路径，为None时只使用内存
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        # 上下文文件的内容哈希，按(修改时间, 大小)判断是否需要重新读取
+        self._file_digests: Dict[str, tuple[int, int, str]] = {}
+        # 数据库连接只在_executor的线程中创建和使用
+        self._db: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        if path is not None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="codypy-cache")
+            self._executor.submit(self._open_db)
+        self.hits: int = 0  # 命中次数（包括从数据库命中）
+        self.disk_hits: int = 0  # 内存未命中、从数据库命中的次数
+        self.misses: int = 0  # 未命中次数
+        self.stores: int = 0  # 写入的回答数
+        self.evictions: int = 0  # 因超出max_entries被淘汰的条目数
+        self.expired: int = 0  # 因过期被丢弃的条目数
+
+    def _open_db(self) -> None:
+        """
+        打开（必要时创建）SQLite数据库。使用WAL模式，多个进程可以同时读取。在数据库线程中运行。
+        """
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(
+                self.path, timeout=SQLITE_TIMEOUT, isolation_level=None
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "context_files TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        except (OSError, sqlite3.Error) as exc:
+            logger.warning("打开回答缓存数据库 %s 失败，只使用内存: %r", self.path, exc)
+            return
+        self._db = db
+
+    async def _run_db(self, function, *args) -> Any:
+        """
+        在数据库线程中运行function并等待结果。只使用内存时在事件循环默认的线程池中运行。
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def key(
+        self,
+        model_id: str,
+        message: str,
+        context_files: Iterable[Any],
+        enhanced_context: bool,
+        show_context_files: bool = False,
+    ) -> str:
+        """
+        计算缓存键。
+
+        上下文文件的内容哈希需要读取文件，在数据库线程（只使用内存时为默认线程池）中计算，
+        不会阻塞事件循环；没有本地上下文文件时直接在事件循环中计算。
+
+        参数:
+        model_id (str): 模型ID，使用代理的默认模型时为空字符串
+        message (str): 消息文本
+        context_files (Iterable[Any]): 消息附带的上下文文件
+        enhanced_context (bool): 是否包含增强上下文
+        show_context_files (bool): 是否需要回答推断出的上下文文件
+
+        返回:
+        str: 缓存键
+        """
+        context_files = list(context_files)
+        args = (model_id, message, context_files, enhanced_context, show_context_files)
+        if any(_context_file_path(context_file) for context_file in context_files):
+            return await self._run_db(self._key, *args)
+        return self._key(*args)
+
+    def _key(
+        self,
+        model_id: str,
+        message: str,
+        context_files: list[Any],
+        enhanced_context: bool,
+        show_context_files: bool,
+    ) -> str:
+        """
+        计算缓存键，按需读取上下文文件。在数据库线程或默认线程池中运行。
+        """
+        digest = hashlib.sha256()
+        flags = f"{int(enhanced_context)}{int(show_context_files)}"
+        for part in (model_id, message, flags):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        for context_file in context_files:
+            path = _context_file_path(context_file)
+            if path is None:
+                digest.update(repr(context_file).encode("utf-8"))
+            else:
+                digest.update(path.encode("utf-8"))
+                digest.update(b"\0")
+                digest.update(self._file_digest(path).encode("ascii"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _file_digest(self, path: str) -> str:
+        """
+        返回文件内容的SHA-256。修改时间和大小都没有变化时使用上次的结果，不重新读取文件。
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return "missing"
+        cached = self._file_digests.get(path)
+        if (
+            cached is not None
+            and cached[0] == stat.st_mtime_ns
+            and cached[1] == stat.st_size
+        ):
+            return cached[2]
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as file:
+                while chunk := file.read(1024 * 1024):
+                    digest.update(chunk)
+        except OSError:
+            return "unreadable"
+        self._file_digests[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> CachedResponse | None:
+        """
+        查找缓存的回答。内存中没有时在数据库线程中查询数据库。
+
+        参数:
+        key (str): 缓存键
+
+        返回:
+        CachedResponse | None: 未过期的回答，未命中时为None
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            del self._entries[key]
+            self.expired += 1
+
+        if self._executor is not None:
+            entry = await self._run_db(self._read, key, now)
+            if entry is not None:
+                self._remember(key, entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def _read(self, key: str, now: float) -> CachedResponse | None:
+        """
+        从数据库读取未过期的回答。在数据库线程中运行。
+        """
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT response, context_files, expires_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("读取回答缓存数据库失败: %r", exc)
+            return None
+        if row is None or row[2] <= now:
+            return None
+        return CachedResponse(row[0], json.loads(row[1]), row[2])
+
+    def put(self, key: str, response: str, context_files: list[str]) -> None:
+        """
+        保存一次回答。数据库在后台写入，不等待写入完成。
+
+        参数:
+        key (str): 缓存键
+        response (str): 回答文本
+        context_files (list[str]): 回答推断出的上下文文件
+        """
+        entry = CachedResponse(response, list(context_files), time.time() + self.ttl)
+        self._remember(key, entry)
+        self.stores += 1
+        if self._executor is not None:
+            self._executor.submit(self._write, key, entry)
+
+    def _write(self, key: str, entry: CachedResponse) -> None:
+        """
+        把回答写入数据库。在数据库线程中运行。
+        """
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (
+                    key,
+                    entry.response,
+                    json.dumps(entry.context_files),
+                    entry.expires_at,
+                ),
+            )
+        except sqlite3.Error as exc:
+            logger.warning("写入回答缓存数据库失败: %r", exc)
+
+    def _remember(self, key: str, entry: CachedResponse) -> None:
+        """
+        把条目放入内存LRU，超出max_entries时淘汰最久未使用的条目。
+        """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def purge(self) -> int:
+        """
+        删除内存和数据库中所有已过期的条目。
+
+        返回:
+        int: 删除的数据库条目数
+        """
+        now = time.time()
+        for key in [
+            key for key, entry in self._entries.items() if entry.expires_at <= now
+        ]:
+            del self._entries[key]
+            self.expired += 1
+        if self._executor is None:
+            return 0
+        return await self._run_db(
+            self._execute, "DELETE FROM responses WHERE expires_at <= ?", (now,)
+        )
+
+    async def clear(self) -> None:
+        """
+        清空内存和数据库中的所有条目。
+        """
+        self._entries.clear()
+        if self._executor is not None:
+            await self._run_db(self._execute, "DELETE FROM responses", ())
+
+    def _execute(self, sql: str, parameters: tuple) -> int:
+        """
+        执行一条修改数据库的语句，返回受影响的行数。在数据库线程中运行。
+        """
+        if self._db is None:
+            return 0
+        return self._db.execute(sql, parameters).rowcount
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回缓存的命中率和条目数。
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "path": self.path,
+        }
+
+    def close(self) -> None:
+        """
+        关闭SQLite数据库。已经提交的写入仍会完成，内存中的条目仍然可用。
+        """
+        if self._executor is not None:
+            self._executor.submit(self._close_db)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _close_db(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
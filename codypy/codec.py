@@ -0,0 +1,228 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Type
+
+import pydantic_core as pd
+from pydantic import TypeAdapter
+
+try:
+    import msgspec
+except ImportError:  # msgspec是可选依赖
+    msgspec = None
+
+
+@dataclass(slots=True)
+class JsonRpcMessage:
+    """
+    解码后的JSON-RPC消息外壳。
+
+    params和result是编解码器相关的载荷：可能已经是Python对象，也可能是尚未解码的原始JSON，
+    需要通过JsonCodec.decode_payload取得实际的值。
+
+    属性:
+        id (int | str | None): 消息ID，通知没有ID
+        method (str | None): 方法名，响应没有方法名
+        params (Any): 请求或通知的参数载荷
+        result (Any): 响应的结果载荷
+        error (Any): 错误响应中的错误对象
+    """
+
+    id: int | str | None = None
+    method: str | None = None
+    params: Any = None
+    result: Any = None
+    error: Any = None
+
+
+class JsonCodec(ABC):
+    """
+    传输层使用的JSON编解码器接口。
+
+    连接只在读取循环中解码消息外壳（ID、方法名和错误），
+    参数和结果在真正需要时才由调用方按目标类型解码。
+    """
+
+    name: str = ""
+
+    @abstractmethod
+    def encode(self, message: Any) -> bytes:
+        """
+        将消息编码为JSON字节。
+
+        参数:
+            message (Any): 要编码的消息，可以包含字典、列表和数据类。
+
+        返回:
+            bytes: JSON字节。
+        """
+
+    @abstractmethod
+    def decode_message(self, data: bytes | bytearray | memoryview) -> JsonRpcMessage:
+        """
+        解码一条JSON-RPC消息的外壳。
+
+        参数:
+            data (bytes | bytearray | memoryview): 一条消息的消息体。
+
+        返回:
+            JsonRpcMessage: 消息外壳。
+
+        异常:
+            ValueError: 如果消息体不是合法的JSON-RPC消息。
+        """
+
+    @abstractmethod
+    def decode_payload(self, payload: Any, type_: Type | None = None) -> Any:
+        """
+        解码消息外壳中的参数或结果载荷。
+
+        参数:
+            payload (Any): decode_message得到的params或result。
+            type_ (Type | None): 目标类型，例如codypy.protocol中的数据类。
+                为None时解码为普通的字典和列表。
+
+        返回:
+            Any: 解码后的值。载荷为空或JSON null时返回None。
+
+        异常:
+            ValueError: 如果载荷与目标类型不匹配。
+        """
+
+
+@lru_cache(maxsize=None)
+def _type_adapter(type_: Type) -> TypeAdapter:
+    """
+    为目标类型创建并缓存pydantic的TypeAdapter。
+    """
+    return TypeAdapter(type_)
+
+
+class PydanticJsonCodec(JsonCodec):
+    """
+    基于pydantic_core的编解码器。
+
+    外壳解码时会完整解析为字典，按类型解码时再把字典校验为目标数据类。
+    这是始终可用的默认实现。
+    """
+
+    name = "pydantic"
+
+    def encode(self, message: Any) -> bytes:
+        return pd.to_json(message)
+
+    def decode_message(self, data: bytes | bytearray | memoryview) -> JsonRpcMessage:
+        # pydantic_core不接受memoryview
+        message = pd.from_json(bytes(data) if isinstance(data, memoryview) else data)
+        if not isinstance(message, dict):
+            raise ValueError(f"JSON-RPC消息必须是对象: {message!r}")
+        return JsonRpcMessage(
+            id=message.get("id"),
+            method=message.get("method"),
+            params=message.get("params"),
+            result=message.get("result"),
+            error=message.get("error"),
+        )
+
+    def decode_payload(self, payload: Any, type_: Type | None = None) -> Any:
+        if payload is None or type_ is None:
+            return payload
+        return _type_adapter(type_).validate_python(payload)
+
+
+if msgspec is not None:
+
+    class _MsgspecEnvelope(msgspec.Struct):
+        """
+        msgspec使用的消息外壳，参数和结果保留为原始JSON片段。
+        """
+
+        id: int | str | None = None
+        method: str | None = None
+        params: msgspec.Raw = msgspec.Raw()
+        result: msgspec.Raw = msgspec.Raw()
+        error: Any = None
+
+
+class MsgspecJsonCodec(JsonCodec):
+    """
+    基于msgspec的编解码器（需要安装可选依赖msgspec）。
+
+    外壳解码时参数和结果只被定位而不被解析，按类型解码时直接从JSON字节构造目标数据类，
+    未声明的字段会被跳过，不会产生中间字典。
+    """
+
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        """
+        初始化MsgspecJsonCodec实例。
+
+        异常:
+            ImportError: 如果没有安装msgspec。
+        """
+        if msgspec is None:
+            raise ImportError("MsgspecJsonCodec需要安装msgspec: pip install msgspec")
+        self._encoder = msgspec.json.Encoder()
+        self._envelope_decoder = msgspec.json.Decoder(_MsgspecEnvelope)
+        self._generic_decoder = msgspec.json.Decoder()
+        self._decoders: Dict[Type, Any] = {}
+
+    def encode(self, message: Any) -> bytes:
+        return self._encoder.encode(message)
+
+    def decode_message(self, data: bytes | bytearray | memoryview) -> JsonRpcMessage:
+        envelope = self._envelope_decoder.decode(data)
+        return JsonRpcMessage(
+            id=envelope.id,
+            method=envelope.method,
+            params=envelope.params,
+            result=envelope.result,
+            error=envelope.error,
+        )
+
+    def decode_payload(self, payload: Any, type_: Type | None = None) -> Any:
+        if not isinstance(payload, msgspec.Raw):
+            # 不是由本编解码器产生的载荷，已经是Python对象
+            if payload is None or type_ is None:
+                return payload
+            return msgspec.convert(payload, type_)
+        if not payload:
+            return None
+        if type_ is None:
+            return self._generic_decoder.decode(payload)
+        decoder = self._decoders.get(type_)
+        if decoder is None:
+            decoder = self._decoders[type_] = msgspec.json.Decoder(type_ | None)
+        return decoder.decode(payload)
+
+
+# 可按名称选择的编解码器
+CODECS: Dict[str, Type[JsonCodec]] = {
+    PydanticJsonCodec.name: PydanticJsonCodec,
+    MsgspecJsonCodec.name: MsgspecJsonCodec,
+}
+
+
+def get_codec(name: str | None = None) -> JsonCodec:
+    """
+    按名称创建编解码器。
+
+    参数:
+        name (str | None): "pydantic"或"msgspec"。为None时，
+            如果安装了msgspec则使用msgspec，否则使用pydantic。
+
+    返回:
+        JsonCodec: 编解码器实例。
+
+    异常:
+        ValueError: 如果名称未知。
+        ImportError: 如果所选编解码器的依赖没有安装。
+    """
+    if name is None:
+        name = MsgspecJsonCodec.name if msgspec is not None else PydanticJsonCodec.name
+    try:
+        codec_class = CODECS[name]
+    except KeyError:
+        raise ValueError(f"未知的编解码器: {name}") from None
+    return codec_class()
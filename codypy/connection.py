@@ -0,0 +1,583 @@
+import asyncio
+import copy
+import logging
+import math
+import time
+from typing import Any, Dict, Hashable, Set, Type
+
+from codypy.codec import JsonCodec, JsonRpcMessage, get_codec
+from codypy.exceptions import (
+    AgentConnectionClosedError,
+    JsonRpcError,
+    JsonRpcProtocolError,
+    QueueOverflowError,
+    RequestTimeoutError,
+)
+from codypy.handlers import (
+    DEFAULT_NOTIFICATION_HANDLERS,
+    DEFAULT_REQUEST_HANDLERS,
+    NotificationHandler,
+    RequestHandler,
+)
+from codypy.messaging import FrameDecoder, _send_jsonrpc_request, _send_jsonrpc_response
+from codypy.protocol import Transcript, WebviewPostMessage
+from codypy.queues import NotificationQueue, OverflowPolicy
+from codypy.recording import RECEIVED, SENT, WireRecorder
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+stream_logger = logging.getLogger(f"{__name__}.stream")
+
+# 每次从流中读取的最大字节数，一次读取可能包含多条消息
+READ_CHUNK_SIZE = 256 * 1024
+
+# 各方法默认的请求截止时间（秒）。生成回答可能需要数分钟，而查询类请求应当很快返回
+DEFAULT_REQUEST_TIMEOUT = 60.0
+DEFAULT_METHOD_TIMEOUTS: Dict[str, float] = {
+    "initialize": 60.0,
+    "chat/new": 30.0,
+    "chat/submitMessage": 600.0,
+    "chat/models": 10.0,
+    "graphql/getRepoIds": 30.0,
+    "webview/receiveMessage": 30.0,
+    "shutdown": 5.0,
+}
+
+# 每个transcript订阅队列默认最多保存的推送数
+DEFAULT_TRANSCRIPT_QUEUE_SIZE = 16
+
+# 请求延迟指数移动平均的平滑系数，越大越偏向最近的请求
+LATENCY_EWMA_ALPHA = 0.3
+
+# 连接排空时仍然允许发送的请求
+SHUTDOWN_METHODS = frozenset({"shutdown"})
+
+# 关闭写入端时等待缓冲数据写出的时间（秒），挂起的代理不再读取时直接中止
+WRITER_CLOSE_TIMEOUT = 1.0
+
+# JSON-RPC标准错误码
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+
+class JsonRpcConnection:
+    """
+    多路复用的JSON-RPC连接。
+
+    连接独占一对读写流：一个后台任务持续读取代理发来的所有消息，
+    并根据响应的"id"把结果交给对应请求的`asyncio.Future`。
+    因此同一个代理进程上可以同时有多个请求在进行中，
+    响应到达的顺序也不必与请求发送的顺序一致。
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        timeouts: Dict[str, float] | None = None,
+        codec: JsonCodec | None = None,
+        recorder: WireRecorder | None = None,
+    ) -> None:
+        """
+        初始化JsonRpcConnection实例。
+
+        参数:
+        reader (asyncio.StreamReader): 用于接收消息的读取器流
+        writer (asyncio.StreamWriter): 用于发送消息的写入器流
+        timeouts (Dict[str, float] | None): 按方法覆盖默认的请求截止时间（秒）
+        codec (JsonCodec | None): JSON编解码器，默认由codypy.codec.get_codec选择
+        recorder (WireRecorder | None): 可选的线路录制器，记录收发的每一帧
+        """
+        self._reader = reader
+        self._writer = writer
+        self.codec: JsonCodec = codec or get_codec()
+        self.recorder = recorder
+        self.timeouts: Dict[str, float] = {
+            **DEFAULT_METHOD_TIMEOUTS,
+            **(timeouts or {}),
+        }
+        self._cancel_tasks: Set[asyncio.Task] = set()
+        # 代理发来的请求和通知的分发表，预置了内置的默认处理函数
+        self._request_handlers: Dict[str, RequestHandler] = dict(
+            DEFAULT_REQUEST_HANDLERS
+        )
+        self._notification_handlers: Dict[str, NotificationHandler] = dict(
+            DEFAULT_NOTIFICATION_HANDLERS
+        )
+        self._handler_tasks: Set[asyncio.Task] = set()
+        self._next_id: int = 1  # 每个连接独立的请求ID计数器
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._reader_task: asyncio.Task | None = None
+        self._closed: bool = False
+        self._draining: bool = False  # 排空期间不再接受新的请求
+        self._close_error: Exception | None = None  # 关闭时交给未完成请求的异常
+        self.latency_ewma: float = 0.0  # 已完成请求延迟的指数移动平均（秒）
+        self.completed: int = 0  # 已收到响应的请求数
+        # 按聊天ID订阅的transcript队列，用于流式输出进行中的回答
+        self._transcript_subscribers: Dict[str, Set[NotificationQueue]] = {}
+
+    @property
+    def closed(self) -> bool:
+        """连接是否已经关闭（读取任务已结束）。"""
+        return self._closed
+
+    @property
+    def in_flight(self) -> int:
+        """当前尚未收到响应的请求数量。"""
+        return len(self._pending)
+
+    def start(self) -> None:
+        """
+        启动后台读取任务。重复调用不会创建第二个任务。
+        """
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def request(
+        self,
+        method: str,
+        params: Any = None,
+        timeout: float | None = None,
+        result_type: Type | None = None,
+    ) -> Any:
+        """
+        发送JSON-RPC请求并等待与之对应的响应。
+
+        如果在截止时间之前没有收到响应，会向代理发送"$/cancelRequest"并释放该请求，
+        之后迟到的响应会被直接丢弃，不会影响其他请求。
+
+        参数:
+            method (str): 要调用的JSON-RPC方法。
+            params (Any): 传递给方法的参数。
+            timeout (float | None): 截止时间（秒）。为None时使用该方法的默认值，
+                为math.inf时不设截止时间。
+            result_type (Type | None): 结果的目标类型，例如codypy.protocol.Transcript。
+                为None时结果解码为普通的字典和列表。
+
+        返回:
+            Any: 响应中的"result"字段，按result_type解码。
+
+        异常:
+            JsonRpcError: 如果代理返回了错误响应。
+            JsonRpcProtocolError: 如果结果无法解码为result_type。
+            RequestTimeoutError: 如果在截止时间之前没有收到响应。
+            AgentConnectionClosedError: 如果连接在收到响应之前已关闭，或者连接正在排空。
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(method, DEFAULT_REQUEST_TIMEOUT)
+        if self._closed:
+            raise self._closed_error()
+        if self._draining and method not in SHUTDOWN_METHODS:
+            raise AgentConnectionClosedError("连接正在关闭，不再接受新的请求")
+
+        message_id = self._next_id
+        self._next_id += 1
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+
+        logger.debug("发送命令 #%d: %s - %s", message_id, method, params)
+        started = time.monotonic()
+        try:
+            await _send_jsonrpc_request(
+                self._writer, method, params, message_id, self.codec, self._record_sent
+            )
+            result = await asyncio.wait_for(
+                future, None if math.isinf(timeout) else timeout
+            )
+            self._observe_latency(time.monotonic() - started)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "请求 #%d %s 在%.1f秒内没有响应", message_id, method, timeout
+            )
+            self._observe_latency(time.monotonic() - started)
+            self._cancel_request(message_id)
+            raise RequestTimeoutError(
+                f"请求{method}在{timeout}秒内没有响应",
+                method=method,
+                timeout=timeout,
+            ) from None
+        except asyncio.CancelledError:
+            self._cancel_request(message_id)
+            raise
+        finally:
+            self._pending.pop(message_id, None)
+        try:
+            return self.codec.decode_payload(result, result_type)
+        except ValueError as exc:
+            type_name = getattr(result_type, "__name__", result_type)
+            raise JsonRpcProtocolError(
+                f"无法把{method}的结果解码为{type_name}: {exc}"
+            ) from exc
+
+    async def notify(self, method: str, params: Any = None) -> None:
+        """
+        发送不需要响应的JSON-RPC通知。
+
+        参数:
+            method (str): 通知的方法名。
+            params (Any): 通知的参数。
+        """
+        if self._closed:
+            raise AgentConnectionClosedError()
+        logger.debug("发送通知: %s - %s", method, params)
+        await _send_jsonrpc_request(
+            self._writer, method, params, None, self.codec, self._record_sent
+        )
+
+    def _record_sent(self, body: bytes) -> None:
+        """
+        录制一条发送帧。在写入之前调用，使录制中发送帧总是先于代理对它的响应。
+        """
+        if self.recorder is not None:
+            self.recorder.record(SENT, body)
+
+    def register_request_handler(self, method: str, handler: RequestHandler) -> None:
+        """
+        注册处理代理请求的异步函数，替换该方法已有的处理函数。
+
+        处理函数在独立的任务中运行，不会阻塞读取循环；
+        它的返回值会作为响应的"result"发回代理，抛出的异常会作为错误响应发回。
+
+        参数:
+            method (str): 代理请求的方法名。
+            handler (RequestHandler): 接收请求参数并返回结果的异步函数。
+        """
+        self._request_handlers[method] = handler
+
+    def register_notification_handler(
+        self, method: str, handler: NotificationHandler
+    ) -> None:
+        """
+        注册处理代理通知的异步函数，替换该方法已有的处理函数。
+
+        处理函数在独立的任务中运行，不会阻塞读取循环。
+
+        参数:
+            method (str): 代理通知的方法名。
+            handler (NotificationHandler): 接收通知参数的异步函数。
+        """
+        self._notification_handlers[method] = handler
+
+    def subscribe_transcripts(
+        self,
+        chat_id: str,
+        maxsize: int = DEFAULT_TRANSCRIPT_QUEUE_SIZE,
+        overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+    ) -> NotificationQueue[Transcript]:
+        """
+        订阅指定聊天会话的transcript推送。
+
+        代理在生成回答的过程中会通过"webview/postMessage"通知不断推送完整的transcript，
+        每条推送都会以codypy.protocol.Transcript的形式放入返回的有界队列中。
+        每次推送都是完整的快照，因此尚未被取走的进行中transcript会被更新的推送合并替换，
+        消费者较慢时只会看到最新的状态；读取循环写入时从不阻塞。
+
+        参数:
+            chat_id (str): 聊天会话的ID。
+            maxsize (int): 队列中最多保存的推送数。
+            overflow (OverflowPolicy): 队列已满时的处理策略，默认丢弃最旧的推送。
+
+        返回:
+            NotificationQueue[Transcript]: 接收Transcript的队列。使用完毕后需调用unsubscribe_transcripts。
+        """
+        queue: NotificationQueue[Transcript] = NotificationQueue(
+            maxsize, overflow, coalesce_key=_in_progress_key
+        )
+        self._transcript_subscribers.setdefault(chat_id, set()).add(queue)
+        return queue
+
+    def unsubscribe_transcripts(self, chat_id: str, queue: NotificationQueue) -> None:
+        """
+        取消subscribe_transcripts创建的订阅。
+
+        参数:
+            chat_id (str): 聊天会话的ID。
+            queue (NotificationQueue): subscribe_transcripts返回的队列。
+        """
+        subscribers = self._transcript_subscribers.get(chat_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._transcript_subscribers[chat_id]
+
+    def _observe_latency(self, latency: float) -> None:
+        """
+        把一个请求的延迟计入指数移动平均。超时的请求按已经等待的时间计入。
+        """
+        if self.completed == 0:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+        self.completed += 1
+
+    def _cancel_request(self, message_id: int) -> None:
+        """
+        在后台通知代理放弃一个已经无人等待的请求，避免它继续为此消耗资源。
+
+        参数:
+            message_id (int): 要取消的请求ID。
+        """
+        if self._closed:
+            return
+        task = asyncio.create_task(self.notify("$/cancelRequest", {"id": message_id}))
+        self._cancel_tasks.add(task)
+        task.add_done_callback(self._on_cancel_sent)
+
+    def _on_cancel_sent(self, task: asyncio.Task) -> None:
+        """
+        清理已完成的取消通知任务，并记录发送失败的情况。
+        """
+        self._cancel_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("发送$/cancelRequest失败: %r", task.exception())
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        停止接受新的请求（SHUTDOWN_METHODS除外），并等待进行中的请求完成。
+
+        参数:
+            timeout (float): 最长等待时间（秒）。
+
+        返回:
+            bool: 所有请求都在截止时间之前完成时为True。
+        """
+        self._draining = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._pending and not self._closed:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.wait(list(self._pending.values()), timeout=remaining)
+        return not self._pending
+
+    async def close(self, error: Exception | None = None) -> None:
+        """
+        停止后台读取任务，让所有未完成的请求以AgentConnectionClosedError失败，并关闭写入端。
+
+        参数:
+            error (Exception | None): 未完成的请求收到的异常，默认为AgentConnectionClosedError，
+                例如监督器在重启无响应的代理时使用AgentCrashedError。
+        """
+        if error is not None and self._close_error is None:
+            self._close_error = error
+        if self._reader_task is not None and not self._reader_task.done():
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+        for task in list(self._handler_tasks):
+            task.cancel()
+        self._fail_pending(self._closed_error())
+        await self._close_writer()
+
+    async def _close_writer(self) -> None:
+        """
+        关闭写入端，让代理读到EOF。代理不再读取时不等待缓冲的数据写出。
+        """
+        if self._writer.is_closing():
+            return
+        self._writer.close()
+        try:
+            await asyncio.wait_for(self._writer.wait_closed(), WRITER_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if (transport := getattr(self._writer, "transport", None)) is not None:
+                transport.abort()
+        except (ConnectionError, OSError) as exc:
+            logger.debug("关闭写入端时出错: %r", exc)
+
+    async def wait_closed(self) -> None:
+        """
+        等待后台读取任务结束，即对端关闭连接或close()被调用。
+        """
+        if self._reader_task is not None:
+            try:
+                await asyncio.shield(self._reader_task)
+            except asyncio.CancelledError:
+                if not self._reader_task.cancelled():
+                    raise
+
+    async def _read_loop(self) -> None:
+        """
+        后台读取循环：持续读取消息并分发，直到流结束或任务被取消。
+        """
+        decoder = FrameDecoder()
+        try:
+            while data := await self._reader.read(READ_CHUNK_SIZE):
+                for body in decoder.feed(data):
+                    if self.recorder is not None:
+                        self.recorder.record(RECEIVED, body)
+                    try:
+                        message = self.codec.decode_message(body)
+                    except ValueError as exc:
+                        logger.error("无法解码代理发送的消息，已跳过: %s", exc)
+                        continue
+                    self._dispatch(message)
+            logger.info("与Cody代理的连接已到达EOF")
+        except ConnectionError as exc:
+            logger.info("与Cody代理的连接已断开: %r", exc)
+        except JsonRpcProtocolError as exc:
+            logger.error("无法解析代理发送的数据，关闭连接: %s", exc)
+        finally:
+            self._fail_pending(self._closed_error())
+
+    def _dispatch(self, message: JsonRpcMessage) -> None:
+        """
+        分发一条收到的消息。
+
+        带方法名的消息是代理发来的通知或请求，其余带ID的消息是对我们请求的响应。
+        响应的结果保持编解码器的原始载荷，由发起请求的任务按需要的类型解码。
+        """
+        if method := message.method:
+            if method == "webview/postMessage":
+                self._publish_transcript(message.params)
+            if message.id is not None:
+                self._spawn_handler(
+                    self._handle_request(message.id, method, message.params)
+                )
+            elif handler := self._notification_handlers.get(method):
+                self._spawn_handler(
+                    self._handle_notification(handler, method, message.params)
+                )
+            elif method != "webview/postMessage":
+                logger.debug("收到未处理的代理通知: %s", method)
+            return
+
+        future = self._pending.get(message.id)
+        if future is None or future.done():
+            logger.debug("丢弃无人等待的响应 #%s", message.id)
+            return
+
+        if message.error is not None:
+            error = message.error if isinstance(message.error, dict) else {}
+            future.set_exception(
+                JsonRpcError(
+                    error.get("message", "代理返回了JSON-RPC错误"),
+                    code=error.get("code"),
+                    data=error.get("data"),
+                )
+            )
+        else:
+            logger.debug("响应 #%s", message.id)
+            future.set_result(message.result)
+
+    def _spawn_handler(self, coroutine) -> None:
+        """
+        在独立的任务中运行处理函数，使读取循环可以立即继续分发后续的响应。
+        """
+        task = asyncio.create_task(coroutine)
+        self._handler_tasks.add(task)
+        task.add_done_callback(self._handler_tasks.discard)
+
+    async def _handle_request(self, message_id: Any, method: str, params: Any) -> None:
+        """
+        调用已注册的处理函数处理代理请求，并把结果或错误回复给代理。
+
+        参数:
+            message_id (Any): 代理请求的ID。
+            method (str): 代理请求的方法名。
+            params (Any): 代理请求的参数载荷，解码后不一定是字典。
+        """
+        handler = self._request_handlers.get(method)
+        if handler is None:
+            logger.debug("没有处理代理请求%s的函数，回复方法不存在", method)
+            error = {"code": METHOD_NOT_FOUND, "message": f"方法不存在: {method}"}
+            await self._reply(message_id, error=error)
+            return
+        try:
+            result = await handler(self.codec.decode_payload(params))
+        except Exception as exc:
+            logger.exception("处理代理请求%s时出错", method)
+            await self._reply(
+                message_id, error={"code": INTERNAL_ERROR, "message": str(exc)}
+            )
+            return
+        await self._reply(message_id, result=result)
+
+    async def _handle_notification(
+        self, handler: NotificationHandler, method: str, params: Any
+    ) -> None:
+        """
+        调用已注册的处理函数处理代理通知，处理函数的异常只会被记录。
+
+        参数:
+            handler (NotificationHandler): 通知处理函数。
+            method (str): 通知的方法名。
+            params (Any): 通知的参数载荷，解码后不一定是字典。
+        """
+        try:
+            await handler(self.codec.decode_payload(params))
+        except Exception:
+            logger.exception("处理代理通知%s时出错", method)
+
+    async def _reply(
+        self,
+        message_id: Any,
+        result: Any = None,
+        error: Dict[str, Any] | None = None,
+    ) -> None:
+        """
+        向代理发送响应。连接已关闭时放弃发送。
+        """
+        if self._closed:
+            return
+        try:
+            await _send_jsonrpc_response(
+                self._writer, message_id, result, error, self.codec, self._record_sent
+            )
+        except ConnectionError as exc:
+            logger.debug("回复代理请求 #%s 失败: %r", message_id, exc)
+
+    def _publish_transcript(self, params: Any) -> None:
+        """
+        将"webview/postMessage"通知中的transcript交给对应聊天会话的订阅者。
+
+        没有订阅者时不会解码通知参数；有订阅者时直接解码为Transcript。
+
+        参数:
+            params (Any): 通知的参数载荷，包含聊天ID"id"和扩展消息"message"。
+        """
+        if not self._transcript_subscribers:
+            return
+        try:
+            post = self.codec.decode_payload(params, WebviewPostMessage)
+        except ValueError:
+            logger.debug("webview消息不是transcript，已忽略")
+            return
+        if post is None or post.message.type != "transcript":
+            return
+        transcript: Transcript = post.message
+        if transcript.isMessageInProgress:
+            stream_logger.debug("聊天 %s 进行中的响应", post.id)
+        for queue in self._transcript_subscribers.get(post.id, ()):
+            try:
+                queue.put_nowait(transcript)
+            except QueueOverflowError:
+                logger.warning("聊天 %s 的transcript队列已满，丢弃推送", post.id)
+
+    def _closed_error(self) -> Exception:
+        """
+        创建交给未完成请求和关闭后发起的请求的异常，每次返回一个新的实例。
+        """
+        if self._close_error is None:
+            return AgentConnectionClosedError()
+        return copy.copy(self._close_error)
+
+    def _fail_pending(self, exc: Exception) -> None:
+        """
+        将连接标记为关闭，并让所有未完成的请求以给定异常失败。
+        """
+        self._closed = True
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+
+
+def _in_progress_key(transcript: Transcript) -> Hashable | None:
+    """
+    transcript的合并键：进行中的transcript可以被更新的推送取代，完整的transcript保留。
+    """
+    return "in-progress" if transcript.isMessageInProgress else None
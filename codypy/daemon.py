@@ -0,0 +1,503 @@
+import argparse
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import tempfile
+from typing import Any, AsyncIterator, Dict
+
+from codypy.client_info import AgentSpecs, ClientCapabilities
+from codypy.connection import JsonRpcConnection
+from codypy.exceptions import CodyPyError
+from codypy.messaging import _text_delta
+from codypy.pool import CodyServerPool
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 守护进程套接字路径的环境变量
+SOCKET_ENV = "CODYPY_DAEMON_SOCKET"
+
+# 守护进程协议中的方法名
+CHAT_METHOD = "daemon/chat"
+CHAT_DELTA_NOTIFICATION = "daemon/chatDelta"
+STATUS_METHOD = "daemon/status"
+STOP_METHOD = "daemon/stop"
+
+# 客户端等待一次聊天的默认截止时间（秒），与"chat/submitMessage"一致
+DAEMON_REQUEST_TIMEOUTS: Dict[str, float] = {
+    CHAT_METHOD: 600.0,
+    STATUS_METHOD: 5.0,
+    STOP_METHOD: 30.0,
+}
+
+
+def default_socket_path() -> str:
+    """
+    返回守护进程默认的Unix套接字路径。
+
+    优先使用环境变量CODYPY_DAEMON_SOCKET，其次是$XDG_RUNTIME_DIR/codypy.sock，
+    最后是临时目录中按用户区分的codypy-<uid>.sock。
+
+    返回:
+        str: 套接字路径。
+    """
+    if path := os.environ.get(SOCKET_ENV):
+        return path
+    if runtime_dir := os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(runtime_dir, "codypy.sock")
+    return os.path.join(tempfile.gettempdir(), f"codypy-{os.getuid()}.sock")
+
+
+def _token_digest(access_token: str | None) -> str:
+    """
+    返回访问令牌的SHA-256。守护进程协议中只传递令牌的哈希，不传递令牌本身。
+    """
+    return hashlib.sha256((access_token or "").encode("utf-8")).hexdigest()
+
+
+class CodyDaemon:
+    """
+    长期运行的本地代理守护进程。
+
+    守护进程持有一个已经初始化的CodyServerPool，并在Unix域套接字上接受客户端连接。
+    客户端与守护进程之间同样使用Content-Length帧的JSON-RPC：
+    "daemon/chat"在负载最低的代理进程上新建一个聊天会话并回答一条消息，
+    生成过程中通过"daemon/chatDelta"通知推送文本增量；
+    "daemon/status"返回进程池的指标，"daemon/stop"让守护进程退出。
+    这样频繁调用CLI的脚本不必每次都启动Node并完成认证。
+
+    守护进程只服务于启动它时的工作目录和访问令牌，工作目录或令牌不同的聊天请求会被拒绝。
+    """
+
+    def __init__(self, pool: CodyServerPool, socket_path: str | None = None) -> None:
+        """
+        初始化CodyDaemon实例。
+
+        参数:
+            pool (CodyServerPool): 已经初始化的进程池，守护进程退出时会被关闭。
+            socket_path (str | None): 套接字路径，默认由default_socket_path决定。
+        """
+        self.pool = pool
+        self.socket_path = socket_path or default_socket_path()
+        self._server: asyncio.AbstractServer | None = None
+        self._stopped = asyncio.Event()
+        self._clients: set[JsonRpcConnection] = set()
+        self.chats: int = 0  # 已处理的聊天请求数
+
+    async def start(self) -> None:
+        """
+        开始在套接字上监听。
+
+        套接字文件只允许当前用户访问。如果路径上残留着无人监听的套接字文件，会先将其删除。
+
+        异常:
+            CodyPyError: 如果已经有守护进程在该路径上运行。
+        """
+        if os.path.exists(self.socket_path):
+            if await is_daemon_running(self.socket_path):
+                raise CodyPyError(f"守护进程已经在 {self.socket_path} 上运行")
+            os.unlink(self.socket_path)
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        previous_umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(
+                self._serve, self.socket_path
+            )
+        finally:
+            os.umask(previous_umask)
+        logger.info("守护进程正在监听 %s", self.socket_path)
+
+    async def serve_forever(self) -> None:
+        """
+        持续提供服务，直到收到"daemon/stop"或当前任务被取消，然后关闭守护进程。
+        """
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.close()
+
+    def stop(self) -> None:
+        """
+        请求守护进程退出。
+        """
+        self._stopped.set()
+
+    async def close(self) -> None:
+        """
+        停止监听，断开所有客户端，关闭进程池并删除套接字文件。
+        """
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        await asyncio.gather(
+            *(client.close() for client in list(self._clients)),
+            return_exceptions=True,
+        )
+        await self.pool.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        为一个客户端连接提供服务，直到客户端断开。
+        """
+        connection = JsonRpcConnection(reader, writer)
+
+        async def _chat(params: Any) -> Dict[str, Any]:
+            return await self._chat(connection, params or {})
+
+        async def _status(params: Any) -> Dict[str, Any]:
+            return {
+                "chats": self.chats,
+                "clients": len(self._clients),
+                **self._identity(),
+                **self.pool.metrics(),
+            }
+
+        async def _stop(params: Any) -> None:
+            self.stop()
+
+        connection.register_request_handler(CHAT_METHOD, _chat)
+        connection.register_request_handler(STATUS_METHOD, _status)
+        connection.register_request_handler(STOP_METHOD, _stop)
+        self._clients.add(connection)
+        connection.start()
+        try:
+            await connection.wait_closed()
+        finally:
+            self._clients.discard(connection)
+            # 取消该客户端仍在进行中的聊天，代理会收到$/cancelRequest
+            await connection.close()
+            writer.close()
+
+    def _identity(self) -> Dict[str, Any]:
+        """
+        返回守护进程服务的工作目录和访问令牌的哈希。
+        """
+        configuration = self.pool.agent_specs.extensionConfiguration
+        return {
+            "workspace_root_uri": self.pool.agent_specs.workspaceRootUri,
+            "account": _token_digest(
+                configuration.accessToken if configuration else None
+            ),
+        }
+
+    def _check_identity(self, params: Dict[str, Any]) -> None:
+        """
+        检查聊天请求的工作目录和访问令牌是否与守护进程一致，请求中没有的字段不检查。
+
+        异常:
+            CodyPyError: 如果不一致。
+        """
+        identity = self._identity()
+        workspace_root_uri = params.get("workspace_root_uri")
+        if (
+            workspace_root_uri is not None
+            and workspace_root_uri != identity["workspace_root_uri"]
+        ):
+            raise CodyPyError(
+                f"守护进程服务于工作目录 {identity['workspace_root_uri']}，"
+                f"不能处理 {workspace_root_uri} 的请求"
+            )
+        account = params.get("account")
+        if account is not None and account != identity["account"]:
+            raise CodyPyError("守护进程使用的访问令牌与请求的不同")
+
+    async def _chat(
+        self, connection: JsonRpcConnection, params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        处理"daemon/chat"：在新的聊天会话中回答一条消息，并把文本增量推送给客户端。
+        回答之后会话在代理中被删除。
+
+        参数:
+            connection (JsonRpcConnection): 发起请求的客户端连接。
+            params (Dict[str, Any]): 请求参数，包含message、stream、enhanced_context、
+                show_context_files、context_files，以及可选的workspace_root_uri和account（访问令牌的哈希）。
+
+        返回:
+            Dict[str, Any]: 完整的回答文本"text"和上下文文件"context_files"。
+
+        异常:
+            CodyPyError: 如果请求的工作目录或访问令牌与守护进程不一致。
+        """
+        self._check_identity(params)
+        self.chats += 1
+        stream = params.get("stream")
+        session = await self.pool.new_chat()
+        text = ""
+        try:
+            async for delta in session.chat_stream(
+                message=params["message"],
+                enhanced_context=params.get("enhanced_context", False),
+                show_context_files=params.get("show_context_files", False),
+                context_files=params.get("context_files"),
+            ):
+                text += delta
+                if stream is not None:
+                    await connection.notify(
+                        CHAT_DELTA_NOTIFICATION, {"stream": stream, "delta": delta}
+                    )
+        finally:
+            self.pool.release(session)
+            await session.delete()
+        return {"text": text, "context_files": session.last_context_files}
+
+
+class DaemonClient:
+    """
+    连接到CodyDaemon的轻量客户端。
+    """
+
+    @classmethod
+    async def connect(cls, socket_path: str | None = None) -> "DaemonClient":
+        """
+        连接到守护进程。
+
+        参数:
+            socket_path (str | None): 套接字路径，默认由default_socket_path决定。
+
+        返回:
+            DaemonClient: 已连接的客户端。
+
+        异常:
+            OSError: 如果守护进程没有运行。
+        """
+        reader, writer = await asyncio.open_unix_connection(
+            socket_path or default_socket_path()
+        )
+        return cls(reader, writer)
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        初始化DaemonClient实例。通常应使用DaemonClient.connect创建客户端。
+
+        参数:
+            reader (asyncio.StreamReader): 从守护进程读取的流。
+            writer (asyncio.StreamWriter): 写往守护进程的流。
+        """
+        self._writer = writer
+        self.connection = JsonRpcConnection(
+            reader, writer, timeouts=DAEMON_REQUEST_TIMEOUTS
+        )
+        self.connection.register_notification_handler(
+            CHAT_DELTA_NOTIFICATION, self._on_delta
+        )
+        self._streams: Dict[int, asyncio.Queue] = {}
+        self._stream_ids = itertools.count(1)
+        self.connection.start()
+        # 守护进程回答后保存上下文文件，与ChatSession.last_context_files一致
+        self.last_context_files: list[str] = []
+
+    async def _on_delta(self, params: Any) -> None:
+        """
+        把守护进程推送的文本增量交给对应的chat_stream。
+        """
+        if queue := self._streams.get(params.get("stream")):
+            queue.put_nowait(params.get("delta", ""))
+
+    async def chat_stream(
+        self,
+        message: str,
+        enhanced_context: bool = False,
+        show_context_files: bool = False,
+        context_files: list | None = None,
+        workspace_root_uri: str | None = None,
+        access_token: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        通过守护进程发送一条聊天消息，并在回答生成时逐段产出新增的文本。
+
+        参数与CodyAgent.chat_stream相同，每次调用都在守护进程中使用一个新的聊天会话。
+        指定workspace_root_uri或access_token时，守护进程会拒绝与自己不一致的请求。
+
+        产生:
+            str: 回答文本的增量片段。
+        """
+        stream = next(self._stream_ids)
+        params = {
+            "stream": stream,
+            "message": message,
+            "enhanced_context": enhanced_context,
+            "show_context_files": show_context_files,
+            "context_files": context_files or [],
+        }
+        if workspace_root_uri is not None:
+            params["workspace_root_uri"] = workspace_root_uri
+        if access_token is not None:
+            params["account"] = _token_digest(access_token)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._streams[stream] = queue
+        submit = asyncio.create_task(self.connection.request(CHAT_METHOD, params))
+        streamed = ""
+        try:
+            while not submit.done():
+                update = asyncio.create_task(queue.get())
+                await asyncio.wait(
+                    {update, submit}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not update.done():
+                    update.cancel()
+                    continue
+                streamed += update.result()
+                yield update.result()
+            result = submit.result()
+            while not queue.empty():
+                delta = queue.get_nowait()
+                streamed += delta
+                yield delta
+            # 响应可能先于最后几条通知被处理，以完整的回答为准补齐剩余的文本
+            if delta := _text_delta(streamed, result["text"]):
+                yield delta
+            self.last_context_files = result.get("context_files", [])
+        finally:
+            self._streams.pop(stream, None)
+            if not submit.done():
+                submit.cancel()
+
+    async def status(self) -> Dict[str, Any]:
+        """
+        返回守护进程的状态和进程池指标。
+        """
+        return await self.connection.request(STATUS_METHOD)
+
+    async def serves(
+        self, workspace_root_uri: str | None, access_token: str | None
+    ) -> bool:
+        """
+        检查守护进程是否服务于指定的工作目录和访问令牌，为None的参数不检查。
+
+        返回:
+            bool: 指定的参数都一致时为True。
+        """
+        status = await self.status()
+        if (
+            workspace_root_uri is not None
+            and status.get("workspace_root_uri") != workspace_root_uri
+        ):
+            return False
+        return access_token is None or status.get("account") == _token_digest(
+            access_token
+        )
+
+    async def stop_daemon(self) -> None:
+        """
+        请求守护进程退出。
+        """
+        await self.connection.request(STOP_METHOD)
+
+    async def close(self) -> None:
+        """
+        断开与守护进程的连接。
+        """
+        await self.connection.close()
+        self._writer.close()
+
+
+async def is_daemon_running(socket_path: str | None = None) -> bool:
+    """
+    检查守护进程是否正在运行。
+
+    参数:
+        socket_path (str | None): 套接字路径，默认由default_socket_path决定。
+
+    返回:
+        bool: 能够连接到套接字时为True。
+    """
+    path = socket_path or default_socket_path()
+    if not os.path.exists(path):
+        return False
+    try:
+        _, writer = await asyncio.open_unix_connection(path)
+    except OSError:
+        return False
+    writer.close()
+    return True
+
+
+async def run_daemon(
+    agent_specs: AgentSpecs,
+    cody_binary_file: str,
+    version: str = "5.5.14",
+    agents: int = 1,
+    socket_path: str | None = None,
+    **server_options: Any,
+) -> None:
+    """
+    启动进程池和守护进程，并一直运行到收到"daemon/stop"。
+
+    参数:
+        agent_specs (AgentSpecs): 初始化代理使用的代理规格。
+        cody_binary_file (str): Cody代理二进制文件的路径。
+        version (str): Cody代理的版本。
+        agents (int): 代理进程数。
+        socket_path (str | None): 套接字路径，默认由default_socket_path决定。
+        server_options: 传给CodyServer.init的其他参数。
+    """
+    pool = await CodyServerPool.init(
+        agents, agent_specs, cody_binary_file, version, **server_options
+    )
+    daemon = CodyDaemon(pool, socket_path)
+    try:
+        await daemon.start()
+    except BaseException:
+        await pool.close()
+        raise
+    await daemon.serve_forever()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    命令行入口: python -m codypy.daemon --binary_path ... --access_token ...
+    """
+    parser = argparse.ArgumentParser(description="codypy 本地代理守护进程")
+    parser.add_argument(
+        "--binary_path",
+        default=os.getenv("BINARY_PATH"),
+        help="Cody CLI 二进制文件的路径",
+    )
+    parser.add_argument(
+        "--access_token",
+        default=os.getenv("SRC_ACCESS_TOKEN"),
+        help="Sourcegraph 访问令牌",
+    )
+    parser.add_argument(
+        "--workspace_root_uri", default=os.path.abspath(os.getcwd()), help="工作目录"
+    )
+    parser.add_argument("--agents", type=int, default=1, help="代理进程数")
+    parser.add_argument("--socket", default=None, help="Unix套接字路径")
+    args = parser.parse_args(argv)
+    if not args.binary_path or not args.access_token:
+        parser.error(
+            "需要 --binary_path 和 --access_token（或 BINARY_PATH 和 SRC_ACCESS_TOKEN 环境变量）"
+        )
+
+    logging.basicConfig(level=logging.INFO)
+    agent_specs = AgentSpecs(
+        workspaceRootUri=args.workspace_root_uri,
+        extensionConfiguration={
+            "accessToken": args.access_token,
+            "codebase": "",
+            "customConfiguration": {},
+        },
+        capabilities=ClientCapabilities(chat="streaming"),
+    )
+    asyncio.run(
+        run_daemon(
+            agent_specs, args.binary_path, agents=args.agents, socket_path=args.socket
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
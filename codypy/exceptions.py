@@ -49,7 +49,20 @@ class AgentBinaryNotFoundError(CodyPyError):
         super().__init__(self.message)
 
 
-class ServerTCPConnectionError(CodyPyError):
+class ServerConnectionError(CodyPyError):
+    """
+    服务器连接错误异常。
+
+    当无法通过网络传输（TCP或Unix域套接字）连接到代理，
+    或者代理进程在开始监听之前就已经退出时抛出此异常。
+    """
+
+    def __init__(self, message="无法连接到Cody代理"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class ServerTCPConnectionError(ServerConnectionError):
     """
     服务器TCP连接错误异常。
     
@@ -60,3 +73,98 @@ class ServerTCPConnectionError(CodyPyError):
     def __init__(self, message="无法通过TCP连接到服务器"):
         self.message = message
         super().__init__(self.message)
+
+
+class JsonRpcError(CodyPyError):
+    """
+    JSON-RPC错误响应异常。
+
+    当代理对某个请求返回带有"error"字段的响应时抛出此异常。
+    code、message和data分别对应JSON-RPC错误对象中的同名字段。
+    """
+
+    def __init__(self, message="代理返回了JSON-RPC错误", code=None, data=None):
+        self.message = message
+        self.code = code
+        self.data = data
+        super().__init__(self.message)
+
+
+class AgentConnectionClosedError(CodyPyError):
+    """
+    代理连接已关闭异常。
+
+    当与Cody代理的连接已经断开（例如代理进程退出或流到达EOF）时，
+    所有尚未完成以及之后发起的请求都会收到此异常，而不是一直挂起。
+    """
+
+    def __init__(self, message="与Cody代理的连接已关闭"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class JsonRpcProtocolError(CodyPyError):
+    """
+    JSON-RPC协议错误异常。
+
+    当从代理读取到的数据无法按Content-Length帧格式解析时抛出此异常，
+    出现这种情况说明流已经错位，连接无法继续使用。
+    响应的结果与请求的类型不匹配时也会抛出此异常，这时连接仍然可以使用。
+    """
+
+    def __init__(self, message="无法解析JSON-RPC消息帧"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class RequestTimeoutError(CodyPyError):
+    """
+    请求超时异常。
+
+    当代理没有在请求的截止时间之前返回响应时抛出此异常。
+    抛出之前客户端已经向代理发送了"$/cancelRequest"，之后迟到的响应会被丢弃。
+    """
+
+    def __init__(self, message="等待代理响应超时", method=None, timeout=None):
+        self.message = message
+        self.method = method
+        self.timeout = timeout
+        super().__init__(self.message)
+
+
+class QueueOverflowError(CodyPyError):
+    """
+    通知队列溢出异常。
+
+    当通知队列已满且溢出策略为OverflowPolicy.RAISE时，由非阻塞写入抛出此异常。
+    """
+
+    def __init__(self, message="通知队列已满"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class AgentCrashedError(AgentConnectionClosedError):
+    """
+    代理进程崩溃或无响应异常。
+
+    当监督器发现代理进程已经退出或不再响应存活探测时，所有尚未完成以及重启期间发起的请求
+    都会立即收到此异常，而不是等到各自的截止时间。它是AgentConnectionClosedError的子类。
+    """
+
+    def __init__(self, message="Cody代理进程已崩溃或无响应"):
+        super().__init__(message)
+
+
+class ModelNotAvailableError(CodyPyError):
+    """
+    模型不可用异常。
+
+    当要设置的模型不在服务器为当前账户返回的模型列表中时，set_model在本地抛出此异常，
+    不再把未知的模型ID发送给代理。
+    """
+
+    def __init__(self, message="模型不可用", model=None):
+        self.message = message
+        self.model = model
+        super().__init__(self.message)
@@ -0,0 +1,445 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+from codypy.client_info import Models
+from codypy.codec import JsonCodec, get_codec
+from codypy.messaging import FrameDecoder, _write_jsonrpc_message
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# JSON-RPC标准错误码
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+REQUEST_CANCELLED = -32800
+
+
+@dataclass
+class FakeAgentOptions:
+    """
+    本地模拟代理的行为参数。
+
+    属性:
+        latency (float): 每个请求在处理前额外等待的时间（秒）
+        chunk_count (int): "chat/submitMessage"回答分成多少次推送
+        chunk_delay (float): 相邻两次推送之间的时间间隔（秒）
+        response_size (int): 每个回答的字符数
+        error_rate (float): 请求随机返回错误的概率，0到1之间
+        fail_methods (set[str]): 总是返回错误的方法
+        authenticated (bool): "initialize"是否报告已认证
+        seed (int | None): 随机数种子，指定后错误注入和回答内容可以复现
+    """
+
+    latency: float = 0.0
+    chunk_count: int = 5
+    chunk_delay: float = 0.01
+    response_size: int = 200
+    error_rate: float = 0.0
+    fail_methods: set[str] = field(default_factory=set)
+    authenticated: bool = True
+    seed: int | None = None
+
+    def to_args(self) -> list[str]:
+        """
+        把参数转换为命令行参数，与fake_agent_args配合使用。
+
+        返回:
+            list[str]: 命令行参数。
+        """
+        args = [
+            "--latency",
+            str(self.latency),
+            "--chunks",
+            str(self.chunk_count),
+            "--chunk-delay",
+            str(self.chunk_delay),
+            "--response-size",
+            str(self.response_size),
+            "--error-rate",
+            str(self.error_rate),
+        ]
+        for method in sorted(self.fail_methods):
+            args += ["--fail-method", method]
+        if not self.authenticated:
+            args.append("--unauthenticated")
+        if self.seed is not None:
+            args += ["--seed", str(self.seed)]
+        return args
+
+
+def fake_agent_args(options: FakeAgentOptions | None = None) -> list[str]:
+    """
+    返回通过CodyServer启动模拟代理所需的参数。
+
+    用法:
+        cody_server = await CodyServer.init(
+            cody_binary_file=sys.executable,
+            version="5.5.14",
+            agent_args=fake_agent_args(FakeAgentOptions(chunk_delay=0.05)),
+        )
+
+    参数:
+        options (FakeAgentOptions | None): 模拟代理的行为参数。
+
+    返回:
+        list[str]: 放在Python解释器之后的参数。
+    """
+    return ["-m", "codypy.fake_agent", *(options or FakeAgentOptions()).to_args()]
+
+
+class FakeCodyAgent:
+    """
+    用Python实现的Cody代理替身，用于离线的负载测试和延迟测试。
+
+    它说的是与真实代理相同的Content-Length帧JSON-RPC协议，实现了客户端用到的方法：
+    "initialize"、"chat/new"、"chat/restore"、"chat/submitMessage"（带流式推送）、"chat/delete"、"chat/models"、
+    "graphql/getRepoIds"、"webview/receiveMessage"和"shutdown"，
+    并可以注入延迟、错误和不同大小的回答。每个请求在独立的任务中处理，
+    因此可以同时处理多个请求，也支持"$/cancelRequest"。
+    """
+
+    def __init__(
+        self,
+        options: FakeAgentOptions | None = None,
+        codec: JsonCodec | None = None,
+    ) -> None:
+        """
+        初始化FakeCodyAgent实例。
+
+        参数:
+            options (FakeAgentOptions | None): 行为参数。
+            codec (JsonCodec | None): JSON编解码器。
+        """
+        self.options = options or FakeAgentOptions()
+        self.codec = codec or get_codec()
+        self._random = random.Random(self.options.seed)
+        self._chats: Dict[str, list[dict]] = {}
+        self._chat_ids = itertools.count(1)
+        self.request_count: int = 0
+        self._methods = {
+            "initialize": self._initialize,
+            "chat/new": self._chat_new,
+            "chat/restore": self._chat_restore,
+            "chat/submitMessage": self._chat_submit_message,
+            "chat/delete": self._chat_delete,
+            "chat/models": self._chat_models,
+            "graphql/getRepoIds": self._get_repo_ids,
+            "webview/receiveMessage": self._receive_webview_message,
+            "shutdown": self._shutdown,
+        }
+
+    async def serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        在一对读写流上为一个客户端提供服务，直到流结束或收到"exit"通知。
+
+        参数:
+            reader (asyncio.StreamReader): 客户端发来的数据。
+            writer (asyncio.StreamWriter): 发给客户端的数据。
+        """
+        decoder = FrameDecoder()
+        in_flight: Dict[Any, asyncio.Task] = {}
+        try:
+            while data := await reader.read(64 * 1024):
+                for body in decoder.feed(data):
+                    message = self.codec.decode_message(body)
+                    params = self.codec.decode_payload(message.params)
+                    if message.method == "exit":
+                        return
+                    if message.method == "$/cancelRequest":
+                        if task := in_flight.get((params or {}).get("id")):
+                            task.cancel()
+                        continue
+                    if message.id is None or message.method is None:
+                        continue
+                    task = asyncio.create_task(
+                        self._handle(writer, message.id, message.method, params)
+                    )
+                    in_flight[message.id] = task
+                    task.add_done_callback(
+                        lambda _, message_id=message.id: in_flight.pop(message_id, None)
+                    )
+        finally:
+            for task in list(in_flight.values()):
+                task.cancel()
+            writer.close()
+
+    async def serve_stdio(self) -> None:
+        """
+        通过标准输入输出提供服务，与"cody api jsonrpc-stdio"相同。
+        """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer
+        )
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, sys.stdout.buffer
+        )
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        await self.serve(reader, writer)
+
+    async def serve_tcp(self, host: str, port: int) -> asyncio.AbstractServer:
+        """
+        在TCP端口上监听，每个连接都由serve处理。
+
+        参数:
+            host (str): 监听地址。
+            port (int): 监听端口，为0时由系统分配。
+
+        返回:
+            asyncio.AbstractServer: 已开始监听的服务器。
+        """
+        server = await asyncio.start_server(self.serve, host, port)
+        logger.info("模拟代理正在监听 %s", server.sockets[0].getsockname())
+        return server
+
+    async def serve_unix(self, path: str) -> asyncio.AbstractServer:
+        """
+        在Unix域套接字上监听，每个连接都由serve处理。
+
+        参数:
+            path (str): 套接字路径。
+
+        返回:
+            asyncio.AbstractServer: 已开始监听的服务器。
+        """
+        server = await asyncio.start_unix_server(self.serve, path)
+        logger.info("模拟代理正在监听 %s", path)
+        return server
+
+    async def _handle(
+        self, writer: asyncio.StreamWriter, message_id: Any, method: str, params: Any
+    ) -> None:
+        """
+        处理一个请求并写回响应，按参数注入延迟和错误。
+        """
+        self.request_count += 1
+        response: Dict[str, Any] = {"jsonrpc": "2.0", "id": message_id}
+        try:
+            if self.options.latency > 0:
+                await asyncio.sleep(self.options.latency)
+            handler = self._methods.get(method)
+            if handler is None:
+                response["error"] = {
+                    "code": METHOD_NOT_FOUND,
+                    "message": f"方法不存在: {method}",
+                }
+            elif method in self.options.fail_methods or (
+                self._random.random() < self.options.error_rate
+            ):
+                response["error"] = {"code": INTERNAL_ERROR, "message": "注入的错误"}
+            else:
+                response["result"] = await handler(writer, params)
+        except asyncio.CancelledError:
+            response["error"] = {"code": REQUEST_CANCELLED, "message": "请求已取消"}
+        except Exception as exc:
+            logger.exception("模拟代理处理%s时出错", method)
+            response["error"] = {"code": INTERNAL_ERROR, "message": str(exc)}
+        if not writer.is_closing():
+            await _write_jsonrpc_message(writer, response, self.codec)
+
+    async def _initialize(self, writer, params) -> dict:
+        endpoint = "https://sourcegraph.com"
+        if isinstance(params, dict):
+            endpoint = (params.get("extensionConfiguration") or {}).get(
+                "serverEndpoint", endpoint
+            )
+        authenticated = self.options.authenticated
+        return {
+            "name": "fake-cody-agent",
+            "authenticated": authenticated,
+            "codyEnabled": True,
+            "codyVersion": "5.5.14",
+            "authStatus": {
+                "endpoint": endpoint,
+                "showInvalidAccessTokenError": not authenticated,
+                "authenticated": authenticated,
+                "hasVerifiedEmail": True,
+                "requiresVerifiedEmail": False,
+                "siteVersion": "fake",
+                "userCanUpgrade": False,
+                "username": "fake-user",
+                "primaryEmail": "fake@example.com",
+                "displayName": "Fake User",
+                "avatarURL": "",
+            },
+        }
+
+    async def _chat_new(self, writer, params) -> str:
+        chat_id = f"fake-chat-{next(self._chat_ids)}"
+        self._chats[chat_id] = []
+        return chat_id
+
+    async def _chat_restore(self, writer, params) -> str:
+        chat_id = await self._chat_new(writer, params)
+        self._chats[chat_id] = list(params.get("messages") or [])
+        return chat_id
+
+    async def _chat_submit_message(self, writer, params) -> dict:
+        chat_id = params["id"]
+        message = params["message"]
+        messages = self._chats.setdefault(chat_id, [])
+        messages.append(
+            {
+                "speaker": "human",
+                "text": message.get("text", ""),
+                "contextFiles": message.get("contextFiles") or [],
+            }
+        )
+        answer = self._answer()
+        reply = {"speaker": "assistant"}
+        messages.append(reply)
+
+        chunk_count = max(self.options.chunk_count, 1)
+        for chunk in range(1, chunk_count):
+            reply["text"] = answer[: len(answer) * chunk // chunk_count]
+            await self._post_transcript(writer, chat_id, messages, True)
+            await asyncio.sleep(self.options.chunk_delay)
+        reply["text"] = answer
+        await self._post_transcript(writer, chat_id, messages, False)
+        return self._transcript(chat_id, messages, False)
+
+    async def _chat_delete(self, writer, params) -> list:
+        self._chats.pop(params["chatId"], None)
+        return []
+
+    async def _chat_models(self, writer, params) -> dict:
+        return {
+            "models": [
+                {
+                    "id": model.value.model_id,
+                    "title": model.value.model_name,
+                    "provider": model.value.model_id.split("/")[0],
+                    "usage": ["chat", "edit"],
+                    "tags": [],
+                }
+                for model in Models
+            ]
+        }
+
+    async def _get_repo_ids(self, writer, params) -> dict:
+        names = params.get("names", [])
+        names = names[: params.get("first", len(names))]
+        return {"repos": [{"name": name, "id": f"fake-repo-{name}"} for name in names]}
+
+    async def _receive_webview_message(self, writer, params) -> None:
+        return None
+
+    async def _shutdown(self, writer, params) -> None:
+        return None
+
+    def _answer(self) -> str:
+        """
+        生成一段指定长度的回答文本。
+        """
+        words = ("cody", "python", "agent", "代码", "context", "stream", "token")
+        text = ""
+        while len(text) < self.options.response_size:
+            text += self._random.choice(words) + " "
+        return text[: self.options.response_size]
+
+    @staticmethod
+    def _transcript(chat_id: str, messages: list[dict], in_progress: bool) -> dict:
+        return {
+            "type": "transcript",
+            "messages": messages,
+            "isMessageInProgress": in_progress,
+            "chatID": chat_id,
+        }
+
+    async def _post_transcript(
+        self, writer, chat_id: str, messages: list[dict], in_progress: bool
+    ) -> None:
+        """
+        以"webview/postMessage"通知推送当前的transcript。
+        """
+        notification = {
+            "jsonrpc": "2.0",
+            "method": "webview/postMessage",
+            "params": {
+                "id": chat_id,
+                "message": self._transcript(chat_id, messages, in_progress),
+            },
+        }
+        await _write_jsonrpc_message(writer, notification, self.codec)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    命令行入口：python -m codypy.fake_agent [选项] [api jsonrpc-stdio]
+
+    与真实代理一样，环境变量CODY_AGENT_DEBUG_REMOTE为"true"时改为在TCP端口上监听，
+    端口默认取自CODY_AGENT_DEBUG_PORT。指定--socket时在Unix域套接字上监听。
+    """
+    parser = argparse.ArgumentParser(description="用于测试的本地模拟Cody代理")
+    parser.add_argument("command", nargs="*", help="兼容真实代理的子命令，会被忽略")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="每个请求的额外延迟（秒）"
+    )
+    parser.add_argument("--chunks", type=int, default=5, help="每个回答的推送次数")
+    parser.add_argument(
+        "--chunk-delay", type=float, default=0.01, help="推送间隔（秒）"
+    )
+    parser.add_argument("--response-size", type=int, default=200, help="回答的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机错误的概率")
+    parser.add_argument(
+        "--fail-method",
+        action="append",
+        default=[],
+        help="总是返回错误的方法，可重复指定",
+    )
+    parser.add_argument("--unauthenticated", action="store_true", help="报告未认证")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    parser.add_argument("--host", default="localhost", help="TCP模式的监听地址")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=int(os.environ.get("CODY_AGENT_DEBUG_PORT", "3113")),
+        help="TCP模式的监听端口",
+    )
+    parser.add_argument("--socket", default=None, help="在该Unix域套接字路径上监听")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    agent = FakeCodyAgent(
+        FakeAgentOptions(
+            latency=args.latency,
+            chunk_count=args.chunks,
+            chunk_delay=args.chunk_delay,
+            response_size=args.response_size,
+            error_rate=args.error_rate,
+            fail_methods=set(args.fail_method),
+            authenticated=not args.unauthenticated,
+            seed=args.seed,
+        )
+    )
+
+    async def _run() -> None:
+        if args.socket is not None:
+            server = await agent.serve_unix(args.socket)
+            async with server:
+                await server.serve_forever()
+        elif os.environ.get("CODY_AGENT_DEBUG_REMOTE") == "true":
+            server = await agent.serve_tcp(args.host, args.port)
+            async with server:
+                await server.serve_forever()
+        else:
+            await agent.serve_stdio()
+
+    try:
+        asyncio.run(_run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 处理代理请求的函数：接收请求参数，返回值作为响应的"result"
+RequestHandler = Callable[[Any], Awaitable[Any]]
+# 处理代理通知的函数：接收通知参数，不需要返回值
+NotificationHandler = Callable[[Any], Awaitable[None]]
+
+
+def _reply_with(result: Any) -> RequestHandler:
+    """
+    创建一个立即返回固定结果的请求处理函数。
+
+    参数:
+        result (Any): 要返回给代理的结果。
+
+    返回:
+        RequestHandler: 请求处理函数。
+    """
+
+    async def _handler(params: Any) -> Any:
+        return result
+
+    return _handler
+
+
+async def _log_show_message(params: Any) -> None:
+    """
+    记录代理要求显示的窗口消息。
+
+    参数:
+        params (Any): "window/showMessage"的参数，通常包含"severity"和"message"。
+    """
+    if isinstance(params, dict):
+        logger.info("代理消息 [%s]: %s", params.get("severity"), params.get("message"))
+    else:
+        logger.info("代理消息: %s", params)
+
+
+async def _handle_show_message(params: Any) -> None:
+    """
+    处理以请求形式发送的窗口消息。客户端没有可供选择的按钮，总是回复null。
+
+    参数:
+        params (Any): "window/showMessage"的参数。
+    """
+    await _log_show_message(params)
+    return None
+
+
+async def _log_debug_message(params: Any) -> None:
+    """
+    将代理的调试输出转发到日志。
+
+    参数:
+        params (Any): "debug/message"的参数，通常包含"channel"和"message"。
+    """
+    if isinstance(params, dict):
+        logger.debug("[%s] %s", params.get("channel"), params.get("message"))
+    else:
+        logger.debug("代理调试消息: %s", params)
+
+
+async def _log_notification(params: Any) -> None:
+    """
+    仅记录通知内容的处理函数，用于客户端不关心的通知。
+
+    参数:
+        params (Any): 通知的参数。
+    """
+    logger.debug("代理通知: %s", params)
+
+
+# 内置的代理请求处理函数。客户端不支持编辑器相关的能力，
+# 因此对这些请求立即给出"未执行"的回复，避免代理一直等待直到超时。
+DEFAULT_REQUEST_HANDLERS: Dict[str, RequestHandler] = {
+    "window/showMessage": _handle_show_message,
+    "window/showSaveDialog": _reply_with(None),
+    "textDocument/edit": _reply_with(False),
+    "textDocument/show": _reply_with(False),
+    "textDocument/openUntitledDocument": _reply_with(None),
+    "workspace/edit": _reply_with(False),
+    "env/openExternal": _reply_with(False),
+    "secrets/get": _reply_with(None),
+    "secrets/store": _reply_with(None),
+    "secrets/delete": _reply_with(None),
+}
+
+# 内置的代理通知处理函数
+DEFAULT_NOTIFICATION_HANDLERS: Dict[str, NotificationHandler] = {
+    "window/showMessage": _log_show_message,
+    "debug/message": _log_debug_message,
+    "progress/start": _log_notification,
+    "progress/report": _log_notification,
+    "progress/end": _log_notification,
+    "window/didChangeContext": _log_notification,
+}
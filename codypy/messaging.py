@@ -1,23 +1,27 @@
 import asyncio
 import logging
 from json import JSONDecodeError
-from typing import Any, AsyncGenerator, Dict, Tuple
+from typing import Any, Callable, Dict, Tuple
 
 import pydantic_core as pd
 
+from codypy.codec import JsonCodec
 from codypy.config import Configs
+from codypy.exceptions import JsonRpcProtocolError
+from codypy.protocol import ChatMessage, Transcript
 
 # 设置日志记录器
 logger = logging.getLogger(__name__)
-stream_logger = logging.getLogger(f"{__name__}.stream")
-
-# 全局消息ID，用于标识每个JSON-RPC请求
-MESSAGE_ID = 1
 
 
 async def _send_jsonrpc_request(
-    writer: asyncio.StreamWriter, method: str, params: Dict[str, Any] | None
-) -> None:
+    writer: asyncio.StreamWriter,
+    method: str,
+    params: Dict[str, Any] | None,
+    message_id: int | None = None,
+    codec: JsonCodec | None = None,
+    on_encoded: Callable[[bytes], None] | None = None,
+) -> bytes:
     """
     向服务器发送JSON-RPC请求。
 
@@ -25,78 +29,222 @@ async def _send_jsonrpc_request(
         writer: 用于发送请求的asyncio StreamWriter。
         method: 要调用的JSON-RPC方法。
         params: 传递给JSON-RPC方法的参数，如果不需要参数则为None。
+        message_id: 请求ID，由所属连接分配；为None时作为通知发送（不带"id"）。
+        codec: 用于编码消息的编解码器，默认使用pydantic_core。
+        on_encoded: 可选的回调，在写入流之前以消息体调用。
+
+    返回:
+        bytes: 已发送的消息体（不含头部）。
 
     异常:
         无
     """
-    global MESSAGE_ID
-    message: Dict[str, Any] = {
-        "jsonrpc": "2.0",
-        "id": MESSAGE_ID,
-        "method": method,
-        "params": params,
-    }
+    message: Dict[str, Any] = {"jsonrpc": "2.0"}
+    if message_id is not None:
+        message["id"] = message_id
+    message["method"] = method
+    message["params"] = params
+
+    return await _write_jsonrpc_message(writer, message, codec, on_encoded)
+
+
+async def _send_jsonrpc_response(
+    writer: asyncio.StreamWriter,
+    message_id: int | str,
+    result: Any = None,
+    error: Dict[str, Any] | None = None,
+    codec: JsonCodec | None = None,
+    on_encoded: Callable[[bytes], None] | None = None,
+) -> bytes:
+    """
+    回复代理发来的JSON-RPC请求。
+
+    参数:
+        writer: 用于发送响应的asyncio StreamWriter。
+        message_id: 代理请求的ID。
+        result: 成功时的结果，可以为None。
+        error: 失败时的JSON-RPC错误对象（包含"code"和"message"），此时忽略result。
+        codec: 用于编码消息的编解码器，默认使用pydantic_core。
+        on_encoded: 可选的回调，在写入流之前以消息体调用。
+
+    返回:
+        bytes: 已发送的消息体（不含头部）。
+    """
+    message: Dict[str, Any] = {"jsonrpc": "2.0", "id": message_id}
+    if error is not None:
+        message["error"] = error
+    else:
+        message["result"] = result
+    return await _write_jsonrpc_message(writer, message, codec, on_encoded)
+
+
+async def _write_jsonrpc_message(
+    writer: asyncio.StreamWriter,
+    message: Dict[str, Any],
+    codec: JsonCodec | None = None,
+    on_encoded: Callable[[bytes], None] | None = None,
+) -> bytes:
+    """
+    将一条JSON-RPC消息编码为Content-Length帧并写入流。
 
+    参数:
+        writer: 目标asyncio StreamWriter。
+        message: 要发送的JSON-RPC消息。
+        codec: 用于编码消息的编解码器，默认使用pydantic_core。
+        on_encoded: 可选的回调，在写入流之前以消息体调用。录制时用它保证发送帧先于对应的响应被记录。
+
+    返回:
+        bytes: 已发送的消息体（不含头部），供录制等用途使用。
+    """
     # 将消息转换为JSON字符串
-    json_message: bytes = pd.to_json(message)
+    json_message: bytes = codec.encode(message) if codec else pd.to_json(message)
     content_length: int = len(json_message)
     content_message: bytes = (
         f"Content-Length: {content_length}\r\n\r\n".encode() + json_message
     )
 
+    if on_encoded is not None:
+        on_encoded(json_message)
+
     # 向服务器发送JSON-RPC消息
     writer.write(content_message)
     await writer.drain()
-    MESSAGE_ID += 1
+    return json_message
 
 
-async def _receive_jsonrpc_messages(reader: asyncio.StreamReader) -> str:
+# 头部块的最大长度。正常的头部只有几十个字节，超过这个长度说明流已经错位
+MAX_HEADER_SIZE = 8192
+HEADER_TERMINATOR = b"\r\n\r\n"
+
+
+def _parse_content_length(headers: bytes) -> int:
     """
-    从提供的`asyncio.StreamReader`中读取JSON-RPC消息。
+    从头部块中解析Content-Length的值。
+
+    头部按字节解析，不区分大小写，也不依赖头部的顺序，
+    其他头部（例如Content-Type）会被忽略。
 
     参数:
-        reader: 用于读取消息的`asyncio.StreamReader`。
+        headers (bytes): 不含结尾空行的头部块。
 
     返回:
-        JSON-RPC消息字符串。
+        int: 消息体的字节数。
 
     异常:
-        asyncio.TimeoutError: 如果在5秒超时内无法读取消息。
+        JsonRpcProtocolError: 如果头部中没有合法的Content-Length。
     """
-    headers: bytes = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5.0)
-    content_length: int = int(
-        headers.decode("utf-8").split("Content-Length:")[1].strip()
-    )
+    for line in headers.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            try:
+                content_length = int(value)
+            except ValueError:
+                break
+            if content_length >= 0:
+                return content_length
+            break
+    raise JsonRpcProtocolError(f"无效的JSON-RPC消息头: {bytes(headers)!r}")
+
+
+class FrameDecoder:
+    """
+    增量式的Content-Length帧解码器。
 
-    json_data: bytes = await asyncio.wait_for(
-        reader.readexactly(content_length), timeout=5.0
-    )
-    return json_data.decode("utf-8")
+    每次读取到的数据通过feed()送入解码器，它会从缓冲区中取出所有已经完整的帧，
+    一次读取中包含的多个帧会被一起返回，不完整的部分留在缓冲区等待下一次读取。
+    头部在字节层面解析，消息体以缓冲区上的memoryview切片交给JSON解析器，不复制也不先解码为str。
 
+    缓冲区用读取偏移量记录已经取出的部分，只有已取出的前缀超过缓冲区的一半时才整理（移除前缀），
+    因此每个字节平均只被移动常数次。解码结果（例如msgspec.Raw）可能仍然引用旧的缓冲区，
+    这时缓冲区不能原地修改，未取出的部分会被复制到新的缓冲区中，旧的缓冲区随引用一起释放。
+    """
 
-async def _handle_server_respones(
-    reader: asyncio.StreamReader,
-) -> AsyncGenerator[Dict[str, Any], Any]:
+    def __init__(self) -> None:
+        """
+        初始化FrameDecoder实例。
+        """
+        self._buffer = bytearray()
+        self._offset: int = 0  # 缓冲区中已经取出的字节数
+        self._body_length: int | None = None  # 当前帧消息体的长度，None表示正在等待头部
+
+    def feed(self, data: bytes) -> list[memoryview]:
+        """
+        送入新读取的数据，并返回所有已经完整的消息体。
+
+        参数:
+            data (bytes): 从流中读取到的数据。
+
+        返回:
+            list[memoryview]: 按顺序排列的完整消息体，可能为空。它们引用解码器的缓冲区，
+                在下一次feed()之前使用或复制。
+
+        异常:
+            JsonRpcProtocolError: 如果头部过长或无法解析。
+        """
+        self._append(data)
+        buffer = self._buffer
+        view = memoryview(buffer)
+        offset = self._offset
+        bodies: list[memoryview] = []
+        while True:
+            if self._body_length is None:
+                end = buffer.find(HEADER_TERMINATOR, offset)
+                if end < 0:
+                    if len(buffer) - offset > MAX_HEADER_SIZE:
+                        raise JsonRpcProtocolError("JSON-RPC消息头过长")
+                    break
+                self._body_length = _parse_content_length(bytes(view[offset:end]))
+                offset = end + len(HEADER_TERMINATOR)
+
+            if len(buffer) - offset < self._body_length:
+                break
+            bodies.append(view[offset : offset + self._body_length])
+            offset += self._body_length
+            self._body_length = None
+        self._offset = offset
+        return bodies
+
+    def _append(self, data: bytes) -> None:
+        """
+        把数据追加到缓冲区，必要时先整理缓冲区。
+        """
+        buffer = self._buffer
+        if self._offset == len(buffer):
+            # 上次的数据已经全部取出，直接换用新的缓冲区
+            self._buffer = bytearray(data)
+            self._offset = 0
+            return
+        try:
+            if self._offset > len(buffer) // 2:
+                del buffer[: self._offset]
+                self._offset = 0
+            buffer += data
+        except BufferError:
+            # 上次取出的消息体仍被引用，不能原地修改
+            self._buffer = bytearray(memoryview(buffer)[self._offset :])
+            self._buffer += data
+            self._offset = 0
+
+
+async def _receive_jsonrpc_messages(reader: asyncio.StreamReader) -> bytes:
     """
-    异步处理服务器响应，从提供的`asyncio.StreamReader`中读取JSON-RPC消息。
+    从提供的`asyncio.StreamReader`中读取一条JSON-RPC消息。
 
-    此函数会产生每个JSON-RPC响应作为字典，直到发生超时。
+    连接的后台读取任务使用FrameDecoder批量解码；此函数用于只需要逐条读取的场合。
 
     参数:
-        reader: 用于读取JSON-RPC消息的`asyncio.StreamReader`。
+        reader: 用于读取消息的`asyncio.StreamReader`。
 
-    产生:
-        表示JSON-RPC响应的字典。
+    返回:
+        JSON-RPC消息体的原始字节，可以直接交给JSON解析器。
 
     异常:
-        asyncio.TimeoutError: 如果在5秒超时内无法读取JSON-RPC消息。
+        asyncio.IncompleteReadError: 如果流在读完一条消息之前到达EOF。
+        JsonRpcProtocolError: 如果消息头无法解析。
     """
-    try:
-        while True:
-            response: str = await _receive_jsonrpc_messages(reader)
-            yield pd.from_json(response)
-    except asyncio.TimeoutError:
-        yield pd.from_json("{}")
+    headers: bytes = await reader.readuntil(HEADER_TERMINATOR)
+    content_length = _parse_content_length(headers[: -len(HEADER_TERMINATOR)])
+    return await reader.readexactly(content_length)
 
 
 async def _has_method(json_response: Dict[str, Any]) -> bool:
@@ -187,87 +335,97 @@ async def _handle_json_data(json_data, configs: Configs) -> Dict[str, Any] | Non
     return json_response
 
 
+def _context_file_ranges(message: ChatMessage) -> list[str]:
+    """
+    返回一条消息中带有行范围的上下文文件，格式为"路径:起始行-结束行"。
+    """
+    return [
+        f"{reso.uri.path}:{reso.range.start.line}-{reso.range.end.line}"
+        for reso in message.contextFiles
+        if reso.range is not None
+    ]
+
+
+def _last_turn_start(messages: list[ChatMessage]) -> int:
+    """
+    返回最后一轮对话（从最后一条用户消息开始）的第一条消息的下标，没有用户消息时为0。
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].speaker == "human":
+            return index
+    return 0
+
+
 async def _show_last_message(
-    messages: Dict[str, Any],
+    messages: Transcript | None,
     show_context_files: bool,
 ) -> Tuple[str, str, list[str]]:
     """
     检索消息记录中最后一条消息的发言者和文本。
 
     参数:
-        messages (Dict[str, Any]): 包含消息历史的字典。
+        messages (Transcript | None): 包含消息历史的transcript。
+        show_context_files (bool): 是否同时收集最后一轮对话中上下文文件的行范围（已去重）。
 
     返回:
-        Tuple[str, str]: 包含最后一条消息的发言者和文本的元组。
+        Tuple[str, str, list[str]]: 包含最后一条消息的发言者、文本和上下文文件的元组。
     """
-    if messages is not None and messages["type"] == "transcript":
-        last_message = messages["messages"][-1:][0]
+    if messages is not None and messages.type == "transcript" and messages.messages:
+        last_message = messages.messages[-1]
         logger.debug("最后一条消息: %s", last_message)
-        speaker: str = last_message["speaker"]
-        text: str = last_message["text"]
+        speaker: str = last_message.speaker
+        # 进行中的助手消息在生成出第一个字之前可能还没有文本
+        text: str = last_message.text or ""
 
         context_file_results = []
         if show_context_files:
-            context_files: list[any] = messages["messages"]
-
-            for context_result in context_files:
-                res = (
-                    context_result["contextFiles"]
-                    if "contextFiles" in context_result
-                    else []
-                )
-                for reso in res:
-                    uri = reso["uri"]["path"]
-                    if "range" in reso:
-                        rng = reso["range"]
-                        rng_start = rng["start"]["line"]
-                        rng_end = rng["end"]["line"]
-                        context_file_results.append(f"{uri}:{rng_start}-{rng_end}")
+            # 只看最后一轮对话，而不是从头遍历整个transcript
+            ranges: Dict[str, None] = {}
+            for message in messages.messages[_last_turn_start(messages.messages) :]:
+                ranges.update(dict.fromkeys(_context_file_ranges(message)))
+            context_file_results = list(ranges)
 
         return speaker, text, context_file_results
     return ("", "", [])
 
 
-async def _show_messages(message, configs: Configs) -> None:
+async def _show_messages(message: Transcript, configs: Configs) -> None:
     """
     打印消息记录中每条消息的发言者和文本。
 
     参数:
-        message (dict): 包含消息历史的字典，其中"type"键设置为"transcript"，
-                        "messages"键包含消息字典列表。
+        message (Transcript): 类型为"transcript"的消息记录。
         configs (Configs): 处理过程中使用的配置设置。
 
     返回:
         无
     """
-    if message["type"] == "transcript":
-        for message in message["messages"]:
-            logger.debug("%s: %s", message["speaker"], message["text"])
+    if message.type == "transcript":
+        for chat_message in message.messages:
+            logger.debug("%s: %s", chat_message.speaker, chat_message.text)
 
 
-async def request_response(method_name: str, params, reader, writer) -> Any:
+def _text_delta(previous: str, current: str) -> str:
     """
-    向服务器发送JSON-RPC请求并处理响应。
+    计算两次连续的进行中消息文本之间新增的部分。
+
+    代理每次推送的都是到目前为止的完整回答文本，因此通常新文本以旧文本为前缀，
+    增量就是多出来的后缀。如果代理改写了已发送的内容（新文本不以旧文本为前缀），
+    则无法撤回已经输出的部分，只返回公共前缀之后的新内容。
 
     参数:
-        method_name (str): 要调用的JSON-RPC方法的名称。
-        params: 传递给JSON-RPC方法的参数。
-        reader (asyncio.StreamReader): 用于接收响应的读取器流。
-        writer (asyncio.StreamWriter): 用于发送请求的写入器流。
+        previous (str): 上一次看到的完整文本。
+        current (str): 本次收到的完整文本。
 
     返回:
-        Any: JSON-RPC请求的结果，如果没有可用结果则返回None。
-    """
-    logger.debug("发送命令: %s - %s", method_name, params)
-    await _send_jsonrpc_request(writer, method_name, params)
-    async for response in _handle_server_respones(reader):
-        params = response.get("params", {})
-        if not isinstance(params, dict):
-            continue
-        if params.get("isMessageInProgress"):
-            stream_logger.debug("进行中的响应: %s", response)
-        if response and await _has_result(response):
-            logger.debug("响应: %s", response)
-            return response["result"]
-
-    return None
+        str: 新增的文本片段，没有新内容时为空字符串。
+    """
+    if current.startswith(previous):
+        return current[len(previous) :]
+    common = 0
+    for old_char, new_char in zip(previous, current):
+        if old_char != new_char:
+            break
+        common += 1
+    logger.debug("进行中的回答被改写，从第%d个字符处继续输出", common)
+    return current[max(common, len(previous)) :]
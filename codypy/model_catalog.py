@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import time
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, Set
+
+from codypy.client_info import Models
+from codypy.exceptions import CodyPyError, ModelNotAvailableError
+from codypy.protocol import ModelList
+from codypy.repo_ids import account_scope
+
+if TYPE_CHECKING:
+    from codypy.agent import CodyAgent
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 模型列表的有效期（秒）
+MODEL_CATALOG_TTL = 300.0
+
+# 后台刷新的间隔相对于有效期的比例，使运行后台刷新时缓存不会过期
+REFRESH_FRACTION = 0.8
+
+
+class ModelCatalog:
+    """
+    按账户缓存"chat/models"的结果。
+
+    每种用途（"chat"、"edit"）的模型列表按ttl过期。过期后的第一次查询立即返回旧的列表，
+    同时在后台刷新；调用start()后，后台任务会在过期之前定期刷新所有查询过的列表。
+    同一列表的并发查询只发送一个请求。
+
+    set_model用它在本地检查模型是否可用。默认所有CodyAgent使用shared()返回的同一个实例。
+    """
+
+    _shared: "ModelCatalog | None" = None
+
+    @classmethod
+    def shared(cls) -> "ModelCatalog":
+        """
+        返回进程内共享的实例，第一次调用时创建。
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def __init__(self, ttl: float = MODEL_CATALOG_TTL) -> None:
+        """
+        初始化ModelCatalog实例。
+
+        参数:
+        ttl (float): 模型列表的有效期（秒）
+        """
+        self.ttl = ttl
+        # (账户作用域, 用途) -> (模型列表, 获取时的time.monotonic())
+        self._entries: Dict[tuple[str, str], tuple[ModelList, float]] = {}
+        # (账户作用域, 用途) -> 正在进行的请求
+        self._fetching: Dict[tuple[str, str], asyncio.Task] = {}
+        # 账户作用域 -> 最近一次查询使用的代理，后台刷新通过它发送请求
+        self._agents: Dict[str, weakref.ref] = {}
+        self._refresh_task: asyncio.Task | None = None
+        self._background: Set[asyncio.Task] = set()
+        self.hits: int = 0  # 从未过期的缓存中返回的次数
+        self.stale_hits: int = 0  # 返回已过期的列表并在后台刷新的次数
+        self.misses: int = 0  # 没有缓存、需要等待请求的次数
+        self.requests: int = 0  # 发送的"chat/models"请求数
+        self.refresh_failures: int = 0  # 后台刷新失败的次数
+
+    async def models(
+        self,
+        agent: "CodyAgent",
+        usage: str = "chat",
+        refresh: bool = False,
+    ) -> ModelList:
+        """
+        返回代理所属账户在指定用途下可用的模型。
+
+        参数:
+        agent (CodyAgent): 已经初始化的代理，需要请求时通过它发送
+        usage (str): 模型用途，"chat"或"edit"
+        refresh (bool): 是否忽略缓存，等待重新获取的结果
+
+        返回:
+        ModelList: "chat/models"请求的结果
+        """
+        key = (account_scope(agent), usage)
+        self._agents[key[0]] = weakref.ref(agent)
+        entry = self._entries.get(key)
+        if entry is not None and not refresh:
+            if time.monotonic() - entry[1] >= self.ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(agent, key)
+            else:
+                self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return await asyncio.shield(self._fetch(agent, key))
+
+    def _fetch(self, agent: "CodyAgent", key: tuple[str, str]) -> asyncio.Task:
+        """
+        返回获取模型列表的任务，已经有进行中的请求时复用它。
+        """
+        task = self._fetching.get(key)
+        if task is None:
+            task = self._fetching[key] = asyncio.create_task(self._load(agent, key))
+            task.add_done_callback(lambda _: self._fetching.pop(key, None))
+        return task
+
+    async def _load(self, agent: "CodyAgent", key: tuple[str, str]) -> ModelList:
+        self.requests += 1
+        model_list: ModelList = await agent._cody_server.connection.request(
+            "chat/models",
+            {"modelUsage": key[1]},
+            result_type=ModelList,
+        )
+        self._entries[key] = (model_list, time.monotonic())
+        return model_list
+
+    def _refresh_in_background(self, agent: "CodyAgent", key: tuple[str, str]) -> None:
+        """
+        在后台刷新一个列表，失败时保留旧的列表。
+        """
+        if key in self._fetching:
+            return
+        task = self._fetch(agent, key)
+        self._background.add(task)
+        task.add_done_callback(self._on_refreshed)
+
+    def _on_refreshed(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            self.refresh_failures += 1
+            logger.warning("刷新模型列表失败: %r", exc)
+
+    def cached(self, agent: "CodyAgent", usage: str = "chat") -> ModelList | None:
+        """
+        返回缓存的模型列表（可能已过期），不发送请求。
+
+        参数:
+        agent (CodyAgent): 代理，用于确定账户
+        usage (str): 模型用途
+
+        返回:
+        ModelList | None: 缓存的列表，还没有获取过时为None
+        """
+        entry = self._entries.get((account_scope(agent), usage))
+        return entry[0] if entry is not None else None
+
+    def availability(
+        self, agent: "CodyAgent", usage: str = "chat"
+    ) -> Dict[Models, bool] | None:
+        """
+        返回Models中每个模型在服务器上是否可用，不发送请求。
+
+        参数:
+        agent (CodyAgent): 代理，用于确定账户
+        usage (str): 模型用途
+
+        返回:
+        Dict[Models, bool] | None: 每个模型是否可用，还没有获取过模型列表时为None
+        """
+        model_list = self.cached(agent, usage)
+        if model_list is None:
+            return None
+        available = {model.id for model in model_list.models}
+        return {model: model.value.model_id in available for model in Models}
+
+    def is_available(
+        self, agent: "CodyAgent", model: Models, usage: str = "chat"
+    ) -> bool | None:
+        """
+        返回模型是否可用，不发送请求。还没有获取过模型列表时为None。
+        """
+        availability = self.availability(agent, usage)
+        return availability[model] if availability is not None else None
+
+    async def check(
+        self, agent: "CodyAgent", model: Models, usage: str = "chat"
+    ) -> None:
+        """
+        检查模型是否可用，必要时先获取模型列表。无法获取模型列表时不做检查，交给代理判断。
+
+        参数:
+        agent (CodyAgent): 已经初始化的代理
+        model (Models): 要检查的模型
+        usage (str): 模型用途
+
+        异常:
+        ModelNotAvailableError: 如果模型不在账户可用的模型列表中
+        """
+        try:
+            model_list = await self.models(agent, usage)
+        except CodyPyError as exc:
+            logger.warning(
+                "无法获取模型列表，跳过对 %s 的检查: %r", model.value.model_id, exc
+            )
+            return
+        if all(item.id != model.value.model_id for item in model_list.models):
+            raise ModelNotAvailableError(
+                f"模型 {model.value.model_id} 对当前账户不可用", model=model
+            )
+
+    def start(self, interval: float | None = None) -> None:
+        """
+        启动后台刷新任务，定期刷新所有查询过的模型列表。重复调用不会创建第二个任务。
+
+        参数:
+        interval (float | None): 刷新间隔（秒），默认为ttl的80%
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(
+                self._refresh_loop(interval or self.ttl * REFRESH_FRACTION)
+            )
+
+    async def _refresh_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for key in list(self._entries):
+                agent = self._agents.get(key[0], lambda: None)()
+                if agent is None or agent._cody_server.connection.closed:
+                    continue
+                self._refresh_in_background(agent, key)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回缓存的命中、请求和每个列表的存在时间。
+        """
+        now = time.monotonic()
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "requests": self.requests,
+            "refresh_failures": self.refresh_failures,
+            "lists": [
+                {
+                    "usage": usage,
+                    "models": len(model_list.models),
+                    "age": now - fetched_at,
+                }
+                for (_, usage), (model_list, fetched_at) in self._entries.items()
+            ],
+        }
+
+    async def close(self) -> None:
+        """
+        停止后台刷新任务。
+        """
+        tasks = list(self._background)
+        if self._refresh_task is not None:
+            tasks.append(self._refresh_task)
+            self._refresh_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,424 @@
+import asyncio
+import logging
+import weakref
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable
+
+from codypy.agent import CodyAgent
+from codypy.batch import BatchResult, chat_many
+from codypy.cache import ResponseCache
+from codypy.client_info import AgentSpecs
+from codypy.exceptions import AgentConnectionClosedError, CodyPyError
+from codypy.ratelimit import RateLimiter
+from codypy.server import CodyServer, shutdown_servers
+from codypy.session import ChatSession
+from codypy.transport import uses_single_endpoint
+from codypy.warm import WarmSpares, spawn_agent
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+
+class LoadBalancing(Enum):
+    """
+    为新聊天会话选择代理进程的负载衡量方式。
+
+    - IN_FLIGHT: 进行中的请求最少的进程
+    - LATENCY: 请求延迟的指数移动平均乘以（进行中的请求数 + 会话数 + 1）最小的进程，
+      对变慢的进程更敏感
+    """
+
+    IN_FLIGHT = "in_flight"
+    LATENCY = "latency"
+
+
+@dataclass(eq=False)
+class PoolMember:
+    """
+    进程池中的一个代理进程。
+
+    属性:
+        index (int): 在进程池中的序号
+        server (CodyServer): 代理进程及其连接
+        agent (CodyAgent): 用于初始化该进程的代理
+        sessions (weakref.WeakSet): 放置在该进程上、仍在使用的聊天会话（ChatSession）
+        placed (int): 累计放置的聊天会话数
+        placing (int): 正在创建、尚未加入sessions的聊天会话数
+        recycled (int): 该位置上的进程被替换的次数
+        recycling (bool): 是否正在替换该进程
+    """
+
+    index: int
+    server: CodyServer
+    agent: CodyAgent
+    sessions: weakref.WeakSet = field(default_factory=weakref.WeakSet)
+    placed: int = 0
+    placing: int = 0
+    recycled: int = 0
+    recycling: bool = False
+
+    @property
+    def available(self) -> bool:
+        """进程的连接是否仍然可用。"""
+        connection = self.server.connection
+        return connection is not None and not connection.closed
+
+    def load(self, balancing: LoadBalancing) -> tuple:
+        """
+        计算该进程当前的负载，值越小越空闲。
+
+        参数:
+            balancing (LoadBalancing): 负载衡量方式。
+
+        返回:
+            tuple: 可比较的负载，相同时依次比较进行中的请求数和会话数。
+        """
+        connection = self.server.connection
+        in_flight = connection.in_flight
+        sessions = len(self.sessions) + self.placing
+        if balancing is LoadBalancing.LATENCY:
+            cost = connection.latency_ewma * (in_flight + sessions + 1)
+            return (cost, in_flight, sessions)
+        return (in_flight, sessions)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回该进程的负载指标。
+        """
+        connection = self.server.connection
+        return {
+            "index": self.index,
+            "pid": self.server.pid,
+            "available": self.available,
+            "in_flight": connection.in_flight,
+            "latency_ewma": connection.latency_ewma,
+            "completed": connection.completed,
+            "sessions": len(self.sessions),
+            "placed": self.placed,
+            "recycled": self.recycled,
+        }
+
+
+class CodyServerPool:
+    """
+    多个Cody代理进程组成的进程池。
+
+    一个CodyServer只对应一个Node进程和一个事件循环，进程池通过CodyServer.init启动N个进程，
+    用同一份AgentSpecs初始化每个进程，并把新的聊天会话放置在负载最低的进程上。
+    会话固定在创建它的进程上，因为聊天ID只在该进程中有效；只有替换进程时会话才会被迁移（见recycle）。
+    """
+
+    @classmethod
+    async def init(
+        cls,
+        size: int,
+        agent_specs: AgentSpecs,
+        cody_binary_file: str,
+        version: str,
+        balancing: LoadBalancing = LoadBalancing.IN_FLIGHT,
+        response_cache: ResponseCache | None = None,
+        rate_limiter: RateLimiter | None = None,
+        **server_options: Any,
+    ) -> "CodyServerPool":
+        """
+        并行启动并初始化size个代理进程。
+
+        任何一个进程启动或初始化失败时，已经启动的进程都会被清理，异常会继续抛出。
+
+        参数:
+        size (int): 进程数，必须大于0
+        agent_specs (AgentSpecs): 初始化每个进程使用的代理规格
+        cody_binary_file (str): Cody代理二进制文件的路径
+        version (str): Cody代理的版本
+        balancing (LoadBalancing): 负载衡量方式
+        response_cache (ResponseCache | None): 所有进程共享的回答缓存，为None时不缓存
+        rate_limiter (RateLimiter | None): 所有进程共享的聊天请求限速器，为None时不限速
+        server_options: 传给CodyServer.init的其他参数，例如request_timeouts和agent_args
+
+        返回:
+        CodyServerPool: 所有进程都已初始化的进程池
+        """
+        if size < 1:
+            raise ValueError("size必须大于0")
+        if size > 1 and uses_single_endpoint(server_options):
+            raise ValueError("网络传输下所有代理进程使用同一个端点，进程池只支持stdio")
+
+        pool = cls(agent_specs, balancing, response_cache, rate_limiter)
+        pool._spawn_options = (cody_binary_file, version, server_options)
+        results = await asyncio.gather(
+            *(
+                pool._start_member(index, cody_binary_file, version, server_options)
+                for index in range(size)
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, PoolMember):
+                pool.members.append(result)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await pool.close()
+            raise errors[0]
+        logger.info("已启动%d个代理进程的进程池", size)
+        return pool
+
+    def __init__(
+        self,
+        agent_specs: AgentSpecs,
+        balancing: LoadBalancing = LoadBalancing.IN_FLIGHT,
+        response_cache: ResponseCache | None = None,
+        rate_limiter: RateLimiter | None = None,
+    ) -> None:
+        """
+        初始化CodyServerPool实例。通常应使用CodyServerPool.init创建进程池。
+
+        参数:
+        agent_specs (AgentSpecs): 代理规格，每个聊天会话都使用这份规格
+        balancing (LoadBalancing): 负载衡量方式
+        response_cache (ResponseCache | None): 所有进程共享的回答缓存，为None时不缓存
+        rate_limiter (RateLimiter | None): 所有进程共享的聊天请求限速器，为None时不限速
+        """
+        self.agent_specs = agent_specs
+        self.balancing = balancing
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.members: list[PoolMember] = []
+        self._closed = False
+        # CodyServerPool.init使用的启动参数，替换进程时用同样的参数启动新进程
+        self._spawn_options: tuple[str, str, Dict[str, Any]] | None = None
+
+    async def _start_member(
+        self,
+        index: int,
+        cody_binary_file: str,
+        version: str,
+        server_options: Dict[str, Any],
+    ) -> PoolMember:
+        """
+        启动并初始化一个代理进程。
+        """
+        server, agent = await spawn_agent(
+            self.agent_specs, cody_binary_file, version, **server_options
+        )
+        self._adopt(agent)
+        return PoolMember(index, server, agent)
+
+    def _adopt(self, agent: CodyAgent) -> None:
+        """
+        让加入进程池的代理使用进程池共享的回答缓存和限速器。
+        """
+        if self.response_cache is not None:
+            agent.response_cache = self.response_cache
+        if self.rate_limiter is not None:
+            agent.rate_limiter = self.rate_limiter
+
+    def add_member(self, server: CodyServer, agent: CodyAgent) -> PoolMember:
+        """
+        把一个已经初始化的代理进程加入进程池。
+
+        参数:
+        server (CodyServer): 已经启动的代理进程
+        agent (CodyAgent): 已经在该进程上完成initialize_agent的代理
+
+        返回:
+        PoolMember: 新的进程池成员
+        """
+        self._adopt(agent)
+        member = PoolMember(len(self.members), server, agent)
+        self.members.append(member)
+        return member
+
+    async def scale_up(self, spares: WarmSpares) -> PoolMember:
+        """
+        从预热的备用代理中取一个加入进程池，不必等待冷启动。
+
+        备用代理应使用与进程池相同的AgentSpecs初始化。
+
+        参数:
+        spares (WarmSpares): 备用代理
+
+        返回:
+        PoolMember: 新的进程池成员
+        """
+        spare = await spares.acquire()
+        return self.add_member(spare.server, spare.agent)
+
+    async def recycle(self, member: PoolMember, **shutdown_options: float) -> None:
+        """
+        用一个新的代理进程替换member，不中断放置在它上面的会话。
+
+        新进程初始化完成后立即接替member，之后的新会话都放置在新进程上；
+        已有的会话逐个迁移到新进程（见ChatSession.move_to），每个会话先等它进行中的消息
+        在旧进程上完成再迁移，最后排空并关闭旧进程。迁移失败的会话留在旧进程上，随旧进程关闭而失效。
+
+        参数:
+        member (PoolMember): 要替换的进程
+        shutdown_options: 传给旧进程CodyServer.cleanup_server的截止时间
+
+        异常:
+        CodyPyError: 如果进程池不是由CodyServer.init启动的，不知道如何启动新进程
+        """
+        if self._spawn_options is None:
+            raise CodyPyError(
+                "进程池不是由CodyServerPool.init创建的，无法启动替换的进程"
+            )
+        if member.recycling or self._closed:
+            return
+        cody_binary_file, version, server_options = self._spawn_options
+        member.recycling = True
+        try:
+            server, agent = await spawn_agent(
+                self.agent_specs, cody_binary_file, version, **server_options
+            )
+            self._adopt(agent)
+            old_server = member.server
+            member.server, member.agent = server, agent
+            member.recycled += 1
+            for session in list(member.sessions):
+                if session._cody_server is not old_server:
+                    continue
+                try:
+                    await session.move_to(agent)
+                except CodyPyError as exc:
+                    logger.warning("迁移聊天会话 %s 失败: %r", session.chat_id, exc)
+        finally:
+            member.recycling = False
+        logger.info(
+            "进程 #%d 已从PID %s替换为PID %s", member.index, old_server.pid, server.pid
+        )
+        await old_server.cleanup_server(**shutdown_options)
+
+    def select(self) -> PoolMember:
+        """
+        选择负载最低的可用进程。
+
+        返回:
+        PoolMember: 被选中的进程
+
+        异常:
+        AgentConnectionClosedError: 如果进程池已关闭或没有可用的进程
+        """
+        if self._closed:
+            raise AgentConnectionClosedError("进程池已关闭")
+        available = [member for member in self.members if member.available]
+        if not available:
+            raise AgentConnectionClosedError("进程池中没有可用的代理进程")
+        return min(available, key=lambda member: member.load(self.balancing))
+
+    async def new_chat(self, context_files: list | None = None) -> ChatSession:
+        """
+        在负载最低的进程上创建一个新的聊天会话。
+
+        返回的ChatSession绑定在被选中的进程上，之后的所有请求都发往该进程。
+
+        参数:
+        context_files (list | None): 这个会话每条消息都附带的上下文文件
+
+        返回:
+        ChatSession: 新的聊天会话
+        """
+        member = self.select()
+        member.placed += 1
+        member.placing += 1
+        try:
+            session = await ChatSession.create(member.agent, context_files)
+        finally:
+            member.placing -= 1
+        member.sessions.add(session)
+        logger.debug("聊天会话 %s 放置在进程 #%d 上", session.chat_id, member.index)
+        return session
+
+    def member_for(self, session: ChatSession) -> PoolMember | None:
+        """
+        查找聊天会话所在的进程。
+
+        参数:
+        session (ChatSession): new_chat返回的会话
+
+        返回:
+        PoolMember | None: 会话所在的进程，不属于该进程池时为None
+        """
+        for member in self.members:
+            if member.server is session._cody_server:
+                return member
+        return None
+
+    def release(self, session: ChatSession) -> None:
+        """
+        通知进程池一个聊天会话已不再使用。
+
+        会话对象被回收时也会自动释放，此方法用于在仍持有引用时提前释放。
+
+        参数:
+        session (ChatSession): new_chat返回的会话
+        """
+        if (member := self.member_for(session)) is not None:
+            member.sessions.discard(session)
+        session.close()
+
+    def chat_many(
+        self,
+        prompts: Iterable[str] | AsyncIterable[str],
+        concurrency: int | None = None,
+        **options: Any,
+    ) -> AsyncIterator[BatchResult]:
+        """
+        以有限的并发发送大量互相独立的提示，会话按负载分布在所有进程上，见codypy.batch.chat_many。
+
+        参数:
+        prompts (Iterable[str] | AsyncIterable[str]): 提示
+        concurrency (int | None): 同时进行的提示数，默认为每个进程8个
+        options: 传给chat_many的其他参数，例如ordered、retries和results_file
+
+        返回:
+        AsyncIterator[BatchResult]: 每个提示的结果
+        """
+        return chat_many(
+            prompts,
+            self.new_chat,
+            self.release,
+            concurrency=concurrency or 8 * max(len(self.members), 1),
+            **options,
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回进程池的负载指标。
+
+        返回:
+        Dict[str, Any]: 进程数、可用进程数、总会话数、回答缓存、限速器和每个进程的指标
+        """
+        members = [member.metrics() for member in self.members]
+        return {
+            "size": len(self.members),
+            "available": sum(member["available"] for member in members),
+            "sessions": sum(member["sessions"] for member in members),
+            "in_flight": sum(member["in_flight"] for member in members),
+            "response_cache": (
+                self.response_cache.metrics() if self.response_cache else None
+            ),
+            "rate_limits": self.rate_limiter.metrics() if self.rate_limiter else None,
+            "members": members,
+        }
+
+    async def close(self, **shutdown_options: float) -> None:
+        """
+        并行关闭进程池中的所有代理进程。
+
+        参数:
+        shutdown_options: 传给CodyServer.cleanup_server的截止时间
+        """
+        self._closed = True
+        results = await shutdown_servers(
+            (member.server for member in self.members), **shutdown_options
+        )
+        for member, result in zip(self.members, results):
+            if isinstance(result, Exception):
+                logger.warning("清理代理进程 #%d 时出错: %r", member.index, result)
+
+    async def __aenter__(self) -> "CodyServerPool":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
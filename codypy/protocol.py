@@ -0,0 +1,163 @@
+# 热点消息的紧凑类型定义。
+# 这些数据类只声明客户端实际读取的字段，编解码器会直接把JSON解码为这些结构，
+# 其余字段在解码时被跳过。
+
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class Position:
+    """
+    文档中的位置。
+
+    属性:
+        line (int): 行号
+    """
+
+    line: int = 0
+
+
+@dataclass(slots=True)
+class Range:
+    """
+    文档中的行范围。
+
+    属性:
+        start (Position): 起始位置
+        end (Position): 结束位置
+    """
+
+    start: Position = field(default_factory=Position)
+    end: Position = field(default_factory=Position)
+
+
+@dataclass(slots=True)
+class ContextUri:
+    """
+    上下文文件的URI，只保留路径。
+
+    属性:
+        path (str): 文件路径
+    """
+
+    path: str = ""
+
+
+@dataclass(slots=True)
+class ContextFile:
+    """
+    代理在回答时使用的上下文文件。
+
+    属性:
+        uri (ContextUri): 文件URI
+        range (Range | None): 使用的行范围，整个文件时为None
+    """
+
+    uri: ContextUri = field(default_factory=ContextUri)
+    range: Range | None = None
+
+
+@dataclass(slots=True)
+class ChatMessage:
+    """
+    transcript中的一条消息。
+
+    属性:
+        speaker (str): 发言者，"human"或"assistant"
+        text (str | None): 消息文本，进行中的助手消息可能还没有文本
+        contextFiles (list[ContextFile]): 与该消息关联的上下文文件
+    """
+
+    speaker: str = ""
+    text: str | None = None
+    contextFiles: list[ContextFile] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class Transcript:
+    """
+    聊天会话的完整消息记录，"chat/submitMessage"的结果和进行中的推送都是这种形状。
+
+    属性:
+        type (str): 扩展消息类型，transcript时为"transcript"
+        messages (list[ChatMessage]): 按时间顺序排列的消息
+        isMessageInProgress (bool): 最后一条消息是否仍在生成中
+        chatID (str | None): 聊天会话ID
+    """
+
+    type: str = ""
+    messages: list[ChatMessage] = field(default_factory=list)
+    isMessageInProgress: bool = False
+    chatID: str | None = None
+
+
+@dataclass(slots=True)
+class WebviewPostMessage:
+    """
+    "webview/postMessage"通知的参数。
+
+    属性:
+        id (str): 聊天会话（面板）ID
+        message (Transcript): 扩展消息。非transcript类型的消息只有type字段有意义
+    """
+
+    id: str = ""
+    message: Transcript = field(default_factory=Transcript)
+
+
+@dataclass(slots=True)
+class ChatModel:
+    """
+    "chat/models"返回的单个模型。
+
+    属性:
+        id (str): 模型ID，例如"anthropic/claude-3-sonnet-20240229"
+        title (str): 模型的显示名称
+        provider (str): 模型提供商
+        usage (list[str]): 模型用途，例如"chat"、"edit"
+        tags (list[str]): 模型标签
+    """
+
+    id: str = ""
+    title: str = ""
+    provider: str = ""
+    usage: list[str] = field(default_factory=list)
+    tags: list[str] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class ModelList:
+    """
+    "chat/models"的结果。
+
+    属性:
+        models (list[ChatModel]): 可用的模型
+    """
+
+    models: list[ChatModel] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class RepoId:
+    """
+    远程仓库的名称和ID。
+
+    属性:
+        name (str): 仓库名称，例如"github.com/sourcegraph/cody"
+        id (str): 仓库ID
+    """
+
+    name: str = ""
+    id: str = ""
+
+
+@dataclass(slots=True)
+class RepoIdResponse:
+    """
+    "graphql/getRepoIds"的结果。
+
+    属性:
+        repos (list[RepoId]): 找到的仓库
+    """
+
+    repos: list[RepoId] = field(default_factory=list)
@@ -0,0 +1,200 @@
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import Callable, Deque, Dict, Generic, Hashable, TypeVar
+
+from codypy.exceptions import QueueOverflowError
+
+T = TypeVar("T")
+
+
+class OverflowPolicy(Enum):
+    """
+    队列已满时非阻塞写入（put_nowait）的处理策略。
+
+    - DROP_OLDEST: 丢弃队首最旧的一项，为新项腾出位置
+    - DROP_NEWEST: 丢弃正要写入的新项
+    - RAISE: 抛出QueueOverflowError，由生产者自行处理
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    RAISE = "raise"
+
+
+class NotificationQueue(Generic[T]):
+    """
+    有界、可合并的异步通知队列。
+
+    队列长度有上限，非阻塞写入在队列已满时按OverflowPolicy处理，
+    因此读取循环这样不能被阻塞的生产者永远不会因为消费者太慢而停下，
+    客户端的内存占用也不会无限增长。
+
+    如果提供了coalesce_key，具有相同键且尚未被取走的项会被新项原地替换，
+    例如同一聊天中被后续推送取代的进行中transcript只保留最新的一份。
+    键为None的项不会被合并，也不会被越过：它之后写入的项只会与它之后的项合并，
+    因此完整的transcript永远不会被下一轮进行中的推送取代或调换顺序。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 64,
+        overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        coalesce_key: Callable[[T], Hashable | None] | None = None,
+    ) -> None:
+        """
+        初始化NotificationQueue实例。
+
+        参数:
+            maxsize (int): 队列中最多保存的项数，必须大于0。
+            overflow (OverflowPolicy): 队列已满时put_nowait的处理策略。
+            coalesce_key (Callable | None): 计算合并键的函数，为None时不合并。
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize必须大于0")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._coalesce_key = coalesce_key
+        self._items: Deque[list] = deque()  # 每项为[合并键, 值]
+        self._by_key: Dict[Hashable, list] = {}
+        self._getters: Deque[asyncio.Future] = deque()
+        self._putters: Deque[asyncio.Future] = deque()
+        self.dropped: int = 0  # 因队列已满而丢弃的项数
+        self.coalesced: int = 0  # 被新项合并替换的项数
+
+    def qsize(self) -> int:
+        """队列中当前的项数。"""
+        return len(self._items)
+
+    def empty(self) -> bool:
+        """队列是否为空。"""
+        return not self._items
+
+    def full(self) -> bool:
+        """队列是否已满。"""
+        return len(self._items) >= self.maxsize
+
+    def put_nowait(self, item: T) -> bool:
+        """
+        非阻塞地写入一项。
+
+        参数:
+            item (T): 要写入的项。
+
+        返回:
+            bool: 写入（或合并）成功时为True，按DROP_NEWEST策略被丢弃时为False。
+
+        异常:
+            QueueOverflowError: 如果队列已满且策略为RAISE。
+        """
+        key = self._coalesce_key(item) if self._coalesce_key is not None else None
+        if key is not None and (cell := self._by_key.get(key)) is not None:
+            cell[1] = item
+            self.coalesced += 1
+            return True
+
+        if self.full():
+            if self.overflow is OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return False
+            if self.overflow is OverflowPolicy.RAISE:
+                raise QueueOverflowError(f"通知队列已满（{self.maxsize}项）")
+            self._discard(self._items.popleft())
+            self.dropped += 1
+
+        cell = [key, item]
+        self._items.append(cell)
+        if key is not None:
+            self._by_key[key] = cell
+        else:
+            # 键为None的项是合并屏障，之前排队的项不再接受合并
+            self._by_key.clear()
+        self._wakeup(self._getters)
+        return True
+
+    async def put(self, item: T) -> None:
+        """
+        写入一项，队列已满时等待消费者腾出空间，而不是按溢出策略处理。
+
+        读取循环不能使用此方法；它适用于可以接受被消费者限速的生产者。
+
+        参数:
+            item (T): 要写入的项。
+        """
+        key = self._coalesce_key(item) if self._coalesce_key is not None else None
+        while self.full() and (key is None or key not in self._by_key):
+            await self._wait(self._putters)
+        self.put_nowait(item)
+
+    def get_nowait(self) -> T:
+        """
+        非阻塞地取出队首的一项。
+
+        返回:
+            T: 队首的项。
+
+        异常:
+            asyncio.QueueEmpty: 如果队列为空。
+        """
+        if not self._items:
+            raise asyncio.QueueEmpty
+        cell = self._items.popleft()
+        self._discard(cell)
+        self._wakeup(self._putters)
+        return cell[1]
+
+    async def get(self) -> T:
+        """
+        取出队首的一项，队列为空时等待。
+
+        返回:
+            T: 队首的项。
+        """
+        while not self._items:
+            await self._wait(self._getters)
+        return self.get_nowait()
+
+    def drain(self) -> list[T]:
+        """
+        非阻塞地取出队列中的所有项，供只关心最新状态的消费者一次性追上进度。
+
+        返回:
+            list[T]: 按写入顺序排列的所有项。
+        """
+        items = []
+        while self._items:
+            items.append(self.get_nowait())
+        return items
+
+    def _discard(self, cell: list) -> None:
+        """
+        从合并索引中移除一个已离开队列的项。
+        """
+        key = cell[0]
+        if key is not None and self._by_key.get(key) is cell:
+            del self._by_key[key]
+
+    @staticmethod
+    async def _wait(waiters: Deque[asyncio.Future]) -> None:
+        """
+        在给定的等待队列中等待被唤醒。
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in waiters:
+                waiters.remove(future)
+            raise
+
+    @staticmethod
+    def _wakeup(waiters: Deque[asyncio.Future]) -> None:
+        """
+        唤醒等待队列中第一个仍在等待的任务。
+        """
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                break
@@ -0,0 +1,351 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Deque, Dict
+
+from codypy.client_info import Models
+from codypy.exceptions import CodyPyError
+from codypy.repo_ids import account_scope
+
+if TYPE_CHECKING:
+    from codypy.agent import CodyAgent
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RateLimits:
+    """
+    每个账户的请求速率和并发限制，只作用于发送给大模型的"chat/submitMessage"请求。
+
+    属性:
+        account_rate (float | None): 每个账户每秒的请求数上限，为None时不限
+        account_burst (int): 账户限流允许的突发请求数
+        model_rates (Dict[str | Models, float]): 按模型（Models或模型ID）设置的每秒请求数上限
+        default_model_rate (float | None): 没有在model_rates中列出的模型的上限，为None时不限
+        model_burst (int): 模型限流允许的突发请求数
+        initial_concurrency (int): 每个账户初始的并发请求数上限
+        min_concurrency (int): 并发上限的最小值
+        max_concurrency (int): 并发上限的最大值
+        latency_target (float | None): 请求耗时超过它（秒）时视为过载，为None时只根据错误调整
+        decrease_factor (float): 过载时并发上限乘以的系数
+        decrease_interval (float): 两次降低并发上限之间的最短间隔（秒），避免同一波错误连续降低
+    """
+
+    account_rate: float | None = None
+    account_burst: int = 10
+    model_rates: Dict[str | Models, float] = field(default_factory=dict)
+    default_model_rate: float | None = None
+    model_burst: int = 5
+    initial_concurrency: int = 4
+    min_concurrency: int = 1
+    max_concurrency: int = 32
+    latency_target: float | None = None
+    decrease_factor: float = 0.5
+    decrease_interval: float = 1.0
+
+    def model_rate(self, model_id: str) -> float | None:
+        """
+        返回模型的每秒请求数上限。
+
+        参数:
+        model_id (str): 模型ID，使用代理的默认模型时为空字符串
+
+        返回:
+        float | None: 上限，为None时不限
+        """
+        for model, rate in self.model_rates.items():
+            if (
+                model.value.model_id if isinstance(model, Models) else model
+            ) == model_id:
+                return rate
+        return self.default_model_rate
+
+
+class TokenBucket:
+    """
+    异步令牌桶：每个请求消耗一个令牌，令牌按rate每秒补充，最多burst个。
+    没有令牌时等待，等待的请求按到达顺序得到令牌。
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """
+        参数:
+        rate (float): 每秒补充的令牌数
+        burst (int): 令牌数上限
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited: float = 0.0  # 累计等待令牌的时间（秒）
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            float(self.burst), self.tokens + (now - self._refilled_at) * self.rate
+        )
+        self._refilled_at = now
+
+    async def acquire(self) -> None:
+        """
+        取得一个令牌，必要时等待。
+        """
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self._refill()
+            self.tokens -= 1
+
+    def metrics(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": self.tokens,
+            "waited": self.waited,
+        }
+
+
+class AdaptiveConcurrency:
+    """
+    按AIMD（加性增、乘性减）调整上限的并发限制。
+
+    每个成功且耗时不超过latency_target的请求使上限增加1/上限，即每一轮并发请求增加1；
+    出错或超时的请求使上限乘以decrease_factor，但两次降低之间至少间隔decrease_interval秒。
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        latency_target: float | None = None,
+        decrease_factor: float = 0.5,
+        decrease_interval: float = 1.0,
+    ) -> None:
+        """
+        参数:
+        initial (int): 初始上限
+        minimum (int): 上限的最小值
+        maximum (int): 上限的最大值
+        latency_target (float | None): 请求耗时超过它（秒）时视为过载
+        decrease_factor (float): 过载时上限乘以的系数
+        decrease_interval (float): 两次降低上限之间的最短间隔（秒）
+        """
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.in_flight: int = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._decreased_at = float("-inf")
+        self.increases: int = 0  # 上限增加到下一个整数的次数
+        self.decreases: int = 0  # 降低上限的次数
+
+    async def acquire(self) -> None:
+        """
+        等待直到进行中的请求数低于当前上限。
+        """
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # 已经被唤醒却不再需要，把机会让给下一个
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self, latency: float, error: bool) -> None:
+        """
+        请求结束，按结果调整上限。
+
+        参数:
+        latency (float): 请求耗时（秒）
+        error (bool): 请求是否出错
+        """
+        self.in_flight -= 1
+        overloaded = error or (
+            self.latency_target is not None and latency > self.latency_target
+        )
+        if overloaded:
+            now = time.monotonic()
+            if now - self._decreased_at >= self.decrease_interval:
+                self._decreased_at = now
+                self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                self.decreases += 1
+                logger.info("请求过载，并发上限降低到%d", int(self.limit))
+        elif self.limit < self.maximum:
+            before = int(self.limit)
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            if int(self.limit) > before:
+                self.increases += 1
+        self._wake()
+
+    def abandon(self) -> None:
+        """
+        放弃一个已经取得的名额而没有发出请求，不调整上限。
+        """
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """
+        唤醒与空闲名额数量相同的等待者。
+        """
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+class _AccountLimits:
+    """
+    一个账户的令牌桶、按模型的令牌桶和并发限制。
+    """
+
+    def __init__(self, limits: RateLimits) -> None:
+        self.limits = limits
+        self.bucket = (
+            TokenBucket(limits.account_rate, limits.account_burst)
+            if limits.account_rate is not None
+            else None
+        )
+        self.model_buckets: Dict[str, TokenBucket | None] = {}
+        self.concurrency = AdaptiveConcurrency(
+            limits.initial_concurrency,
+            limits.min_concurrency,
+            limits.max_concurrency,
+            limits.latency_target,
+            limits.decrease_factor,
+            limits.decrease_interval,
+        )
+        self.requests: int = 0
+        self.errors: int = 0
+
+    def model_bucket(self, model_id: str) -> TokenBucket | None:
+        if model_id not in self.model_buckets:
+            rate = self.limits.model_rate(model_id)
+            self.model_buckets[model_id] = (
+                TokenBucket(rate, self.limits.model_burst) if rate is not None else None
+            )
+        return self.model_buckets[model_id]
+
+
+class RateLimiter:
+    """
+    客户端的请求限速器。
+
+    同一账户（服务器端点加访问令牌，见account_scope）的所有代理、会话和进程池成员共享一个账户令牌桶、
+    每个模型一个令牌桶，以及一个按延迟和错误率自动调整的并发限制（AdaptiveConcurrency），
+    使批量任务既不会过慢，也不会因为请求过多而被服务器限流或封禁账户。
+    """
+
+    _shared: "RateLimiter | None" = None
+
+    @classmethod
+    def shared(cls, limits: RateLimits | None = None) -> "RateLimiter":
+        """
+        返回进程内共享的实例，第一次调用时用limits创建，之后的limits被忽略。
+        """
+        if cls._shared is None:
+            cls._shared = cls(limits)
+        return cls._shared
+
+    def __init__(self, limits: RateLimits | None = None) -> None:
+        """
+        初始化RateLimiter实例。
+
+        参数:
+        limits (RateLimits | None): 每个账户的限制，默认为RateLimits()
+        """
+        self.limits = limits or RateLimits()
+        self._accounts: Dict[str, _AccountLimits] = {}
+
+    def _account(self, agent: "CodyAgent") -> _AccountLimits:
+        scope = account_scope(agent)
+        if (account := self._accounts.get(scope)) is None:
+            account = self._accounts[scope] = _AccountLimits(self.limits)
+        return account
+
+    @asynccontextmanager
+    async def slot(self, agent: "CodyAgent", model_id: str) -> AsyncIterator[None]:
+        """
+        在账户和模型的限制内发送一个请求。
+
+        先等待并发名额，再依次取得账户和模型的令牌；请求正常结束或抛出CodyPyError时，
+        按耗时和是否出错调整并发上限。请求被取消、调用方提前关闭流式输出或抛出其他异常时，
+        结果未知，只归还名额而不调整上限。
+
+        参数:
+        agent (CodyAgent): 发送请求的代理，用于确定账户
+        model_id (str): 请求使用的模型ID，使用代理的默认模型时为空字符串
+        """
+        account = self._account(agent)
+        await account.concurrency.acquire()
+        started = None
+        error: bool | None = None  # 正常结束时为False，抛出CodyPyError时为True
+        try:
+            if account.bucket is not None:
+                await account.bucket.acquire()
+            if (bucket := account.model_bucket(model_id)) is not None:
+                await bucket.acquire()
+            started = time.monotonic()
+            account.requests += 1
+            yield
+            error = False
+        except CodyPyError:
+            error = True
+            account.errors += 1
+            raise
+        finally:
+            if started is None or error is None:
+                # 请求没有发出，或者被取消（CancelledError、GeneratorExit等），不影响并发上限
+                account.concurrency.abandon()
+            else:
+                account.concurrency.release(time.monotonic() - started, error)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回每个账户当前的限制和状态。
+        """
+        return {
+            scope: {
+                "requests": account.requests,
+                "errors": account.errors,
+                "concurrency": account.concurrency.metrics(),
+                "account_bucket": account.bucket.metrics() if account.bucket else None,
+                "model_buckets": {
+                    model_id or "default": bucket.metrics()
+                    for model_id, bucket in account.model_buckets.items()
+                    if bucket is not None
+                },
+            }
+            for scope, account in self._accounts.items()
+        }
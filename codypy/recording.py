@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator
+
+from codypy.messaging import FrameDecoder
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 录制文件的格式:
+#   文件头: MAGIC
+#   每条记录: 方向(1字节) + 相对时间戳(float64, 秒) + 消息体长度(uint32) + 消息体
+# 所有数字均为小端序。消息体是不含Content-Length头部的JSON字节。
+MAGIC = b"CODYREC1"
+RECORD_HEADER = struct.Struct("<cdI")
+
+SENT = b"S"  # 客户端发送给代理的帧
+RECEIVED = b"R"  # 客户端从代理收到的帧
+
+
+@dataclass(slots=True)
+class RecordedFrame:
+    """
+    录制文件中的一帧。
+
+    属性:
+        direction (bytes): SENT或RECEIVED
+        timestamp (float): 相对于录制开始的时间（秒）
+        body (bytes): JSON消息体
+    """
+
+    direction: bytes
+    timestamp: float
+    body: bytes
+
+
+class WireRecorder:
+    """
+    JSON-RPC线路录制器。
+
+    把连接上发送和接收的每一帧连同时间戳写入一个紧凑的二进制日志。
+    一个文件只保存一次会话，回放时从头到尾作为一次会话回放，因此打开时会覆盖已有的文件。
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        初始化WireRecorder实例，创建录制文件；文件已经存在时覆盖它。
+
+        参数:
+            path (str): 录制文件的路径。
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(MAGIC)
+        self._started = time.monotonic()
+
+    def record(self, direction: bytes, body: bytes | bytearray | memoryview) -> None:
+        """
+        追加一帧。
+
+        参数:
+            direction (bytes): SENT或RECEIVED。
+            body (bytes | bytearray | memoryview): JSON消息体。
+        """
+        if self._file.closed:
+            return
+        timestamp = time.monotonic() - self._started
+        self._file.write(RECORD_HEADER.pack(direction, timestamp, len(body)))
+        self._file.write(body)
+
+    def close(self) -> None:
+        """
+        将缓冲的数据写入磁盘并关闭录制文件。
+        """
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_recording(path: str) -> Iterator[RecordedFrame]:
+    """
+    按顺序读取录制文件中的所有帧。
+
+    参数:
+        path (str): 录制文件的路径。
+
+    产生:
+        RecordedFrame: 录制的帧。
+
+    异常:
+        ValueError: 如果文件不是录制文件。
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} 不是codypy录制文件")
+        while header := file.read(RECORD_HEADER.size):
+            if len(header) < RECORD_HEADER.size:
+                logger.warning("录制文件 %s 末尾的记录不完整，已忽略", path)
+                return
+            direction, timestamp, length = RECORD_HEADER.unpack(header)
+            body = file.read(length)
+            if len(body) < length:
+                logger.warning("录制文件 %s 末尾的记录不完整，已忽略", path)
+                return
+            yield RecordedFrame(direction, timestamp, body)
+
+
+class _ReplayWriter:
+    """
+    回放时交给客户端的写入端，实现连接用到的StreamWriter接口。
+
+    客户端写入的帧被解码后计数，回放任务据此判断录制中的下一条发送帧是否已经发生。
+    """
+
+    def __init__(self) -> None:
+        self._decoder = FrameDecoder()
+        self._sent: int = 0  # 客户端已经发送的帧数
+        self._changed = asyncio.Event()
+        self._closed = False
+
+    def write(self, data: bytes) -> None:
+        if self._closed:
+            raise ConnectionResetError("回放连接已关闭")
+        self._sent += len(self._decoder.feed(data))
+        self._changed.set()
+
+    async def drain(self) -> None:
+        return None
+
+    def is_closing(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        self._closed = True
+        self._changed.set()
+
+    async def wait_closed(self) -> None:
+        return None
+
+    async def wait_for_sent(self, count: int) -> bool:
+        """
+        等待客户端至少发送count帧。
+
+        返回:
+            bool: 达到数量时为True，写入端先被关闭时为False。
+        """
+        while self._sent < count:
+            if self._closed:
+                return False
+            self._changed.clear()
+            await self._changed.wait()
+        return True
+
+
+class ReplayTransport:
+    """
+    确定性的回放传输。
+
+    把一次录制的会话回放给客户端，不需要Node、代理二进制文件或网络。
+    收到的帧按录制顺序交给客户端；录制中每一条发送帧都要等客户端真正发出对应的一帧之后，
+    才会继续回放其后的接收帧，因此请求和响应之间的因果顺序与录制时一致。
+    realtime为True时保持录制中相邻两帧之间的时间间隔，否则尽可能快地回放。
+    """
+
+    def __init__(self, path: str, realtime: bool = False) -> None:
+        """
+        初始化ReplayTransport实例。
+
+        参数:
+            path (str): 录制文件的路径。
+            realtime (bool): 是否保持录制时的时间间隔，默认为False。
+        """
+        self.path = path
+        self.realtime = realtime
+        self.frames = list(read_recording(path))
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: _ReplayWriter | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> tuple[asyncio.StreamReader, _ReplayWriter]:
+        """
+        开始回放。
+
+        返回:
+            tuple: 供客户端使用的(reader, writer)。
+        """
+        self.reader = asyncio.StreamReader()
+        self.writer = _ReplayWriter()
+        self._task = asyncio.create_task(self._replay())
+        return self.reader, self.writer
+
+    async def close(self) -> None:
+        """
+        停止回放。
+        """
+        if self.writer is not None:
+            self.writer.close()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _replay(self) -> None:
+        """
+        回放任务：按录制顺序推进，遇到发送帧时等待客户端，遇到接收帧时写入读取端。
+        """
+        sent = 0
+        previous = 0.0
+        for frame in self.frames:
+            if frame.direction == SENT:
+                # 发送的时机由客户端决定，等它真正发出后再以此为基准计时
+                sent += 1
+                if not await self.writer.wait_for_sent(sent):
+                    break
+            else:
+                if self.realtime and frame.timestamp > previous:
+                    await asyncio.sleep(frame.timestamp - previous)
+                self.reader.feed_data(
+                    f"Content-Length: {len(frame.body)}\r\n\r\n".encode() + frame.body
+                )
+            previous = frame.timestamp
+        logger.debug("录制 %s 回放完毕", self.path)
+        self.reader.feed_eof()
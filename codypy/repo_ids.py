@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, Set
+
+from codypy.protocol import RepoId, RepoIdResponse
+
+if TYPE_CHECKING:
+    from codypy.agent import CodyAgent
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 找到的仓库ID的有效期（秒）。仓库ID几乎不会变化，可以保留很久
+REPO_ID_TTL = 24 * 60 * 60.0
+
+# 没有找到的仓库的有效期（秒）。仓库可能刚刚被索引，不宜长期记住
+NEGATIVE_TTL = 60.0
+
+# 没有指定服务器端点时使用的作用域
+DEFAULT_SCOPE = "https://sourcegraph.com"
+
+
+def server_endpoint(agent: "CodyAgent") -> str:
+    """
+    返回代理连接的Sourcegraph服务器端点。
+    """
+    configuration = agent.agent_specs.extensionConfiguration
+    if configuration is None or not configuration.serverEndpoint:
+        return DEFAULT_SCOPE
+    return configuration.serverEndpoint.rstrip("/")
+
+
+def account_scope(agent: "CodyAgent") -> str:
+    """
+    返回代理所属账户的作用域：服务器端点加上访问令牌的哈希。
+    不同实例上同名仓库的ID不同，同一实例上不同账户能看到的仓库和模型也可能不同，
+    因此仓库ID、模型列表和限速都按账户区分，同一账户的所有代理（例如进程池中的每个进程）共享它们。
+    """
+    configuration = agent.agent_specs.extensionConfiguration
+    token = configuration.accessToken if configuration is not None else ""
+    digest = hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+    return f"{server_endpoint(agent)}#{digest}"
+
+
+class RepoIdCache:
+    """
+    进程内共享的仓库ID缓存。
+
+    结果按账户（见account_scope）区分。找到的仓库按ttl过期，没有找到的仓库按较短的negative_ttl过期。
+    同一作用域中正在查询的名称只查询一次，其他调用等待同一个结果；
+    同一次事件循环迭代中由不同会话发起的查询会合并为一个"graphql/getRepoIds"请求。
+    指定path时，找到的仓库会保存到JSON文件中，下次启动时读回。
+
+    默认所有CodyAgent使用shared()返回的同一个实例。
+    """
+
+    _shared: "RepoIdCache | None" = None
+
+    @classmethod
+    def shared(cls) -> "RepoIdCache":
+        """
+        返回进程内共享的实例，第一次调用时创建。
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def __init__(
+        self,
+        ttl: float = REPO_ID_TTL,
+        negative_ttl: float = NEGATIVE_TTL,
+        path: str | None = None,
+    ) -> None:
+        """
+        初始化RepoIdCache实例。
+
+        参数:
+        ttl (float): 找到的仓库ID的有效期（秒）
+        negative_ttl (float): 没有找到的仓库的有效期（秒）
+        path (str | None): 持久化使用的JSON文件路径，为None时只保存在内存中
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        # (作用域, 仓库名称) -> (仓库ID或None, 过期时间time.time())
+        self._entries: Dict[tuple[str, str], tuple[RepoId | None, float]] = {}
+        # (作用域, 仓库名称) -> 正在进行的查询
+        self._in_flight: Dict[tuple[str, str], asyncio.Future] = {}
+        # 作用域 -> 等待合并发送的名称，以及负责发送的代理
+        self._batches: Dict[str, tuple["CodyAgent", Dict[str, asyncio.Future]]] = {}
+        self._flushes: Set[asyncio.Task] = set()  # 等待发送的批次
+        self.hits: int = 0  # 从缓存中得到的名称数
+        self.negative_hits: int = 0  # 从缓存中得到的"没有找到"的名称数
+        self.coalesced: int = 0  # 等待其他调用正在进行的查询的名称数
+        self.misses: int = 0  # 需要查询的名称数
+        self.requests: int = 0  # 发送的"graphql/getRepoIds"请求数
+        if path is not None:
+            self._load()
+
+    async def lookup(self, agent: "CodyAgent", names: list[str]) -> list[RepoId]:
+        """
+        通过仓库名称查找仓库ID。
+
+        参数:
+        agent (CodyAgent): 需要查询时用来发送请求的代理
+        names (list[str]): 仓库名称
+
+        返回:
+        list[RepoId]: 找到的仓库，按names的顺序排列，没有找到的仓库不在其中
+
+        异常:
+        CodyPyError: 如果查询请求失败。失败的结果不会被缓存
+        """
+        scope = account_scope(agent)
+        now = time.time()
+        results: Dict[str, RepoId | None] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        for name in dict.fromkeys(names):
+            key = (scope, name)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                results[name] = entry[0]
+                self.hits += 1
+                if entry[0] is None:
+                    self.negative_hits += 1
+            elif (future := self._in_flight.get(key)) is not None:
+                waiting[name] = future
+                self.coalesced += 1
+            else:
+                waiting[name] = self._enqueue(agent, scope, name)
+                self.misses += 1
+
+        for name, future in waiting.items():
+            results[name] = await asyncio.shield(future)
+        return [repo for name in names if (repo := results[name]) is not None]
+
+    def _enqueue(self, agent: "CodyAgent", scope: str, name: str) -> asyncio.Future:
+        """
+        把名称加入作用域的待发送批次，必要时安排在下一次事件循环迭代发送。
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[(scope, name)] = future
+        batch = self._batches.get(scope)
+        if batch is None:
+            batch = self._batches[scope] = (agent, {})
+            task = asyncio.create_task(self._flush(scope))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        batch[1][name] = future
+        return future
+
+    async def _flush(self, scope: str) -> None:
+        """
+        让出一次事件循环，然后用一个请求查询作用域中积累的所有名称。
+        """
+        await asyncio.sleep(0)
+        agent, futures = self._batches.pop(scope)
+        names = list(futures)
+        self.requests += 1
+        try:
+            response: RepoIdResponse = await agent._cody_server.connection.request(
+                "graphql/getRepoIds",
+                {"names": names, "first": len(names)},
+                result_type=RepoIdResponse,
+            )
+        except BaseException as exc:
+            for name, future in futures.items():
+                self._in_flight.pop((scope, name), None)
+                if isinstance(exc, Exception):
+                    future.set_exception(exc)
+                    # 没有调用方等待时不报告"exception was never retrieved"
+                    future.exception()
+                else:
+                    future.cancel()
+            if not isinstance(exc, Exception):
+                raise
+            return
+
+        found = {repo.name: repo for repo in response.repos}
+        now = time.time()
+        for name, future in futures.items():
+            repo = found.get(name)
+            ttl = self.ttl if repo is not None else self.negative_ttl
+            self._entries[(scope, name)] = (repo, now + ttl)
+            self._in_flight.pop((scope, name), None)
+            if not future.done():
+                future.set_result(repo)
+        if found and self.path is not None:
+            self._save()
+
+    def invalidate(self, name: str | None = None) -> None:
+        """
+        丢弃缓存的结果。
+
+        参数:
+        name (str | None): 仓库名称，为None时丢弃所有结果
+        """
+        if name is None:
+            self._entries.clear()
+        else:
+            for key in [key for key in self._entries if key[1] == name]:
+                del self._entries[key]
+        if self.path is not None:
+            self._save()
+
+    def _load(self) -> None:
+        """
+        从JSON文件读取未过期的仓库ID。文件不存在或损坏时从空缓存开始。
+        """
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                saved = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logger.warning("读取仓库ID缓存 %s 失败: %r", self.path, exc)
+            return
+        now = time.time()
+        for scope, name, repo_id, expires_at in saved.get("repos", []):
+            if expires_at > now:
+                self._entries[(scope, name)] = (
+                    RepoId(name=name, id=repo_id),
+                    expires_at,
+                )
+
+    def _save(self) -> None:
+        """
+        把找到的仓库ID写入JSON文件。先写临时文件再替换，其他进程不会读到写了一半的文件。
+        """
+        repos = [
+            [scope, name, repo.id, expires_at]
+            for (scope, name), (repo, expires_at) in self._entries.items()
+            if repo is not None
+        ]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump({"repos": repos}, file)
+            os.replace(temporary, self.path)
+        except OSError as exc:
+            logger.warning("保存仓库ID缓存 %s 失败: %r", self.path, exc)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回缓存的命中和请求次数。
+        """
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "requests": self.requests,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Set
+
+from codypy.pool import CodyServerPool, PoolMember
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# /proc中CPU时间的单位（每秒的时钟滴答数）和内存页的大小
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# 默认的采样间隔（秒）
+SAMPLE_INTERVAL = 10.0
+
+
+@dataclass(slots=True)
+class ProcessSample:
+    """
+    一次对代理进程资源占用的采样。
+
+    属性:
+        pid (int): 进程ID
+        rss_bytes (int): 常驻内存（字节）
+        cpu_seconds (float): 进程累计使用的CPU时间（用户态加内核态，秒）
+        cpu_percent (float | None): 自上次采样以来的CPU占用率，100表示一个核心满载，第一次采样时为None
+        open_fds (int): 打开的文件描述符数
+        sampled_at (float): 采样时的time.monotonic()
+    """
+
+    pid: int
+    rss_bytes: int
+    cpu_seconds: float
+    cpu_percent: float | None
+    open_fds: int
+    sampled_at: float
+
+
+def sample_process(
+    pid: int, previous: ProcessSample | None = None
+) -> ProcessSample | None:
+    """
+    从/proc/<pid>读取进程的内存、CPU时间和文件描述符数。
+
+    参数:
+    pid (int): 进程ID
+    previous (ProcessSample | None): 同一进程的上一次采样，用于计算CPU占用率
+
+    返回:
+    ProcessSample | None: 采样结果；进程已经退出或系统没有/proc时为None
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as stat_file:
+            stat = stat_file.read()
+        with open(f"/proc/{pid}/statm", "rb") as statm_file:
+            statm = statm_file.read().split()
+        open_fds = len(os.listdir(f"/proc/{pid}/fd"))
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    # 进程名可能包含空格和括号，从最后一个")"之后开始按空格拆分，utime和stime是第14和15个字段
+    fields = stat[stat.rindex(b")") + 2 :].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    sampled_at = time.monotonic()
+    cpu_percent = None
+    if (
+        previous is not None
+        and previous.pid == pid
+        and sampled_at > previous.sampled_at
+    ):
+        cpu_percent = (
+            100.0
+            * (cpu_seconds - previous.cpu_seconds)
+            / (sampled_at - previous.sampled_at)
+        )
+    return ProcessSample(
+        pid=pid,
+        rss_bytes=int(statm[1]) * PAGE_SIZE,
+        cpu_seconds=cpu_seconds,
+        cpu_percent=cpu_percent,
+        open_fds=open_fds,
+        sampled_at=sampled_at,
+    )
+
+
+@dataclass
+class ResourceLimits:
+    """
+    代理进程的资源上限，超过任意一项时进程会被替换。为None的项不检查。
+
+    属性:
+        max_rss_bytes (int | None): 常驻内存的上限（字节）
+        max_cpu_seconds (float | None): 累计CPU时间的上限（秒）
+        max_open_fds (int | None): 打开的文件描述符数的上限
+        max_requests (int | None): 进程处理的请求数的上限
+    """
+
+    max_rss_bytes: int | None = None
+    max_cpu_seconds: float | None = None
+    max_open_fds: int | None = None
+    max_requests: int | None = None
+
+    def exceeded(self, sample: ProcessSample | None, requests: int) -> str | None:
+        """
+        检查采样结果是否超过上限。
+
+        参数:
+        sample (ProcessSample | None): 进程的采样结果，无法采样时为None
+        requests (int): 进程已经处理的请求数
+
+        返回:
+        str | None: 超过的上限的描述，没有超过时为None
+        """
+        if self.max_requests is not None and requests >= self.max_requests:
+            return f"请求数{requests}达到上限{self.max_requests}"
+        if sample is None:
+            return None
+        if self.max_rss_bytes is not None and sample.rss_bytes > self.max_rss_bytes:
+            return f"常驻内存{sample.rss_bytes}字节超过上限{self.max_rss_bytes}"
+        if (
+            self.max_cpu_seconds is not None
+            and sample.cpu_seconds > self.max_cpu_seconds
+        ):
+            return f"CPU时间{sample.cpu_seconds:.1f}秒超过上限{self.max_cpu_seconds}"
+        if self.max_open_fds is not None and sample.open_fds > self.max_open_fds:
+            return f"文件描述符数{sample.open_fds}超过上限{self.max_open_fds}"
+        return None
+
+
+class ResourceMonitor:
+    """
+    定期采样进程池中每个代理进程的资源占用，并替换超过上限的进程。
+
+    采样只读取/proc，不向代理发送请求。超过ResourceLimits的进程通过CodyServerPool.recycle替换，
+    会话会迁移到新进程；同一时间只替换一个进程，使进程池始终保留大部分容量。
+    """
+
+    def __init__(
+        self,
+        pool: CodyServerPool,
+        limits: ResourceLimits | None = None,
+        interval: float = SAMPLE_INTERVAL,
+        **shutdown_options: float,
+    ) -> None:
+        """
+        初始化ResourceMonitor实例。调用start()后才开始采样。
+
+        参数:
+        pool (CodyServerPool): 被监视的进程池
+        limits (ResourceLimits | None): 资源上限，为None时只采样不替换
+        interval (float): 采样间隔（秒）
+        shutdown_options: 替换时传给旧进程CodyServer.cleanup_server的截止时间
+        """
+        self.pool = pool
+        self.limits = limits
+        self.interval = interval
+        self.shutdown_options = shutdown_options
+        # 按进程池中的序号保存的最近一次采样
+        self._samples: Dict[int, ProcessSample] = {}
+        self._task: asyncio.Task | None = None
+        self._recycle_tasks: Set[asyncio.Task] = set()
+        self.recycles: int = 0  # 因超过上限而替换的次数
+        self.last_recycle_reason: str | None = None
+
+    def start(self) -> None:
+        """
+        启动后台采样任务。重复调用不会创建第二个任务。
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample_loop())
+
+    async def _sample_loop(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def sample(self) -> Dict[int, ProcessSample]:
+        """
+        立即采样每个进程，并为超过上限的进程启动替换。
+
+        返回:
+        Dict[int, ProcessSample]: 按进程池中的序号保存的采样结果，无法采样的进程不在其中
+        """
+        for member in self.pool.members:
+            pid = member.server.pid
+            sample = None
+            if pid is not None and member.server.returncode is None:
+                sample = sample_process(pid, self._samples.get(member.index))
+            if sample is None:
+                self._samples.pop(member.index, None)
+            else:
+                self._samples[member.index] = sample
+            if self.limits is not None and member.available:
+                reason = self.limits.exceeded(
+                    sample, member.server.connection.completed
+                )
+                if reason is not None:
+                    self._maybe_recycle(member, reason)
+        return dict(self._samples)
+
+    def _maybe_recycle(self, member: PoolMember, reason: str) -> None:
+        """
+        没有其他进程正在替换时，在后台替换member。
+        """
+        if self._recycle_tasks or member.recycling:
+            return
+        logger.warning(
+            "进程 #%d（PID %s）%s，正在替换", member.index, member.server.pid, reason
+        )
+        self.recycles += 1
+        self.last_recycle_reason = reason
+        task = asyncio.create_task(self._recycle(member))
+        self._recycle_tasks.add(task)
+        task.add_done_callback(self._recycle_tasks.discard)
+
+    async def _recycle(self, member: PoolMember) -> None:
+        try:
+            await self.pool.recycle(member, **self.shutdown_options)
+        except Exception as exc:
+            logger.error("替换进程 #%d 失败: %r", member.index, exc)
+        self._samples.pop(member.index, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回每个进程最近一次的采样结果和替换次数。
+        """
+        members = []
+        for member in self.pool.members:
+            entry: Dict[str, Any] = {
+                "index": member.index,
+                "requests": member.server.connection.completed,
+                "recycling": member.recycling,
+            }
+            if (sample := self._samples.get(member.index)) is not None:
+                entry.update(asdict(sample))
+            members.append(entry)
+        return {
+            "recycles": self.recycles,
+            "last_recycle_reason": self.last_recycle_reason,
+            "members": members,
+        }
+
+    async def close(self) -> None:
+        """
+        停止采样，并等待正在进行的替换完成。
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._recycle_tasks, return_exceptions=True)
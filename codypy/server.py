@@ -1,18 +1,27 @@
 import asyncio
-import datetime
 import logging
 import os
 from asyncio.subprocess import Process
+from typing import Iterable
 
-from codypy.exceptions import (
-    AgentBinaryNotFoundError,
-    ServerTCPConnectionError,
-)
-from codypy.messaging import _send_jsonrpc_request
+from codypy.agent_log import AgentLog, AgentLogOptions
+from codypy.connection import JsonRpcConnection
+from codypy.exceptions import AgentBinaryNotFoundError, CodyPyError
+from codypy.recording import ReplayTransport, WireRecorder
+from codypy.transport import AgentTransport, StdioTransport, TcpTransport
 
 # 设置日志记录器
 logger = logging.getLogger(__name__)
 
+# 关闭时等待进行中的请求完成的时间（秒）
+DRAIN_TIMEOUT = 5.0
+
+# 关闭时等待shutdown响应，以及发送exit后等待进程自行退出的时间（秒）
+SHUTDOWN_TIMEOUT = 2.0
+
+# 终止代理进程时等待它自行退出的时间（秒），超时后强制结束
+TERMINATE_TIMEOUT = 5.0
+
 
 class CodyServer:
     """
@@ -25,6 +34,11 @@ class CodyServer:
             cody_binary_file: str,
             version: str,
             use_tcp: bool = False,  # 默认使用stdio，因为ca-certificate验证的原因
+            request_timeouts: dict[str, float] | None = None,
+            record_path: str | None = None,
+            agent_args: list[str] | None = None,
+            transport: AgentTransport | None = None,
+            agent_log: AgentLogOptions | None = None,
     ) -> "CodyServer":
         """
         初始化CodyServer实例的类方法。
@@ -33,28 +47,86 @@ class CodyServer:
         binary_path (str): 二进制文件的路径
         version (str): Cody代理的版本
         use_tcp (bool): 是否使用TCP连接，默认为False
+        request_timeouts (dict[str, float] | None): 按方法覆盖默认的请求截止时间（秒）
+        record_path (str | None): 如果指定，把收发的每一帧录制到该文件（覆盖已有的文件），可用CodyServer.replay回放
+        agent_args (list[str] | None): 放在"api jsonrpc-stdio"之前的额外启动参数，
+            例如用codypy.fake_agent.fake_agent_args()启动本地模拟代理
+        transport (AgentTransport | None): 与代理通信的传输，例如指定端点的TcpTransport，
+            或连接到已在运行的代理的UnixSocketTransport。为None时由use_tcp决定
+        agent_log (AgentLogOptions | None): 代理输出的处理方式，默认写入共享的轮转日志文件
 
         返回:
         CodyServer: 初始化后的CodyServer实例
         """
         # cody_binary = await _get_cody_binary(binary_path, version)
-        cody_server = cls(cody_binary_file, use_tcp)
+        cody_server = cls(
+            cody_binary_file, use_tcp, request_timeouts, agent_args, transport, agent_log
+        )
+        if record_path is not None:
+            cody_server._recorder = WireRecorder(record_path)
         await cody_server._create_server_connection()
         return cody_server
 
-    def __init__(self, cody_binary: str, use_tcp: bool) -> None:
+    @classmethod
+    async def replay(
+            cls,
+            record_path: str,
+            realtime: bool = False,
+            request_timeouts: dict[str, float] | None = None,
+    ) -> "CodyServer":
+        """
+        创建一个回放录制会话的CodyServer实例，不启动代理进程，也不需要网络。
+
+        参数:
+        record_path (str): 由record_path参数录制的文件
+        realtime (bool): 是否保持录制时的时间间隔，默认为False（尽可能快）
+        request_timeouts (dict[str, float] | None): 按方法覆盖默认的请求截止时间（秒）
+
+        返回:
+        CodyServer: 连接到回放传输的CodyServer实例
+        """
+        cody_server = cls("", False, request_timeouts)
+        cody_server._replay = ReplayTransport(record_path, realtime)
+        cody_server._reader, cody_server._writer = cody_server._replay.start()
+        cody_server._start_connection()
+        logger.info("已连接到录制 %s 的回放", record_path)
+        return cody_server
+
+    def __init__(
+            self,
+            cody_binary: str,
+            use_tcp: bool,
+            request_timeouts: dict[str, float] | None = None,
+            agent_args: list[str] | None = None,
+            transport: AgentTransport | None = None,
+            agent_log: AgentLogOptions | None = None,
+    ) -> None:
         """
         初始化CodyServer实例。
 
         参数:
         cody_binary (str): Cody代理二进制文件的路径
         use_tcp (bool): 是否使用TCP连接
+        request_timeouts (dict[str, float] | None): 按方法覆盖默认的请求截止时间（秒）
+        agent_args (list[str] | None): 放在"api jsonrpc-stdio"之前的额外启动参数
+        transport (AgentTransport | None): 与代理通信的传输，为None时use_tcp选择
+            默认端点的TcpTransport，否则使用StdioTransport
+        agent_log (AgentLogOptions | None): 代理输出的处理方式
         """
+        if transport is None:
+            transport = TcpTransport() if use_tcp else StdioTransport()
         self.cody_binary = cody_binary
-        self.use_tcp = use_tcp
+        self.transport = transport
+        self.use_tcp = isinstance(transport, TcpTransport)
+        self.request_timeouts = request_timeouts
+        self.agent_args: list[str] = list(agent_args or [])
         self._process: Process | None = None
         self._reader: asyncio.StreamReader | None = None
         self._writer: asyncio.StreamWriter | None = None
+        self.connection: JsonRpcConnection | None = None  # 多路复用的JSON-RPC连接
+        self._recorder: WireRecorder | None = None
+        self._replay: ReplayTransport | None = None
+        self.agent_log = AgentLog(agent_log)  # 代理输出，跨越重启保留最近的输出
 
     async def _create_server_connection(
             self, test_against_node_source: bool = False
@@ -62,29 +134,36 @@ class CodyServer:
         """
         异步创建与Cody服务器的连接。
 
-        如果`cody_binary`为空字符串，则抛出异常。
-        根据`use_tcp`和调试标志设置环境变量。
-        创建子进程运行Cody代理，可以是执行二进制文件或运行指定的index.js文件。
-        根据`use_tcp`标志，使用stdio或TCP连接到代理。
-        如果TCP连接失败（重试5次后），抛出异常。
+        如果传输需要启动代理进程，则创建子进程运行Cody代理，可以是执行二进制文件
+        或运行指定的index.js文件，环境变量由调试标志和传输共同决定。
+        之后由传输建立读写流：stdio直接使用进程的管道，TCP和Unix域套接字等待代理开始监听后连接。
 
         参数:
         test_against_node_source (bool): 是否使用Node源代码进行测试，默认为False
 
         异常:
         AgentBinaryNotFoundError: 如果Cody代理二进制文件路径为空
-        ServerTCPConnectionError: 如果TCP连接失败
+        ServerConnectionError: 如果无法通过网络传输连接到代理
         """
+        if not self.transport.spawn:
+            logger.info("正在连接到已在运行的Cody代理 (%s)", self.transport.describe())
+            self._process = None
+            self._reader, self._writer = await self.transport.connect(None)
+            self._start_connection()
+            return
+
         if not test_against_node_source and self.cody_binary == "":
             raise AgentBinaryNotFoundError(
                 "Cody代理二进制文件路径为空。您需要指定BINARY_PATH为代理二进制文件"
                 "或index.js文件的绝对路径。"
             )
 
-        # 设置调试相关的环境变量
+        # 设置调试相关的环境变量，只影响代理进程，不修改当前进程的环境
         debug = logger.getEffectiveLevel() == logging.DEBUG
-        os.environ["CODY_AGENT_DEBUG_REMOTE"] = str(self.use_tcp).lower()
-        os.environ["CODY_DEBUG"] = str(debug).lower()
+        env = dict(os.environ)
+        env["CODY_AGENT_DEBUG_REMOTE"] = "false"
+        env["CODY_DEBUG"] = str(debug).lower()
+        env.update(self.transport.environment())
 
         # 准备启动参数
         args = []
@@ -99,74 +178,199 @@ class CodyServer:
             )
         else:
             binary = self.cody_binary
+        args.extend(self.agent_args)
         args.append("api")
         args.append("jsonrpc-stdio")
-        log_filename = f"log/cody_agent_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-        # 确保日志目录存在
-        os.makedirs(os.path.dirname(log_filename), exist_ok=True)
-        log_file = open(log_filename, 'wb')
+        # 标准错误通过管道由AgentLog读取；传输不使用标准输出时，它同样由AgentLog读取
+        stdio = self.transport.process_stdio()
+        read_stdout = "stdout" not in stdio
+        stdio.setdefault("stdout", asyncio.subprocess.PIPE)
         self._process: Process = await asyncio.create_subprocess_exec(
             binary,
             *args,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=log_file,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            **stdio,
         )
+        self.agent_log.attach(self._process, read_stdout=read_stdout)
         logger.info("创建了PID为%d的Cody代理进程", self._process.pid)
-        self._reader = self._process.stdout
-        self._writer = self._process.stdin
 
-        if not self.use_tcp:
-            logger.info("已创建与Cody代理的stdio连接")
-        else:
-            # TCP连接逻辑
-            retry: int = 0
-            retry_attempts: int = 5
-            # TODO: 考虑使这些参数可配置
-            host: str = "localhost"
-            port: int = 3113
-            for retry in range(retry_attempts):
-                try:
-                    (self._reader, self._writer) = await asyncio.open_connection(
-                        host, port
-                    )
-                    if self._reader is not None and self._writer is not None:
-                        logger.info(
-                            "已创建与Cody代理的TCP连接 (%s:%s)",
-                            host,
-                            port,
-                        )
-                        break
-                except ConnectionRefusedError as exc:
-                    # TODO: 这不是最优雅的重试方式，但它保持了日志的简洁。考虑重构。
-                    await asyncio.sleep(1)  # 短暂延迟后重试
-                    retry += 1
-                    if retry == retry_attempts:
-                        logger.debug(
-                            "尝试连接到%s:%s时耗尽了%d次重试机会",
-                            retry_attempts,
-                            host,
-                            port,
-                        )
-                        raise ServerTCPConnectionError(
-                            "无法连接到服务器: %s:%s", host, port
-                        ) from exc
-                    else:
-                        logger.debug(
-                            "连接到%s:%s失败，正在重试 (%d)",
-                            host,
-                            port,
-                            retry,
-                        )
-
-    async def cleanup_server(self):
-        """
-        清理服务器连接。
-
-        向服务器发送"shutdown"请求，并在服务器进程仍在运行时终止它。
+        try:
+            self._reader, self._writer = await self.transport.connect(self._process)
+        except BaseException:
+            await self._stop_process(force=True)
+            raise
+        logger.info("已创建与Cody代理的%s连接", self.transport.describe())
+        self._start_connection()
+
+    def _start_connection(self) -> None:
+        """
+        由连接对象独占读写流，并启动负责读取和分发所有响应的后台任务。
+        """
+        self.connection = JsonRpcConnection(
+            self._reader,
+            self._writer,
+            timeouts=self.request_timeouts,
+            recorder=self._recorder,
+        )
+        self.connection.start()
+
+    async def cleanup_server(
+            self,
+            drain_timeout: float = DRAIN_TIMEOUT,
+            shutdown_timeout: float = SHUTDOWN_TIMEOUT,
+            terminate_timeout: float = TERMINATE_TIMEOUT,
+    ) -> None:
+        """
+        在有限的时间内优雅地关闭代理。
+
+        1. 停止接受新的请求，等待进行中的请求最多drain_timeout秒，之后仍未完成的请求失败
+        2. 发送"shutdown"请求（最多等待shutdown_timeout秒）和"exit"通知
+        3. 关闭连接和写入端，代理读到EOF
+        4. 等待进程自行退出最多shutdown_timeout秒，然后发送SIGTERM，terminate_timeout秒后发送SIGKILL
+
+        最坏情况下用时约为drain_timeout + 2 * shutdown_timeout + terminate_timeout。
+        连接到已在运行的代理时不发送shutdown和exit，也不终止它。重复调用是安全的。
+
+        参数:
+        drain_timeout (float): 等待进行中的请求完成的时间（秒）
+        shutdown_timeout (float): 等待shutdown响应和进程自行退出的时间（秒）
+        terminate_timeout (float): 发送SIGTERM后等待进程退出的时间（秒）
         """
         logger.info("正在清理服务器...")
-        await _send_jsonrpc_request(self._writer, "shutdown", None)
-        if self._process.returncode is None:
-            self._process.terminate()
+        connection = self.connection
+        if connection is not None and not connection.closed:
+            if not await connection.drain(drain_timeout):
+                logger.warning(
+                    "%d个请求没有在%.1f秒内完成，放弃等待", connection.in_flight, drain_timeout
+                )
+            if self.transport.spawn:
+                try:
+                    await connection.request("shutdown", None, timeout=shutdown_timeout)
+                    await connection.notify("exit")
+                except CodyPyError as exc:
+                    logger.debug("shutdown/exit握手未正常完成: %r", exc)
+        if connection is not None:
+            await connection.close()
+        if self._recorder is not None:
+            self._recorder.close()
+        if self._replay is not None:
+            await self._replay.close()
+        await self._stop_process(
+            exit_timeout=shutdown_timeout, terminate_timeout=terminate_timeout
+        )
+
+    async def __aenter__(self) -> "CodyServer":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.cleanup_server()
+
+    async def restart(self, error: Exception | None = None) -> None:
+        """
+        不经过shutdown握手，直接停止当前的代理进程并启动一个新的进程。
+
+        用于代理已经崩溃或无响应的情况。当前连接上未完成的请求会立即以error失败，
+        之后的请求通过新的连接发送。重启后需要重新初始化代理。
+
+        参数:
+        error (Exception | None): 交给未完成请求的异常，默认为AgentConnectionClosedError
+
+        异常:
+        CodyPyError: 如果这是一个回放录制的实例
+        """
+        if self._replay is not None:
+            raise CodyPyError("回放录制的CodyServer不能重启")
+        if self.connection is not None:
+            await self.connection.close(error)
+        await self._stop_process(force=True)
+        if tail := self.agent_log.tail():
+            logger.warning("代理进程最近的输出:\n%s", tail)
+        await self._create_server_connection()
+
+    @property
+    def pid(self) -> int | None:
+        """代理进程的PID，没有进程时为None。"""
+        return self._process.pid if self._process is not None else None
+
+    @property
+    def returncode(self) -> int | None:
+        """代理进程的退出码，进程仍在运行或没有进程时为None。"""
+        return self._process.returncode if self._process is not None else None
+
+    async def wait_process(self) -> int | None:
+        """
+        等待代理进程退出。
+
+        返回:
+        int | None: 进程的退出码，没有进程时立即返回None
+        """
+        if self._process is None:
+            return None
+        return await self._process.wait()
+
+    async def _stop_process(
+            self,
+            force: bool = False,
+            exit_timeout: float = 0.0,
+            terminate_timeout: float = TERMINATE_TIMEOUT,
+    ) -> None:
+        """
+        终止代理进程并等待它退出。
+
+        参数:
+        force (bool): 是否直接强制结束，用于已经崩溃或挂起的进程
+        exit_timeout (float): 发送SIGTERM之前等待进程自行退出的时间（秒），用于已经收到exit的进程
+        terminate_timeout (float): 发送SIGTERM后等待的时间（秒），超时后强制结束
+        """
+        if self._process is None:
+            return
+        if self._process.returncode is None and force:
+            self._process.kill()
+        elif self._process.returncode is None:
+            if not await self._wait_process(exit_timeout):
+                self._process.terminate()
+                if not await self._wait_process(terminate_timeout):
+                    # 挂起或被暂停的进程不会响应SIGTERM
+                    logger.warning(
+                        "代理进程%d没有在%.1f秒内退出，强制结束",
+                        self._process.pid,
+                        terminate_timeout,
+                    )
+                    self._process.kill()
         await self._process.wait()
+        await self.agent_log.drain()
+
+    async def _wait_process(self, timeout: float) -> bool:
+        """
+        等待代理进程退出最多timeout秒。
+
+        返回:
+        bool: 进程是否已经退出
+        """
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(self._process.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._process.returncode is not None
+
+
+async def shutdown_servers(
+        servers: Iterable[CodyServer], **shutdown_options: float
+) -> list[BaseException | None]:
+    """
+    并行关闭多个代理，总用时由最慢的一个决定，而不是所有代理的用时之和。
+
+    参数:
+    servers (Iterable[CodyServer]): 要关闭的代理
+    shutdown_options: 传给CodyServer.cleanup_server的截止时间
+
+    返回:
+    list[BaseException | None]: 每个代理关闭时的异常，成功关闭时为None
+    """
+    results = await asyncio.gather(
+        *(server.cleanup_server(**shutdown_options) for server in servers),
+        return_exceptions=True,
+    )
+    return [result if isinstance(result, BaseException) else None for result in results]
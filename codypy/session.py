@@ -0,0 +1,479 @@
+import asyncio
+import contextlib
+import logging
+import uuid
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+from codypy.cache import ResponseCache
+from codypy.client_info import Models
+from codypy.exceptions import JsonRpcError
+from codypy.messaging import _show_last_message, _text_delta
+from codypy.protocol import ChatMessage, Transcript
+from codypy.server import CodyServer
+from codypy.transcript_index import TranscriptIndex
+
+if TYPE_CHECKING:
+    from codypy.agent import CodyAgent
+
+logger = logging.getLogger(__name__)
+
+# 表示用户想要结束对话的输入
+EXIT_COMMANDS = ("/quit", "/bye", "/exit")
+
+
+class ChatSession:
+    """
+    ChatSession 类代表 Cody 代理中的一个聊天会话。
+
+    每个会话有自己的聊天 ID、模型、仓库上下文和上下文文件。
+    同一个代理进程上的多个会话共享一个连接，它们的 chat() 可以同时调用；
+    同一个会话上的多次调用按顺序进行，因为代理中的一个聊天一次只能生成一个回答。
+    """
+
+    @classmethod
+    async def create(
+        cls,
+        agent: "CodyAgent",
+        context_files: list | None = None,
+    ) -> "ChatSession":
+        """
+        在代理所在的 Cody 服务器上创建一个新的聊天会话。
+
+        与 CodyAgent.new_chat 不同，创建的会话不会成为代理的默认会话。
+
+        参数:
+            agent (CodyAgent): 已经完成 initialize_agent 的代理。
+            context_files (list, optional): 这个会话每条消息都附带的上下文文件，例如 append_paths 的结果。
+
+        返回:
+            ChatSession: 新的聊天会话。
+        """
+        await agent.wait_ready()
+        chat_id = await agent._cody_server.connection.request("chat/new", None)
+        logger.info("新的聊天会话 %s 已创建", chat_id)
+        session = cls(agent, chat_id, context_files)
+        agent._sessions.add(session)
+        return session
+
+    def __init__(
+        self,
+        agent: "CodyAgent",
+        chat_id: str,
+        context_files: list | None = None,
+    ) -> None:
+        """
+        初始化 ChatSession 实例。通常应使用 CodyAgent.new_chat 或 ChatSession.create 创建会话。
+
+        参数:
+            agent (CodyAgent): 会话所属的代理，会话的请求都发往它的 Cody 服务器。
+            chat_id (str): 代理返回的聊天会话 ID。
+            context_files (list, optional): 这个会话每条消息都附带的上下文文件。
+        """
+        self.agent = agent
+        self.chat_id: str = chat_id
+        self.current_repo_context: list[str] = []  # 当前使用的仓库上下文
+        self.current_model: Models | None = None  # 通过 set_model 设置的模型
+        # 每条消息都附带的上下文文件
+        self.context_files: list = list(context_files or [])
+        self.last_context_files: list[str] = []  # 最近一次回答推断出的上下文文件
+        # 按轮次保存的上下文文件，每次回答只处理新增的消息
+        self.transcript_index = TranscriptIndex()
+        # 代理最近一次返回的完整对话，迁移时用于恢复聊天
+        self.messages: list[ChatMessage] = []
+        self.history_lost: bool = False  # 迁移或恢复时代理中的对话历史是否没能恢复
+        self._lock = asyncio.Lock()  # 同一个会话上的消息按顺序提交
+
+    @property
+    def _cody_server(self) -> CodyServer:
+        """会话所在的 Cody 服务器，即所属代理的服务器。"""
+        return self.agent._cody_server
+
+    async def set_context_repo(self, repos: list[str]) -> None:
+        """
+        设置用作上下文的仓库。
+
+        这个方法更新当前的仓库上下文，并将选定的仓库配置为聊天上下文。
+
+        参数:
+            repos (list[str]): 应该用作聊天上下文的仓库名称列表。
+        """
+
+        if self.current_repo_context == repos:
+            return
+
+        self.current_repo_context = repos
+        await self.agent.wait_ready()
+        await self._send_repo_context(self.agent, self.chat_id, repos)
+
+    @staticmethod
+    async def _send_repo_context(
+        agent: "CodyAgent", chat_id: str, repos: list[str]
+    ) -> None:
+        """
+        把仓库上下文发送给指定代理上的聊天会话。
+        """
+        repo_objects = await agent._lookup_repo_ids(repos=repos)
+
+        command = {
+            "id": chat_id,
+            "message": {
+                "command": "context/choose-remote-search-repo",
+                "explicitRepos": repo_objects,
+            },
+        }
+        await agent._cody_server.connection.request(
+            "webview/receiveMessage",
+            command,
+        )
+
+    async def set_model(self, model: Models = Models.Claude3Sonnet) -> Any:
+        """
+        设置聊天会话使用的模型。
+
+        模型先按代理的 model_catalog 在本地检查，账户不可用的模型不会发送给代理。
+
+        参数:
+            model (Models): 要使用的模型。默认为 Models.Claude3Sonnet。
+
+        返回:
+            Any: "webview/receiveMessage" 请求的结果。
+
+        异常:
+            ModelNotAvailableError: 如果模型对当前账户不可用。
+        """
+        await self.agent.wait_ready()
+        await self.agent.model_catalog.check(self.agent, model)
+        result = await self._send_model(self.agent, self.chat_id, model)
+        self.current_model = model
+        return result
+
+    @staticmethod
+    async def _send_model(agent: "CodyAgent", chat_id: str, model: Models) -> Any:
+        """
+        把模型选择发送给指定代理上的聊天会话。
+        """
+        command = {
+            "id": f"{chat_id}",
+            "message": {"command": "chatModel", "model": f"{model.value.model_id}"},
+        }
+
+        return await agent._cody_server.connection.request(
+            "webview/receiveMessage",
+            command,
+        )
+
+    async def restore(self) -> None:
+        """
+        在会话所在的服务器上重新创建聊天会话，并恢复对话历史、仓库上下文和模型。
+
+        用于代理进程重启之后，原来的聊天 ID 在新进程中已经无效。
+        """
+        await self.move_to(self.agent)
+
+    async def move_to(self, agent: "CodyAgent") -> None:
+        """
+        把聊天会话迁移到另一个已经初始化的代理（通常位于另一个 Cody 服务器上）。
+
+        迁移持有会话的锁：先等待正在进行的 chat()/chat_stream() 在原来的服务器上完成，
+        再在目标代理上用 "chat/restore" 重建包含全部对话的聊天，并恢复仓库上下文和模型，
+        最后同时切换所属代理和聊天 ID。迁移期间发起的消息会等到迁移完成后发往新的聊天。
+        目标代理不支持 "chat/restore" 时改为创建空的聊天，此时 history_lost 被设为 True，
+        之后的回答不再基于此前的对话。
+
+        参数:
+            agent (CodyAgent): 已经完成 initialize_agent 的目标代理。
+        """
+        async with self._lock:
+            chat_id = await self._recreate_chat(agent)
+            if self.current_repo_context:
+                await self._send_repo_context(agent, chat_id, self.current_repo_context)
+            if self.current_model is not None:
+                await self._send_model(agent, chat_id, self.current_model)
+            logger.info("聊天会话 %s 已重建为 %s", self.chat_id, chat_id)
+            if agent is not self.agent:
+                self.close()
+                agent._sessions.add(self)
+                self.agent = agent
+            self.chat_id = chat_id
+
+    async def _recreate_chat(self, agent: "CodyAgent") -> str:
+        """
+        在目标代理上创建包含此前对话的聊天，返回新的聊天 ID。
+        """
+        connection = agent._cody_server.connection
+        if self.messages:
+            model_id = self.current_model.value.model_id if self.current_model else None
+            try:
+                return await connection.request(
+                    "chat/restore",
+                    {
+                        "modelID": model_id,
+                        "messages": self.messages,
+                        "chatID": uuid.uuid4().hex,
+                    },
+                )
+            except JsonRpcError as exc:
+                logger.warning("无法恢复聊天会话 %s 的对话历史: %r", self.chat_id, exc)
+                self.history_lost = True
+        chat_id = await connection.request("chat/new", None)
+        # 新的聊天从空的 transcript 开始
+        self.messages = []
+        self.transcript_index.rebase()
+        return chat_id
+
+    async def chat(
+        self,
+        message,
+        enhanced_context: bool = False,
+        show_context_files: bool = False,
+        context_files=None,
+    ):
+        """
+        向 Cody 服务器发送聊天消息并返回响应。
+
+        参数:
+            message (str): 要发送给 Cody 服务器的消息。
+            enhanced_context (bool, optional): 是否在聊天消息请求中包含增强上下文。默认为 False。
+            show_context_files (bool, optional): 是否显示上下文文件。默认为 False。
+            context_files (list, optional): 这条消息额外附带的上下文文件列表。默认为 None。
+
+        返回:
+            tuple: 包含响应文本和上下文文件的元组。
+        """
+        if message in EXIT_COMMANDS:
+            logger.debug("用户输入了退出命令，返回空响应")
+            return "", []
+
+        # 在获取锁之前等待代理就绪：重启后恢复会话（move_to）需要这个锁
+        await self.agent.wait_ready()
+        async with self._lock:
+            cache, cache_key = await self._cache_key(
+                message, enhanced_context, show_context_files, context_files
+            )
+            if cache is not None and (cached := await cache.get(cache_key)) is not None:
+                logger.debug("聊天消息命中回答缓存")
+                self.last_context_files = cached.context_files
+                return (cached.response, cached.context_files)
+
+            chat_message_request = self._chat_message_request(
+                message, enhanced_context, context_files
+            )
+            logger.debug(f"准备发送聊天消息请求：{chat_message_request}")
+
+            async with self._rate_limit():
+                result: Transcript = await self._cody_server.connection.request(
+                    "chat/submitMessage",
+                    chat_message_request,
+                    result_type=Transcript,
+                )
+            logger.debug(f"收到聊天消息响应：{result}")
+
+            speaker, response, _ = await _show_last_message(result, False)
+            self._remember_transcript(result)
+            context_files_response = (
+                self.transcript_index.turn_context_files() if show_context_files else []
+            )
+            logger.debug(
+                f"解析响应结果：speaker={speaker}, response长度={len(response)}, context_files_response长度={len(context_files_response)}"
+            )
+            if speaker == "" or response == "":
+                logger.error("提交聊天消息失败: %s", result)
+                return None
+            logger.debug("成功获取聊天响应，准备返回结果")
+            self.last_context_files = context_files_response
+            if cache is not None:
+                cache.put(cache_key, response, context_files_response)
+            return (response, context_files_response)
+
+    async def chat_stream(
+        self,
+        message,
+        enhanced_context: bool = False,
+        show_context_files: bool = False,
+        context_files=None,
+    ) -> AsyncIterator[str]:
+        """
+        向 Cody 服务器发送聊天消息，并在回答生成过程中逐段产出新增的文本。
+
+        代理在生成回答时会不断推送带有 isMessageInProgress 标记的完整 transcript，
+        这里根据相邻两次推送中最后一条助手消息的差异计算出文本增量。
+        代理规格中的 ClientCapabilities.chat 应设置为 "streaming"。
+
+        参数:
+            message (str): 要发送给 Cody 服务器的消息。
+            enhanced_context (bool, optional): 是否在聊天消息请求中包含增强上下文。默认为 False。
+            show_context_files (bool, optional): 是否在结束后把上下文文件保存到 last_context_files。默认为 False。
+            context_files (list, optional): 这条消息额外附带的上下文文件列表。默认为 None。
+
+        产生:
+            str: 回答文本的增量片段，依次拼接即为完整回答。
+        """
+        if message in EXIT_COMMANDS:
+            logger.debug("用户输入了退出命令，结束流式输出")
+            return
+
+        # 在获取锁之前等待代理就绪：重启后恢复会话（move_to）需要这个锁
+        await self.agent.wait_ready()
+        async with self._lock:
+            cache, cache_key = await self._cache_key(
+                message, enhanced_context, show_context_files, context_files
+            )
+            if cache is not None and (cached := await cache.get(cache_key)) is not None:
+                logger.debug("聊天消息命中回答缓存")
+                self.last_context_files = cached.context_files
+                yield cached.response
+                return
+
+            connection = self._cody_server.connection
+            chat_id = f"{self.chat_id}"
+            async with self._rate_limit():
+                transcripts = connection.subscribe_transcripts(chat_id)
+                submit = asyncio.create_task(
+                    connection.request(
+                        "chat/submitMessage",
+                        self._chat_message_request(
+                            message, enhanced_context, context_files
+                        ),
+                        result_type=Transcript,
+                    )
+                )
+                streamed = ""
+                try:
+                    while not submit.done() or not transcripts.empty():
+                        if transcripts.empty():
+                            update = asyncio.create_task(transcripts.get())
+                            await asyncio.wait(
+                                {update, submit}, return_when=asyncio.FIRST_COMPLETED
+                            )
+                            if not update.done():
+                                update.cancel()
+                                continue
+                            transcript: Transcript = update.result()
+                        else:
+                            transcript = transcripts.get_nowait()
+
+                        speaker, text, _ = await _show_last_message(transcript, False)
+                        if speaker == "assistant" and text:
+                            delta = _text_delta(streamed, text)
+                            streamed = text
+                            if delta:
+                                yield delta
+
+                    result = submit.result()
+                    speaker, response, _ = await _show_last_message(result, False)
+                    self._remember_transcript(result)
+                    context_files_response = (
+                        self.transcript_index.turn_context_files()
+                        if show_context_files
+                        else []
+                    )
+                    if speaker == "" or response == "":
+                        logger.error("提交聊天消息失败: %s", result)
+                        return
+                    self.last_context_files = context_files_response
+                    if cache is not None:
+                        cache.put(cache_key, response, context_files_response)
+                    if delta := _text_delta(streamed, response):
+                        yield delta
+                finally:
+                    connection.unsubscribe_transcripts(chat_id, transcripts)
+                    if not submit.done():
+                        submit.cancel()
+
+    def _remember_transcript(self, result: Transcript | None) -> None:
+        """
+        保存代理返回的完整对话，并更新上下文文件的索引。
+        """
+        if result is not None and result.messages:
+            self.messages = result.messages
+        self.transcript_index.update(result)
+
+    def _rate_limit(self) -> contextlib.AbstractAsyncContextManager:
+        """
+        返回在代理的限速器限制内发送请求的上下文管理器；代理没有限速器时不做限制。
+        """
+        limiter = self.agent.rate_limiter
+        if limiter is None:
+            return contextlib.nullcontext()
+        model_id = (
+            self.current_model.value.model_id if self.current_model is not None else ""
+        )
+        return limiter.slot(self.agent, model_id)
+
+    async def _cache_key(
+        self,
+        message: str,
+        enhanced_context: bool,
+        show_context_files: bool,
+        context_files: list | None,
+    ) -> tuple[ResponseCache | None, str | None]:
+        """
+        返回代理的回答缓存和这条消息的缓存键；代理没有启用缓存时都为 None。
+
+        命中的回答不会发送给代理，只有会话还没有对话历史（代理中的聊天为空）时，
+        缓存的回答才与代理会给出的回答相当，因此会话一旦有了代理回答过的一轮对话，就不再使用缓存。
+        """
+        cache = self.agent.response_cache
+        if cache is None or self.transcript_index.turns:
+            return None, None
+        model_id = (
+            self.current_model.value.model_id if self.current_model is not None else ""
+        )
+        return cache, await cache.key(
+            model_id,
+            message,
+            [*self.context_files, *(context_files or [])],
+            enhanced_context,
+            show_context_files,
+        )
+
+    def _chat_message_request(
+        self,
+        message: str,
+        enhanced_context: bool,
+        context_files: list | None,
+    ) -> dict:
+        """
+        构造 "chat/submitMessage" 请求的参数。
+
+        参数:
+            message (str): 用户消息文本。
+            enhanced_context (bool): 是否包含增强上下文。
+            context_files (list | None): 这条消息额外附带的上下文文件列表，附加在会话的上下文文件之后。
+
+        返回:
+            dict: 请求参数。
+        """
+        return {
+            "id": f"{self.chat_id}",
+            "message": {
+                "command": "submit",
+                "text": message,
+                "submitType": "user",
+                "addEnhancedContext": enhanced_context,
+                "contextFiles": [*self.context_files, *(context_files or [])],
+            },
+        }
+
+    def close(self) -> None:
+        """
+        放弃这个会话。之后代理不再为它恢复聊天，也不再把它作为默认会话。
+        """
+        self.agent._sessions.discard(self)
+        if self.agent._session is self:
+            self.agent._session = None
+
+    async def delete(self) -> None:
+        """
+        放弃这个会话，并在代理中删除对应的聊天，释放它在代理进程中占用的内存。
+
+        不支持 "chat/delete" 的旧版代理只在本地放弃会话。
+        """
+        self.close()
+        connection = self._cody_server.connection
+        if connection.closed:
+            return
+        try:
+            await connection.request("chat/delete", {"chatId": self.chat_id})
+        except JsonRpcError as exc:
+            logger.debug("删除聊天会话 %s 失败: %r", self.chat_id, exc)
@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import random
+import time
+import weakref
+from enum import Enum
+from typing import Any, Dict
+
+from codypy.agent import CodyAgent
+from codypy.client_info import AgentSpecs
+from codypy.exceptions import AgentCrashedError, CodyPyError, RequestTimeoutError
+from codypy.server import CodyServer
+from codypy.session import ChatSession
+from codypy.warm import spawn_agent
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认的存活探测：一个代理在本地即可回答的轻量请求
+DEFAULT_PROBE_METHOD = "chat/models"
+DEFAULT_PROBE_PARAMS: Dict[str, Any] = {"modelUsage": "chat"}
+
+
+class SupervisorState(Enum):
+    """
+    监督器的状态。
+
+    - RUNNING: 代理正常运行
+    - RESTARTING: 正在重启代理并恢复会话
+    - FAILED: 连续重启次数超过上限，监督器已放弃
+    - STOPPED: 监督器已关闭
+    """
+
+    RUNNING = "running"
+    RESTARTING = "restarting"
+    FAILED = "failed"
+    STOPPED = "stopped"
+
+
+class AgentSupervisor:
+    """
+    自愈的代理监督器。
+
+    监督器同时观察三种故障：代理进程退出（returncode）、连接到达EOF，
+    以及连续多次存活探测超时（代理挂起）。发现故障后，未完成的请求立即以AgentCrashedError失败，
+    监督器按指数退避（带随机抖动）重启代理进程，重新执行initialize_agent，
+    并为每个会话重新创建聊天，恢复set_context_repo和set_model的状态。
+
+    被监督的代理及用attach登记的代理创建的所有ChatSession都会被恢复。重启后它们的chat_id
+    会变为新进程中的ID，对象本身保持不变，因为它们引用的是同一个CodyServer。
+    重启和恢复期间，这些代理的会话发起的请求会等待恢复完成（见CodyAgent.wait_ready）。
+    """
+
+    @classmethod
+    async def start(
+        cls,
+        agent_specs: AgentSpecs,
+        cody_binary_file: str,
+        version: str,
+        supervisor_options: Dict[str, Any] | None = None,
+        **server_options: Any,
+    ) -> "AgentSupervisor":
+        """
+        启动并初始化一个代理，然后开始监督它。
+
+        参数:
+        agent_specs (AgentSpecs): 初始化使用的代理规格
+        cody_binary_file (str): Cody代理二进制文件的路径
+        version (str): Cody代理的版本
+        supervisor_options (Dict[str, Any] | None): 传给AgentSupervisor构造函数的参数
+        server_options: 传给CodyServer.init的其他参数
+
+        返回:
+        AgentSupervisor: 已经开始监督的监督器
+        """
+        server, agent = await spawn_agent(
+            agent_specs, cody_binary_file, version, **server_options
+        )
+        supervisor = cls(server, agent, **(supervisor_options or {}))
+        supervisor.watch()
+        return supervisor
+
+    def __init__(
+        self,
+        server: CodyServer,
+        agent: CodyAgent,
+        probe_interval: float = 30.0,
+        probe_timeout: float = 10.0,
+        probe_failures: int = 2,
+        probe_method: str = DEFAULT_PROBE_METHOD,
+        probe_params: Any = DEFAULT_PROBE_PARAMS,
+        backoff_initial: float = 1.0,
+        backoff_max: float = 60.0,
+        max_restarts: int | None = None,
+    ) -> None:
+        """
+        初始化AgentSupervisor实例。调用watch()后才开始监督。
+
+        参数:
+        server (CodyServer): 被监督的代理进程
+        agent (CodyAgent): 已经在该进程上完成initialize_agent的代理，重启后用它重新初始化
+        probe_interval (float): 存活探测的间隔（秒），为0时不探测
+        probe_timeout (float): 单次探测的截止时间（秒）
+        probe_failures (int): 连续多少次探测超时视为代理挂起
+        probe_method (str): 探测使用的方法
+        probe_params (Any): 探测使用的参数
+        backoff_initial (float): 第一次重启失败后的等待时间（秒）
+        backoff_max (float): 重启等待时间的上限（秒）
+        max_restarts (int | None): 连续重启失败的次数上限，为None时不限
+        """
+        self.server = server
+        self.agent = agent
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.probe_failures = probe_failures
+        self.probe_method = probe_method
+        self.probe_params = probe_params
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_restarts = max_restarts
+        self.state = SupervisorState.RUNNING
+        self._agents: weakref.WeakSet = weakref.WeakSet()  # 重启后需要恢复会话的代理
+        self._agents.add(agent)
+        agent.ready_gate = self.wait_ready
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._watch_task: asyncio.Task | None = None
+        self.restarts: int = 0  # 成功完成的重启次数
+        self.restart_failures: int = 0  # 重启失败的次数
+        self.last_failure: str | None = None  # 最近一次故障的原因
+        # 最近一次从发现故障到恢复所用的时间
+        self.last_recovery_seconds: float | None = None
+
+    def watch(self) -> None:
+        """
+        启动后台监督任务。重复调用不会创建第二个任务。
+        """
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_loop())
+
+    def attach(self, agent: CodyAgent) -> CodyAgent:
+        """
+        登记另一个使用被监督进程的代理，重启后为它的所有会话恢复聊天状态，重启期间它的会话请求会等待恢复完成。
+
+        参数:
+        agent (CodyAgent): 绑定在被监督的CodyServer上的代理
+
+        返回:
+        CodyAgent: 传入的代理
+        """
+        if agent._cody_server is not self.server:
+            raise ValueError("只能登记使用被监督进程的代理")
+        self._agents.add(agent)
+        agent.ready_gate = self.wait_ready
+        return agent
+
+    async def new_chat(self, context_files: list | None = None) -> ChatSession:
+        """
+        在被监督的进程上创建一个新的聊天会话，重启后会自动恢复。
+
+        参数:
+        context_files (list | None): 这个会话每条消息都附带的上下文文件
+
+        返回:
+        ChatSession: 新的聊天会话
+        """
+        await self.wait_ready()
+        return await ChatSession.create(self.agent, context_files)
+
+    async def wait_ready(self) -> None:
+        """
+        等待正在进行的重启完成。
+
+        异常:
+        CodyPyError: 如果监督器已经放弃或已关闭
+        """
+        await self._ready.wait()
+        if self.state is SupervisorState.FAILED:
+            raise CodyPyError(f"代理重启失败次数超过上限: {self.last_failure}")
+        if self.state is SupervisorState.STOPPED:
+            raise CodyPyError("监督器已关闭")
+
+    async def _watch_loop(self) -> None:
+        """
+        后台监督任务：等待故障，然后恢复，直到监督器关闭或放弃。
+        """
+        while self.state is SupervisorState.RUNNING:
+            reason = await self._wait_for_failure()
+            if self.state is not SupervisorState.RUNNING:
+                return
+            await self._recover(reason)
+
+    async def _wait_for_failure(self) -> str:
+        """
+        等待当前进程出现任意一种故障。
+
+        返回:
+        str: 故障原因
+        """
+        connection = self.server.connection
+        watchers = {
+            asyncio.create_task(self._connection_closed(connection)),
+            asyncio.create_task(self._probe_until_hung()),
+        }
+        if self.server._process is not None:
+            watchers.add(asyncio.create_task(self._process_exited()))
+        try:
+            done, _ = await asyncio.wait(watchers, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for watcher in watchers:
+                watcher.cancel()
+        return done.pop().result()
+
+    async def _connection_closed(self, connection) -> str:
+        await connection.wait_closed()
+        return "连接已关闭"
+
+    async def _process_exited(self) -> str:
+        returncode = await self.server.wait_process()
+        return f"代理进程已退出（退出码 {returncode}）"
+
+    async def _probe_until_hung(self) -> str:
+        """
+        定期发送存活探测，连续probe_failures次超时后返回。
+        """
+        if self.probe_interval <= 0:
+            await asyncio.Event().wait()
+        failures = 0
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await self.server.connection.request(
+                    self.probe_method, self.probe_params, timeout=self.probe_timeout
+                )
+                failures = 0
+            except RequestTimeoutError:
+                failures += 1
+                logger.warning("存活探测超时（%d/%d）", failures, self.probe_failures)
+                if failures >= self.probe_failures:
+                    return f"连续{failures}次存活探测超时"
+            except CodyPyError as exc:
+                # 代理能返回错误说明它仍在响应
+                logger.debug("存活探测返回错误: %r", exc)
+                failures = 0
+
+    async def _recover(self, reason: str) -> None:
+        """
+        按指数退避重启代理进程，直到恢复成功或超过重启次数上限。
+        """
+        logger.error("检测到代理故障: %s，正在重启", reason)
+        self.last_failure = reason
+        self.state = SupervisorState.RESTARTING
+        self._ready.clear()
+        started = time.monotonic()
+        backoff = self.backoff_initial
+        attempts = 0
+        while True:
+            try:
+                await self.server.restart(AgentCrashedError(f"Cody代理故障: {reason}"))
+                await self.agent.initialize_agent()
+                break
+            except Exception as exc:
+                attempts += 1
+                self.restart_failures += 1
+                self.last_failure = f"{reason}; 重启失败: {exc!r}"
+                if self.max_restarts is not None and attempts >= self.max_restarts:
+                    logger.error("代理连续%d次重启失败，放弃", attempts)
+                    self.state = SupervisorState.FAILED
+                    self._ready.set()
+                    return
+                delay = backoff * random.uniform(0.5, 1.5)
+                logger.warning("代理重启失败: %r，%.1f秒后重试", exc, delay)
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.backoff_max)
+
+        await self._restore_sessions()
+        self.restarts += 1
+        self.last_recovery_seconds = time.monotonic() - started
+        self.state = SupervisorState.RUNNING
+        self._ready.set()
+        logger.info("代理已在%.2f秒内恢复", self.last_recovery_seconds)
+
+    async def _restore_sessions(self) -> None:
+        """
+        在新进程上为每个会话重新创建聊天，并恢复仓库上下文和模型。
+        """
+        for session in self._all_sessions():
+            try:
+                await session.restore()
+            except CodyPyError as exc:
+                logger.warning("恢复聊天会话 %s 失败: %r", session.chat_id, exc)
+
+    def _all_sessions(self) -> list[ChatSession]:
+        """
+        返回所有登记的代理的会话。
+        """
+        return [session for agent in list(self._agents) for session in agent.sessions]
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回监督器的指标。
+        """
+        return {
+            "state": self.state.value,
+            "restarts": self.restarts,
+            "restart_failures": self.restart_failures,
+            "last_failure": self.last_failure,
+            "last_recovery_seconds": self.last_recovery_seconds,
+            "sessions": len(self._all_sessions()),
+        }
+
+    async def close(self, **shutdown_options: float) -> None:
+        """
+        停止监督并优雅地关闭代理进程。
+
+        参数:
+        shutdown_options: 传给CodyServer.cleanup_server的截止时间
+        """
+        self.state = SupervisorState.STOPPED
+        self._ready.set()
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+        await self.server.cleanup_server(**shutdown_options)
@@ -0,0 +1,109 @@
+from typing import Any, Dict
+
+from codypy.messaging import _context_file_ranges
+from codypy.protocol import ChatMessage, Transcript
+
+
+class TranscriptIndex:
+    """
+    一个聊天会话的增量transcript索引。
+
+    代理每次回答都返回完整的transcript，索引只处理上次之后新增的消息，
+    按轮次（从每条用户消息开始）保存去重后的上下文文件行范围，
+    因此查询某一轮或整个对话的上下文文件不需要重新遍历transcript，长对话的总开销是线性的。
+
+    最后一条消息在生成过程中仍会变化，它只作为暂定的部分参与查询，下一次更新时才正式计入。
+    """
+
+    def __init__(self) -> None:
+        self.processed: int = 0  # 当前transcript中已经正式计入的消息数
+        self._turns: list[Dict[str, None]] = []  # 每一轮去重后的上下文文件
+        self._all: Dict[str, None] = {}  # 整个对话去重后的上下文文件
+        self._last: ChatMessage | None = None  # 暂定的最后一条消息
+
+    def update(self, transcript: Transcript | None) -> None:
+        """
+        计入transcript中新增的消息。
+
+        参数:
+        transcript (Transcript | None): 代理返回的完整transcript
+        """
+        if transcript is None or not transcript.messages:
+            return
+        messages = transcript.messages
+        if len(messages) < self.processed:
+            # 聊天在代理中被重建，之后的transcript从头开始
+            self.rebase()
+        committed = len(messages) - 1
+        for index in range(self.processed, committed):
+            self._add(messages[index])
+        self.processed = max(self.processed, committed)
+        self._last = messages[-1]
+
+    def rebase(self) -> None:
+        """
+        表示聊天在代理中被重建（例如迁移到另一个进程），之后的transcript从第一条消息开始。
+        已经计入的轮次保留。
+        """
+        if self._last is not None:
+            self._add(self._last)
+        self.processed = 0
+        self._last = None
+
+    def _add(self, message: ChatMessage) -> None:
+        if self._starts_turn(message):
+            self._turns.append({})
+        ranges = dict.fromkeys(_context_file_ranges(message))
+        self._turns[-1].update(ranges)
+        self._all.update(ranges)
+
+    def _starts_turn(self, message: ChatMessage) -> bool:
+        return message.speaker == "human" or not self._turns
+
+    @property
+    def turns(self) -> int:
+        """对话的轮数，包括正在进行的一轮。"""
+        pending = self._last is not None and self._starts_turn(self._last)
+        return len(self._turns) + pending
+
+    def turn_context_files(self, turn: int = -1) -> list[str]:
+        """
+        返回某一轮对话的上下文文件。
+
+        参数:
+        turn (int): 轮次，从0开始，负数从最后一轮倒数
+
+        返回:
+        list[str]: 去重后的上下文文件，格式为"路径:起始行-结束行"
+
+        异常:
+        IndexError: 如果没有这一轮对话
+        """
+        count = self.turns
+        if count == 0:
+            return []
+        index = turn if turn >= 0 else count + turn
+        if not 0 <= index < count:
+            raise IndexError(f"没有第{turn}轮对话")
+        files = self._turns[index] if index < len(self._turns) else {}
+        if index == count - 1 and self._last is not None:
+            return list({**files, **dict.fromkeys(_context_file_ranges(self._last))})
+        return list(files)
+
+    def context_files(self) -> list[str]:
+        """
+        返回整个对话的上下文文件。
+
+        返回:
+        list[str]: 去重后的上下文文件，按第一次出现的顺序排列
+        """
+        if self._last is None:
+            return list(self._all)
+        return list({**self._all, **dict.fromkeys(_context_file_ranges(self._last))})
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "turns": self.turns,
+            "processed": self.processed,
+            "context_files": len(self._all),
+        }
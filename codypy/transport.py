@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import random
+from abc import ABC, abstractmethod
+from asyncio.subprocess import Process
+from typing import Any, Dict
+
+from codypy.config import Configs
+from codypy.exceptions import ServerConnectionError, ServerTCPConnectionError
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 等待代理开始监听的默认时间（秒）
+CONNECT_TIMEOUT = 30.0
+
+# 连接被拒绝后的重试等待时间（秒）：从几毫秒开始，带随机抖动地翻倍，直到上限
+CONNECT_BACKOFF_INITIAL = 0.005
+CONNECT_BACKOFF_MAX = 0.5
+
+StreamPair = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AgentTransport(ABC):
+    """
+    CodyServer与代理之间的传输接口。
+
+    传输决定代理进程的标准输入输出如何连接、需要哪些环境变量，以及如何得到交给
+    JsonRpcConnection的读写流。连接建立之后，上层的连接和消息处理对所有传输都是一样的。
+    """
+
+    # 是否由CodyServer启动代理进程。为False时连接到一个已经在运行的代理
+    spawn: bool = True
+
+    def environment(self) -> Dict[str, str]:
+        """
+        返回启动代理进程时额外设置的环境变量。
+        """
+        return {}
+
+    @abstractmethod
+    def process_stdio(self) -> Dict[str, Any]:
+        """
+        返回传给asyncio.create_subprocess_exec的stdin和stdout参数。
+        标准错误总是由AgentLog读取；不包含stdout时，标准输出也由AgentLog读取。
+        """
+
+    @abstractmethod
+    async def connect(self, process: Process | None) -> StreamPair:
+        """
+        连接到代理，返回读写流。
+
+        参数:
+            process (Process | None): 刚启动的代理进程，连接到已经在运行的代理时为None。
+
+        返回:
+            StreamPair: 读取代理消息的流和发往代理的流。
+
+        异常:
+            ServerConnectionError: 如果无法连接到代理。
+        """
+
+    @abstractmethod
+    def describe(self) -> str:
+        """
+        返回用于日志的端点描述。
+        """
+
+
+class StdioTransport(AgentTransport):
+    """
+    通过代理进程的标准输入输出通信，即"cody api jsonrpc-stdio"的默认方式。
+    """
+
+    def process_stdio(self) -> Dict[str, Any]:
+        return {"stdin": asyncio.subprocess.PIPE, "stdout": asyncio.subprocess.PIPE}
+
+    async def connect(self, process: Process | None) -> StreamPair:
+        if process is None:
+            raise ServerConnectionError("stdio传输需要由CodyServer启动代理进程")
+        return process.stdout, process.stdin
+
+    def describe(self) -> str:
+        return "stdio"
+
+
+class _SocketTransport(AgentTransport):
+    """
+    网络传输的公共部分：代理进程的标准输入输出不再用于通信，
+    连接在代理开始监听之后才能建立。
+
+    就绪探测不使用固定的等待时间，而是立即尝试连接，被拒绝后从几毫秒开始按指数退避
+    （带随机抖动）重试，因此代理一开始监听就能连上；代理进程提前退出时立即失败。
+    """
+
+    error_type: type = ServerConnectionError
+
+    def __init__(
+        self,
+        spawn: bool = True,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        backoff_initial: float = CONNECT_BACKOFF_INITIAL,
+        backoff_max: float = CONNECT_BACKOFF_MAX,
+    ) -> None:
+        """
+        参数:
+        spawn (bool): 是否由CodyServer启动代理进程，为False时连接到已经在运行的代理
+        connect_timeout (float): 等待代理开始监听的最长时间（秒）
+        backoff_initial (float): 第一次连接被拒绝后的等待时间（秒）
+        backoff_max (float): 重试等待时间的上限（秒）
+        """
+        self.spawn = spawn
+        self.connect_timeout = connect_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.attempts: int = 0  # 最近一次connect的连接尝试次数
+        self.ready_seconds: float | None = None  # 最近一次connect等待代理就绪所用的时间
+
+    def process_stdio(self) -> Dict[str, Any]:
+        # 代理不从标准输入读取消息，也不向标准输出写消息，不为它们创建管道
+        return {"stdin": asyncio.subprocess.DEVNULL}
+
+    @abstractmethod
+    async def _open(self) -> StreamPair:
+        """
+        尝试连接一次。
+        """
+
+    async def connect(self, process: Process | None) -> StreamPair:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.connect_timeout
+        backoff = self.backoff_initial
+        exited = asyncio.ensure_future(process.wait()) if process is not None else None
+        self.attempts = 0
+        try:
+            while True:
+                self.attempts += 1
+                try:
+                    streams = await self._open()
+                except OSError as exc:
+                    error = exc
+                else:
+                    self.ready_seconds = loop.time() - started
+                    logger.info(
+                        "已连接到%s（%d次尝试，%.3f秒）",
+                        self.describe(),
+                        self.attempts,
+                        self.ready_seconds,
+                    )
+                    return streams
+
+                if exited is not None and exited.done():
+                    raise self.error_type(
+                        f"代理进程在{self.describe()}开始监听之前退出（退出码 {exited.result()}）"
+                    ) from error
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    logger.debug(
+                        "%d次尝试后仍无法连接到%s", self.attempts, self.describe()
+                    )
+                    raise self.error_type(
+                        f"无法连接到{self.describe()}: {error}"
+                    ) from error
+                delay = min(random.uniform(backoff / 2, backoff), remaining)
+                if exited is not None:
+                    # 等待期间代理进程退出时立即醒来
+                    await asyncio.wait({exited}, timeout=delay)
+                else:
+                    await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.backoff_max)
+        finally:
+            if exited is not None and not exited.done():
+                exited.cancel()
+
+
+class TcpTransport(_SocketTransport):
+    """
+    通过TCP连接到代理。
+
+    启动代理进程时设置CODY_AGENT_DEBUG_REMOTE和CODY_AGENT_DEBUG_PORT，让代理在指定端口上监听。
+    端点默认为Configs.SERVER_ADDRESS。
+    """
+
+    error_type = ServerTCPConnectionError
+
+    def __init__(
+        self,
+        host: str | None = None,
+        port: int | None = None,
+        **options: Any,
+    ) -> None:
+        """
+        初始化TcpTransport实例。
+
+        参数:
+        host (str | None): 代理监听的地址，默认为Configs.SERVER_ADDRESS中的地址
+        port (int | None): 代理监听的端口，默认为Configs.SERVER_ADDRESS中的端口
+        options: spawn、connect_timeout、backoff_initial和backoff_max
+        """
+        super().__init__(**options)
+        default_host, default_port = Configs.SERVER_ADDRESS
+        self.host = default_host if host is None else host
+        self.port = default_port if port is None else port
+
+    def environment(self) -> Dict[str, str]:
+        return {
+            "CODY_AGENT_DEBUG_REMOTE": "true",
+            "CODY_AGENT_DEBUG_PORT": str(self.port),
+        }
+
+    async def _open(self) -> StreamPair:
+        return await asyncio.open_connection(self.host, self.port)
+
+    def describe(self) -> str:
+        return f"TCP {self.host}:{self.port}"
+
+
+class UnixSocketTransport(_SocketTransport):
+    """
+    通过Unix域套接字连接到代理。
+
+    Cody代理本身不在Unix域套接字上监听，因此默认不启动进程，而是连接到一个已经在运行、
+    在该路径上监听的代理（例如用socat转发的代理或codypy.fake_agent --socket）。
+    spawn为True时，由agent_args负责让启动的进程在该路径上监听。
+    """
+
+    def __init__(self, path: str, spawn: bool = False, **options: Any) -> None:
+        """
+        初始化UnixSocketTransport实例。
+
+        参数:
+        path (str): 套接字路径
+        spawn (bool): 是否由CodyServer启动代理进程，默认为False
+        options: connect_timeout、backoff_initial和backoff_max
+        """
+        super().__init__(spawn=spawn, **options)
+        self.path = path
+
+    async def _open(self) -> StreamPair:
+        return await asyncio.open_unix_connection(self.path)
+
+    def describe(self) -> str:
+        return f"Unix套接字 {self.path}"
+
+
+def uses_single_endpoint(server_options: Dict[str, Any]) -> bool:
+    """
+    判断CodyServer.init的参数是否让每个进程都使用同一个网络端点。
+    这样的参数不能用来启动多个代理进程。
+
+    参数:
+    server_options (Dict[str, Any]): 传给CodyServer.init的参数
+
+    返回:
+    bool: 使用网络传输时为True
+    """
+    transport = server_options.get("transport")
+    if transport is not None:
+        return not isinstance(transport, StdioTransport)
+    return bool(server_options.get("use_tcp"))
@@ -6,8 +6,7 @@ import tarfile
 import aiofiles
 import aiohttp
 
-from codypy.config import Configs
-from codypy.messaging import request_response
+from codypy.connection import JsonRpcConnection
 
 
 async def _get_platform_arch() -> str | None:
@@ -178,19 +177,11 @@ async def _download_binary_to_path(
 
 
 async def get_remote_repositories(
-    reader,
-    writer,
+    connection: JsonRpcConnection,
     id: str,
-    configs: Configs,
 ) -> Any:
-    return await request_response("chat/remoteRepos", id, reader, writer, configs)
+    return await connection.request("chat/remoteRepos", id)
 
 
-async def receive_webviewmessage(reader, writer, params, configs: Configs) -> Any:
-    return await request_response(
-        "webview/receiveMessage",
-        params,
-        reader,
-        writer,
-        configs,
-    )
+async def receive_webviewmessage(connection: JsonRpcConnection, params) -> Any:
+    return await connection.request("webview/receiveMessage", params)
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Set
+
+from codypy.agent import CodyAgent
+from codypy.client_info import AgentSpecs
+from codypy.exceptions import AgentConnectionClosedError
+from codypy.server import CodyServer, shutdown_servers
+from codypy.transport import uses_single_endpoint
+
+# 设置日志记录器
+logger = logging.getLogger(__name__)
+
+# 补充失败后的重试等待时间（秒），每次失败翻倍，直到上限
+REFILL_BACKOFF_INITIAL = 1.0
+REFILL_BACKOFF_MAX = 30.0
+
+# 计算启动耗时统计时保留的最近样本数
+SPAWN_SAMPLES = 100
+
+
+async def spawn_agent(
+    agent_specs: AgentSpecs,
+    cody_binary_file: str,
+    version: str,
+    **server_options: Any,
+) -> tuple[CodyServer, CodyAgent]:
+    """
+    启动一个代理进程并完成初始化和认证。
+
+    初始化失败时代理进程会被清理，异常会继续抛出。
+
+    参数:
+    agent_specs (AgentSpecs): 初始化使用的代理规格
+    cody_binary_file (str): Cody代理二进制文件的路径
+    version (str): Cody代理的版本
+    server_options: 传给CodyServer.init的其他参数
+
+    返回:
+    tuple[CodyServer, CodyAgent]: 已经启动的进程和在其上完成initialize_agent的代理
+    """
+    server = await CodyServer.init(cody_binary_file, version, **server_options)
+    agent = CodyAgent(server, agent_specs)
+    try:
+        await agent.initialize_agent()
+    except BaseException:
+        await server.cleanup_server()
+        raise
+    return server, agent
+
+
+@dataclass
+class WarmAgent:
+    """
+    一个已经启动、初始化并认证的备用代理。
+
+    属性:
+        server (CodyServer): 代理进程及其连接
+        agent (CodyAgent): 已完成initialize_agent的代理
+        spawn_seconds (float): 从开始启动到初始化完成所用的时间（秒）
+        ready_at (float): 初始化完成时的time.monotonic()
+    """
+
+    server: CodyServer
+    agent: CodyAgent
+    spawn_seconds: float
+    ready_at: float
+
+    @property
+    def alive(self) -> bool:
+        """代理的连接是否仍然可用。"""
+        connection = self.server.connection
+        return connection is not None and not connection.closed
+
+
+class WarmSpares:
+    """
+    预热的备用代理。
+
+    冷启动一个代理需要启动Node、激活扩展并完成一次认证往返，通常需要数秒。
+    WarmSpares在后台始终保持spares个已经初始化的代理，acquire()可以立即取走其中一个，
+    取走后会在后台补充新的代理，因此扩容或重启时不必等待冷启动。
+    """
+
+    def __init__(
+        self,
+        spares: int,
+        agent_specs: AgentSpecs,
+        cody_binary_file: str,
+        version: str,
+        **server_options: Any,
+    ) -> None:
+        """
+        初始化WarmSpares实例。调用start()后才开始启动代理。
+
+        参数:
+        spares (int): 保持的备用代理数，必须大于0
+        agent_specs (AgentSpecs): 初始化使用的代理规格
+        cody_binary_file (str): Cody代理二进制文件的路径
+        version (str): Cody代理的版本
+        server_options: 传给CodyServer.init的其他参数
+        """
+        if spares < 1:
+            raise ValueError("spares必须大于0")
+        if spares > 1 and uses_single_endpoint(server_options):
+            raise ValueError(
+                "网络传输下所有代理进程使用同一个端点，备用代理只支持stdio"
+            )
+        self.spares = spares
+        self.agent_specs = agent_specs
+        self.cody_binary_file = cody_binary_file
+        self.version = version
+        self.server_options = server_options
+        self._ready: Deque[WarmAgent] = deque()
+        self._spawning: Set[asyncio.Task] = set()
+        self._cleanup_tasks: Set[asyncio.Task] = set()
+        self._available = asyncio.Condition()
+        self._refill_task: asyncio.Task | None = None
+        self._wanted = asyncio.Event()
+        self._closed = False
+        # 最近一轮补充中最后一次启动失败的异常
+        self._spawn_error: Exception | None = None
+        self._failed_rounds: int = 0  # 有代理启动失败的补充轮数
+        self._spawn_samples: Deque[float] = deque(maxlen=SPAWN_SAMPLES)
+        self.spawned: int = 0  # 成功启动的代理数
+        self.failures: int = 0  # 启动或初始化失败的次数
+        self.warm_hits: int = 0  # acquire时直接取得备用代理的次数
+        self.cold_misses: int = 0  # acquire时没有备用代理、需要等待启动的次数
+
+    def start(self) -> None:
+        """
+        启动后台补充任务。重复调用不会创建第二个任务。
+        """
+        if self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill_loop())
+            self._wanted.set()
+
+    async def wait_ready(self, count: int | None = None) -> None:
+        """
+        等待至少count个备用代理就绪。
+
+        参数:
+        count (int | None): 需要就绪的代理数，默认为spares
+        """
+        count = self.spares if count is None else count
+        async with self._available:
+            await self._available.wait_for(lambda: len(self._ready) >= count)
+
+    async def acquire(self) -> WarmAgent:
+        """
+        取走一个备用代理，并在后台补充。
+
+        有就绪的备用代理时立即返回；否则等待后台正在启动的代理就绪。
+        已经断开的备用代理会被丢弃。
+
+        返回:
+        WarmAgent: 已经初始化的代理，之后由调用方负责清理
+
+        异常:
+        AgentConnectionClosedError: 如果WarmSpares已关闭
+        Exception: 如果等待期间后台启动代理失败、没有得到代理，抛出最后一次启动失败的异常
+        """
+        self.start()
+        warm = True
+        async with self._available:
+            while True:
+                if self._closed:
+                    raise AgentConnectionClosedError("备用代理已关闭")
+                while self._ready:
+                    spare = self._ready.popleft()
+                    if spare.alive:
+                        break
+                    logger.warning("备用代理在使用前已断开，已丢弃")
+                    self._discard(spare)
+                else:
+                    warm = False
+                    self._wanted.set()
+                    failed_rounds = self._failed_rounds
+                    await self._available.wait()
+                    if not self._ready and self._failed_rounds != failed_rounds:
+                        raise self._spawn_error
+                    continue
+                break
+        if warm:
+            self.warm_hits += 1
+        else:
+            self.cold_misses += 1
+        self._wanted.set()
+        logger.debug(
+            "取走一个备用代理（已就绪%.1f秒）", time.monotonic() - spare.ready_at
+        )
+        return spare
+
+    def _discard(self, spare: WarmAgent) -> None:
+        """
+        在后台清理一个已经断开的备用代理。
+        """
+        task = asyncio.create_task(spare.server.cleanup_server())
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
+
+    async def _refill_loop(self) -> None:
+        """
+        后台补充任务：每当备用代理不足时并行启动缺少的数量，失败后按指数退避重试。
+        """
+        backoff = REFILL_BACKOFF_INITIAL
+        while not self._closed:
+            await self._wanted.wait()
+            self._wanted.clear()
+            missing = self.spares - len(self._ready) - len(self._spawning)
+            if missing <= 0:
+                continue
+            tasks = [asyncio.create_task(self._spawn()) for _ in range(missing)]
+            for task in tasks:
+                self._spawning.add(task)
+                task.add_done_callback(self._spawning.discard)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                # 把失败告知正在等待的acquire，不让它们一直等到下一次补充成功
+                async with self._available:
+                    self._spawn_error = errors[-1]
+                    self._failed_rounds += 1
+                    self._available.notify_all()
+                logger.warning("补充备用代理失败，%.1f秒后重试", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, REFILL_BACKOFF_MAX)
+            else:
+                backoff = REFILL_BACKOFF_INITIAL
+            self._wanted.set()
+
+    async def _spawn(self) -> None:
+        """
+        启动一个代理，记录启动耗时，并把它放入就绪队列。
+        """
+        started = time.monotonic()
+        try:
+            server, agent = await spawn_agent(
+                self.agent_specs,
+                self.cody_binary_file,
+                self.version,
+                **self.server_options,
+            )
+        except Exception as exc:
+            self.failures += 1
+            logger.warning("启动备用代理失败: %r", exc)
+            raise
+        ready_at = time.monotonic()
+        spawn_seconds = ready_at - started
+        self.spawned += 1
+        self._spawn_samples.append(spawn_seconds)
+        logger.info("备用代理已就绪，启动耗时%.2f秒", spawn_seconds)
+        spare = WarmAgent(server, agent, spawn_seconds, ready_at)
+        self._spawning.discard(asyncio.current_task())
+        if self._closed:
+            await server.cleanup_server()
+            return
+        async with self._available:
+            self._ready.append(spare)
+            self._available.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        返回备用代理的指标。
+
+        返回:
+        Dict[str, Any]: 就绪和正在启动的代理数、命中次数，
+            以及最近SPAWN_SAMPLES次启动的耗时（秒）
+        """
+        samples = list(self._spawn_samples)
+        return {
+            "spares": self.spares,
+            "ready": len(self._ready),
+            "spawning": len(self._spawning),
+            "spawned": self.spawned,
+            "failures": self.failures,
+            "warm_hits": self.warm_hits,
+            "cold_misses": self.cold_misses,
+            "spawn_to_ready_last": samples[-1] if samples else None,
+            "spawn_to_ready_avg": sum(samples) / len(samples) if samples else None,
+            "spawn_to_ready_max": max(samples) if samples else None,
+        }
+
+    async def close(self, **shutdown_options: float) -> None:
+        """
+        停止补充，并并行关闭所有尚未被取走的备用代理。
+
+        参数:
+        shutdown_options: 传给CodyServer.cleanup_server的截止时间
+        """
+        self._closed = True
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+        for task in list(self._spawning):
+            task.cancel()
+        await asyncio.gather(
+            *(
+                task
+                for task in (self._refill_task, *self._spawning)
+                if task is not None
+            ),
+            return_exceptions=True,
+        )
+        async with self._available:
+            spares = list(self._ready)
+            self._ready.clear()
+            self._available.notify_all()
+        await asyncio.gather(
+            shutdown_servers((spare.server for spare in spares), **shutdown_options),
+            *self._cleanup_tasks,
+            return_exceptions=True,
+        )
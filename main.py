@@ -4,8 +4,8 @@ import os
 
 from dotenv import load_dotenv
 
-from codypy.agent import CodyAgent
-from codypy.client_info import AgentSpecs
+from codypy.agent import EXIT_COMMANDS, CodyAgent
+from codypy.client_info import AgentSpecs, ClientCapabilities
 from codypy.config import BLUE, GREEN, RESET
 from codypy.context import append_paths
 from codypy.server import CodyServer
@@ -45,6 +45,8 @@ async def main():
                 "customConfiguration": {},
                 "cody.experimental.symf.enabled": False,
             },
+            # 启用流式聊天，回答会在生成过程中逐段打印
+            capabilities=ClientCapabilities(chat="streaming"),
         )
 
         # 使用指定的agent_specs初始化CodyAgent
@@ -56,10 +58,10 @@ async def main():
         logger.info("--- 获取聊天模型 ---")
         models = await cody_agent.get_models(model_type="chat")
         logger.info("可用模型:")
-        for model in models["models"]:
-            logger.info("- %s (%s) by %s", model["title"], model["id"], model["provider"])
-            logger.info("  用途: %s", ", ".join(model["usage"]))
-            logger.info("  标签: %s", ", ".join(model["tags"]))
+        for model in models.models:
+            logger.info("- %s (%s) by %s", model.title, model.id, model.provider)
+            logger.info("  用途: %s", ", ".join(model.usage))
+            logger.info("  标签: %s", ", ".join(model.tags))
             logger.info("")
         # 创建新的聊天会话
         logger.info("--- 创建新聊天 ---")
@@ -83,19 +85,21 @@ async def main():
         logger.info("--- 发送消息（简短） ---")
         while True:
             message: str = input(f"{GREEN}人类:{RESET} ")
-            response, context_files_response = await cody_agent.chat(
+            if message in EXIT_COMMANDS:
+                break
+            print(f"{BLUE}助手{RESET}: ", end="", flush=True)
+            async for delta in cody_agent.chat_stream(
                 message=message,
                 enhanced_context=False,  # 设置为True以启用代码库感知
                 show_context_files=True,  # 设置为True以返回推断的上下文文件（可选范围）
                 context_files=context_file,  # 设置要提供上下文的文件列表
-            )
-            if response == "":
-                break
-            print(f"{BLUE}助手{RESET}: {response}\n")
+            ):
+                print(delta, end="", flush=True)
+            print("\n")
 
             # 打印上下文文件信息
             logger.info("--- 上下文文件 ---")
-            if context_files_response:
+            if context_files_response := cody_agent.last_context_files:
                 for context in context_files_response:
                     logger.info("文件: %s", context)
             else: